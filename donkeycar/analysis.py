@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Static analysis of the dataflow graph of the vehicle parts.
+
+Templates add many parts conditionally, which makes it easy to run parts
+whose outputs are never read, or to read channels which are never written
+and so are always None. The analysis only looks at the inputs, outputs and
+run conditions given to Vehicle.add().
+"""
+
+import logging
+from typing import List, NamedTuple, Tuple
+
+from .executor import holds_reference
+
+logger = logging.getLogger(__name__)
+
+
+class PartGraphReport(NamedTuple):
+    """
+    Findings of analyze_parts(). Parts are referred to by their index in the
+    parts list and channels by name.
+    """
+    # (part index, channel) of outputs which no part reads
+    unused_outputs: List[Tuple[int, str]]
+    # (part index, channel) of inputs which no part writes
+    unwritten_inputs: List[Tuple[int, str]]
+    # (reader index, channel, writer index) of channels read before their
+    # first writer ran in the tick, so the reader gets the previous value
+    read_before_write: List[Tuple[int, str, int]]
+    # (channel, writer indexes) of channels written by more than one part
+    write_conflicts: List[Tuple[str, List[int]]]
+    # indexes of parts which write all their outputs only to channels which
+    # are not read, directly or through other unused parts, and which don't
+    # declare side effects
+    unused_parts: List[int]
+    # indexes of parts which write into the memory directly, so channels
+    # they write can't be known
+    direct_writers: List[int]
+
+    def log(self, parts):
+        """
+        Log the findings, with the part names taken from the part entries.
+        """
+        def name(i):
+            return f"{parts[i]['part'].__class__.__name__}#{i}"
+
+        for i, channel in self.unused_outputs:
+            logger.info(f"Output '{channel}' of {name(i)} is never read")
+        direct = ', '.join(name(i) for i in self.direct_writers)
+        for i, channel in self.unwritten_inputs:
+            if direct:
+                logger.info(f"Input '{channel}' of {name(i)} is not an "
+                            f"output of any part, unless {direct} writes it")
+            else:
+                logger.warning(f"Input '{channel}' of {name(i)} is never "
+                               f"written and will always be None")
+        for reader, channel, writer in self.read_before_write:
+            logger.info(f"{name(reader)} reads '{channel}' before "
+                        f"{name(writer)} writes it, so it gets the value "
+                        f"of the previous loop")
+        for channel, writers in self.write_conflicts:
+            logger.warning(f"'{channel}' is written by "
+                           f"{', '.join(name(i) for i in writers)}")
+        for i in self.unused_parts:
+            logger.info(f"{name(i)} only writes outputs which are never read")
+
+
+def analyze_parts(parts, mem=None, written=()):
+    """
+    Analyze the dataflow between the parts of a vehicle.
+
+    :param parts:   list of part entries as created by Vehicle.add()
+    :param mem:     the vehicle memory; its current channels count as
+                    written and parts holding a reference to it are direct
+                    writers, which are assumed to write but not read
+                    channels
+    :param written: further channels which are written outside of the parts
+    :return:        PartGraphReport
+    """
+    external = set(written)
+    if mem is not None:
+        external.update(mem.keys())
+
+    readers = {}
+    writers = {}
+    direct_writers = []
+    for i, entry in enumerate(parts):
+        for channel in _reads(entry):
+            readers.setdefault(channel, []).append(i)
+        for channel in entry['outputs']:
+            writers.setdefault(channel, []).append(i)
+        if mem is not None and holds_reference(entry['part'], mem):
+            direct_writers.append(i)
+
+    unused_outputs = [(i, channel)
+                      for i, entry in enumerate(parts)
+                      for channel in entry['outputs']
+                      if channel not in readers]
+    unwritten_inputs = [(i, channel)
+                        for i, entry in enumerate(parts)
+                        for channel in _reads(entry)
+                        if channel not in writers and channel not in external]
+    read_before_write = [(i, channel, writers[channel][0])
+                         for i, entry in enumerate(parts)
+                         for channel in _reads(entry)
+                         if channel in writers and writers[channel][0] > i]
+    write_conflicts = [(channel, indexes)
+                       for channel, indexes in writers.items()
+                       if len(indexes) > 1]
+    return PartGraphReport(unused_outputs, unwritten_inputs,
+                           read_before_write, write_conflicts,
+                           _unused_parts(parts, readers), direct_writers)
+
+
+def _reads(entry):
+    reads = list(entry['inputs'])
+    if entry.get('run_condition'):
+        reads.append(entry['run_condition'])
+    return reads
+
+
+def _unused_parts(parts, readers):
+    """
+    Find parts whose outputs are all unread, repeatedly, as dropping such a
+    part can leave the outputs of the parts feeding it unread. Parts without
+    outputs are kept, as they run for their side effects, like actuators, as
+    well as parts with a true has_side_effects attribute, like the TubWriter.
+    """
+    readers = {channel: set(indexes) for channel, indexes in readers.items()}
+    unused = set()
+    changed = True
+    while changed:
+        changed = False
+        for i, entry in enumerate(parts):
+            if i in unused or not entry['outputs'] \
+                    or getattr(entry['part'], 'has_side_effects', False):
+                continue
+            if all(not readers.get(channel, set()) - unused
+                   for channel in entry['outputs']):
+                unused.add(i)
+                changed = True
+    return sorted(unused)
@@ -10,7 +10,7 @@ from progress.bar import IncrementalBar
 import donkeycar as dk
 from donkeycar.management.joystick_creator import CreateJoystick
 
-from donkeycar.utils import normalize_image, load_image, math
+from donkeycar.utils import load_image, math
 
 PACKAGE_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 TEMPLATES_PATH = os.path.join(PACKAGE_PATH, 'templates')
@@ -332,10 +332,13 @@ class ShowHistogram(BaseCommand):
 
         output = out or os.path.basename(tub_paths)
         path_list = tub_paths.split(",")
-        records = [record for path in path_list for record
-                   in Tub(path, read_only=True)]
-        df = pd.DataFrame(records)
-        df.drop(columns=["_index", "_timestamp_ms"], inplace=True)
+        frames = []
+        for path in path_list:
+            tub = Tub(path, read_only=True)
+            frames.append(tub.to_frame())
+            tub.close()
+        df = pd.concat(frames)
+        df.drop(columns=["_timestamp_ms"], inplace=True)
         # this prints it to screen
         if record_name is not None:
             df[record_name].hist(bins=50)
@@ -363,6 +366,88 @@ class ShowHistogram(BaseCommand):
         self.show_histogram(args.tub, args.record, args.out)
 
 
+class PackTub(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='tubpack',
+                                         usage='%(prog)s [options]')
+        parser.add_argument('--tub', nargs='+', required=True,
+                            help='paths to tubs')
+        parser.add_argument('--unpack', action='store_true', default=False,
+                            help='convert packed images back into files')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        from donkeycar.parts.tub_v2 import pack_images, unpack_images
+        args = self.parse_args(args)
+        convert = unpack_images if args.unpack else pack_images
+        for tub_path in args.tub:
+            count = convert(os.path.expanduser(tub_path))
+            print(f'{"Unpacked" if args.unpack else "Packed"} {count} images '
+                  f'of {tub_path}')
+
+
+class TubClean(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='tubclean',
+                                         usage='%(prog)s [options]')
+        parser.add_argument('--tub', nargs='+', required=True,
+                            help='paths to tubs')
+        parser.add_argument('--compact', action='store_true', default=False,
+                            help='remove deleted records and their images, '
+                                 'otherwise only show what would be removed')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        from donkeycar.parts.tub_compact import compact_tub, compaction_report
+        args = self.parse_args(args)
+        for tub_path in args.tub:
+            if args.compact:
+                kept, removed = compact_tub(tub_path)
+                print(f'Compacted {tub_path}: kept {kept} records, removed '
+                      f'{removed}')
+            else:
+                report = compaction_report(tub_path)
+                print(f'{tub_path}: {report["deleted"]} of '
+                      f'{report["records"]} records deleted, '
+                      f'{report["unreferenced_images"]} of '
+                      f'{report["image_files"] + report["packed_images"]} '
+                      f'images to remove. Run with --compact to remove them.')
+
+
+class CacheTubs(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='cache-tubs',
+                                         usage='%(prog)s [options]')
+        parser.add_argument('--tub', nargs='+', required=True,
+                            help='paths to tubs')
+        parser.add_argument('--config', default='./config.py', help=HELP_CONFIG)
+        parser.add_argument('--myconfig', default='./myconfig.py',
+                            help='file name of myconfig file, defaults to '
+                                 'myconfig.py')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='threads decoding the images, defaults to '
+                                 'one per core')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        from donkeycar.pipeline.frame_cache import build_frame_cache
+        args = self.parse_args(args)
+        cfg = load_config(args.config, args.myconfig)
+        if cfg is None:
+            return
+        for tub_path in args.tub:
+            cache = build_frame_cache(tub_path, cfg, args.workers)
+            count = cache.meta['records'] - len(cache.missing)
+            print(f'Cached {count} frames of shape {cache.frames.shape[1:]} '
+                  f'of {tub_path}')
+
+
 class ShowCnnActivations(BaseCommand):
 
     def __init__(self):
@@ -468,7 +553,7 @@ class ShowPredictionPlots(BaseCommand):
         output_names = list(model.output_shapes()[1].keys())
         for tub_record in records:
             input_dict = model.x_transform(
-                tub_record, lambda x: normalize_image(x))
+                tub_record, model.prepare_image)
             pilot_angle, pilot_throttle = \
                 model.inference_from_dict(input_dict)
             user_angle = tub_record.underlying['user/angle']
@@ -570,6 +655,45 @@ class Train(BaseCommand):
                          f"one of 'tensorflow' or 'pytorch'")
 
 
+class BenchLoop(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='bench-loop',
+                                         usage='%(prog)s [options]')
+        parser.add_argument('--tub', required=True, help='tub to replay')
+        parser.add_argument('--config', default='./config.py', help=HELP_CONFIG)
+        parser.add_argument('--myconfig', default='./myconfig.py',
+                            help='file name of myconfig file, defaults to '
+                                 'myconfig.py')
+        parser.add_argument('--template', default='complete',
+                            help='name or path of the car template, defaults '
+                                 'to complete')
+        parser.add_argument('--ticks', type=int, default=1000,
+                            help='number of loop ticks to run')
+        parser.add_argument('--hz', type=float, default=None,
+                            help='target loop rate, unthrottled if not given')
+        parser.add_argument('--model', default=None, help='pilot model to run')
+        parser.add_argument('--type', default=None, help='model type')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='maximum number of tub records to load')
+        parser.add_argument('--allocations', action='store_true',
+                            help='trace the memory allocated per tick with '
+                                 'tracemalloc, which slows the loop down')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        from donkeycar.management.bench import bench_loop, report
+        args = self.parse_args(args)
+        cfg = load_config(args.config, args.myconfig)
+        if cfg is None:
+            return
+        vehicle = bench_loop(cfg, args.tub, args.template, args.ticks,
+                             args.hz, args.model, args.type, args.limit,
+                             args.allocations)
+        report(vehicle)
+
+
 class ModelDatabase(BaseCommand):
 
     def parse_args(self, args):
@@ -608,12 +732,16 @@ def execute_from_command_line():
         'calibrate': CalibrateCar,
         'tubplot': ShowPredictionPlots,
         'tubhist': ShowHistogram,
+        'tubpack': PackTub,
+        'tubclean': TubClean,
+        'cache-tubs': CacheTubs,
         'makemovie': MakeMovieShell,
         'createjs': CreateJoystick,
         'cnnactivations': ShowCnnActivations,
         'update': UpdateCar,
         'train': Train,
         'models': ModelDatabase,
+        'bench-loop': BenchLoop,
         'ui': Gui,
     }
 
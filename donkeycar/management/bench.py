@@ -0,0 +1,281 @@
+"""
+Headless benchmark of the drive loop of a car template.
+
+The template builds its vehicle as usual, but hardware parts are swapped for
+stand-ins: cameras and controllers replay the records of a tub, actuators
+and the tub writer become null sinks. The loop then runs unthrottled or at a
+target rate for a number of ticks, and the throughput, the part latencies
+and the garbage collections are reported. Optionally the memory allocated in
+each tick is traced with tracemalloc, which slows the loop down.
+"""
+
+import gc
+import importlib.util
+import logging
+import os
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+
+from prettytable import PrettyTable
+
+import donkeycar as dk
+from donkeycar.parts.tub_v2 import Tub, TubWriter
+from donkeycar.utils import load_image
+from donkeycar.vehicle import PROFILE_PERCENTILES, Vehicle
+
+logger = logging.getLogger(__name__)
+
+# modules of parts which talk to hardware or the network
+STAND_IN_MODULES = (
+    'donkeycar.parts.actuator',
+    'donkeycar.parts.camera',
+    'donkeycar.parts.controller',
+    'donkeycar.parts.cv',
+    'donkeycar.parts.dgym',
+    'donkeycar.parts.imu',
+    'donkeycar.parts.led_status',
+    'donkeycar.parts.lidar',
+    'donkeycar.parts.oled',
+    'donkeycar.parts.robohat',
+    'donkeycar.parts.web_controller.web',
+)
+
+# channels written by the hardware parts, recorded under another name
+CHANNEL_ALIASES = {'user/steering': 'user/angle'}
+
+# hardware config flags which are switched off for the benchmark
+HARDWARE_FLAGS = ('DONKEY_GYM', 'USE_LIDAR', 'HAVE_TFMINI', 'HAVE_IMU',
+                  'HAVE_ODOM', 'HAVE_RGB_LED', 'HAVE_SOMBRERO',
+                  'USE_SSD1306_128_32', 'HAVE_MQTT_TELEMETRY',
+                  'PUB_CAMERA_IMAGES', 'HAVE_PERFMON', 'USE_FPV',
+                  'USE_JOYSTICK_AS_DEFAULT', 'USE_NETWORKED_JS')
+
+
+class TubPlayback:
+    """
+    Stand-in part which outputs the recorded values of the given channels,
+    one record per run, and starts over at the end of the records.
+    """
+    def __init__(self, records, outputs):
+        self.records = records
+        self.keys = [CHANNEL_ALIASES.get(key, key) for key in outputs]
+        self.index = 0
+
+    def run(self, *args):
+        record = self.records[self.index]
+        self.index = (self.index + 1) % len(self.records)
+        values = [record.get(key) for key in self.keys]
+        return values[0] if len(values) == 1 else values
+
+
+class NullSink:
+    """
+    Stand-in part which accepts any inputs and outputs nothing.
+    """
+    def run(self, *args):
+        return None
+
+
+def load_records(tub_path, cfg, limit=None):
+    """
+    Load records of a tub into memory with their images decoded, so the
+    playback does not measure the disk.
+    """
+    tub = Tub(os.path.expanduser(tub_path), read_only=True)
+    input_types = dict(zip(tub.manifest.inputs, tub.manifest.types))
+    records = []
+    for record in tub:
+        for key, value in record.items():
+            if input_types.get(key) == 'image_array':
+                record[key] = load_image(tub.image_source(value), cfg)
+        records.append(record)
+        if limit and len(records) >= limit:
+            break
+    tub.close()
+    if not records:
+        raise ValueError(f'No records in tub {tub_path}')
+    return records
+
+
+class BenchVehicle(Vehicle):
+    """
+    Vehicle which swaps hardware parts for stand-ins when they are added.
+    """
+    def __init__(self, records, mem=None, trace_allocations=False):
+        super().__init__(mem)
+        self.records = records
+        self.stand_ins = []
+        self.result = None
+        self.rate_hz = None
+        self.trace_allocations = trace_allocations
+        # per tick: peak bytes allocated on top of the memory at its start,
+        # and the bytes still allocated at its end
+        self.tick_peak_bytes = []
+        self.tick_retained_bytes = []
+
+    def stand_in(self, part, outputs):
+        """
+        Return the stand-in for a hardware part, or None if the part runs as
+        it is.
+        """
+        if isinstance(part, TubWriter):
+            return NullSink()
+        if part.__class__.__module__ in STAND_IN_MODULES:
+            return TubPlayback(self.records, outputs) if outputs \
+                else NullSink()
+        return None
+
+    def add(self, part, inputs=[], outputs=[], threaded=False, **kwargs):
+        stand_in = self.stand_in(part, outputs)
+        if stand_in is not None:
+            logger.info(f'Replacing {part.__class__.__name__} by '
+                        f'{stand_in.__class__.__name__}')
+            # release what the replaced part opened, like the tub files
+            shutdown = getattr(part, 'shutdown', None)
+            if shutdown:
+                shutdown()
+            self.stand_ins.append(part.__class__.__name__)
+            part, threaded = stand_in, False
+            kwargs.pop('process', None)
+        super().add(part, inputs=inputs, outputs=outputs, threaded=threaded,
+                    **kwargs)
+
+    def update_parts(self):
+        if not self.trace_allocations:
+            return super().update_parts()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        super().update_parts()
+        current, peak = tracemalloc.get_traced_memory()
+        # the peak shows allocations which are freed again within the tick
+        self.tick_peak_bytes.append(peak - before)
+        self.tick_retained_bytes.append(current - before)
+
+    def start(self, *args, **kwargs):
+        # the drivetrain is mocked, so consume what it would have consumed
+        self.add(NullSink(), inputs=['steering', 'throttle'])
+        gc.collect()
+        gc_before = [stats['collections'] for stats in gc.get_stats()]
+        if self.trace_allocations:
+            tracemalloc.start()
+        try:
+            self.result = super().start(*args, **kwargs)
+        finally:
+            if self.trace_allocations:
+                tracemalloc.stop()
+        self.gc_collections = [stats['collections'] - before for stats, before
+                               in zip(gc.get_stats(), gc_before)]
+        return self.result
+
+
+def load_template(template, make_vehicle=None):
+    """
+    Import a car template, either by name from the package templates or
+    from a path.
+
+    :param template:        template name or path to a template file
+    :param make_vehicle:    optional function which creates the vehicle
+                            when the template calls dk.vehicle.Vehicle()
+    :return:                the template module
+    """
+    path = os.path.expanduser(template)
+    if not os.path.exists(path):
+        templates = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.realpath(__file__))), 'templates')
+        path = os.path.join(templates, template + '.py')
+    spec = importlib.util.spec_from_file_location('bench_template', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if make_vehicle is not None:
+        # only the dk of the template module builds the given vehicle
+        module.dk = SimpleNamespace(**vars(dk))
+        module.dk.vehicle = SimpleNamespace(**vars(dk.vehicle))
+        module.dk.vehicle.Vehicle = make_vehicle
+    return module
+
+
+def bench_loop(cfg, tub_path, template='complete', ticks=1000, rate_hz=None,
+               model_path=None, model_type=None, limit=None,
+               trace_allocations=False):
+    """
+    Run the drive loop of a template headless over the records of a tub.
+
+    :param cfg:         car config
+    :param tub_path:    tub to replay
+    :param template:    template name or path to a template file, which has
+                        a drive(cfg, model_path, ...) function
+    :param ticks:       number of loop ticks
+    :param rate_hz:     target loop rate, unthrottled if None
+    :param model_path:  optional pilot model to run
+    :param model_type:  type of the pilot model
+    :param limit:       maximum number of tub records to load
+    :param trace_allocations:   trace the memory allocated in each tick
+    :return:            the benchmarked vehicle
+    """
+    records = load_records(tub_path, cfg, limit)
+    logger.info(f'Loaded {len(records)} records from {tub_path}')
+    for flag in HARDWARE_FLAGS:
+        if hasattr(cfg, flag):
+            setattr(cfg, flag, False)
+    cfg.CAMERA_TYPE = 'MOCK'
+    cfg.DRIVE_TRAIN_TYPE = 'MOCK'
+    cfg.MAX_LOOPS = ticks
+    if rate_hz:
+        cfg.DRIVE_LOOP_HZ = rate_hz
+    else:
+        # no sleeping, every tick starts right after the previous one
+        cfg.DRIVE_LOOP_HZ = 1e9
+        cfg.DRIVE_LOOP_OVERRUN = 'stretch'
+
+    vehicles = []
+
+    def make_vehicle(mem=None):
+        vehicles.append(BenchVehicle(records, mem, trace_allocations))
+        vehicles[-1].rate_hz = rate_hz
+        return vehicles[-1]
+
+    module = load_template(template, make_vehicle)
+    with tempfile.TemporaryDirectory() as data_path:
+        # the tub writer is replaced, but its tub is created before
+        cfg.DATA_PATH = data_path
+        cfg.AUTO_CREATE_NEW_TUB = False
+        module.drive(cfg, model_path=model_path, model_type=model_type)
+    if not vehicles or vehicles[0].result is None:
+        raise RuntimeError('The drive loop did not run')
+    return vehicles[0]
+
+
+def report(vehicle):
+    """
+    Print the loop throughput, part latencies, garbage collections and the
+    traced allocations.
+    """
+    loop_count, loop_time = vehicle.result
+    print(f'Replaced parts: {", ".join(vehicle.stand_ins) or "none"}')
+    throughput = f'{loop_count} ticks in {loop_time:.2f}s: ' \
+                 f'{loop_count / loop_time:.1f} ticks/s'
+    if vehicle.rate_hz:
+        throughput += f', {vehicle.scheduler.missed} missed deadlines at ' \
+                      f'{vehicle.rate_hz} Hz'
+    print(throughput)
+    print(f'gc collections per generation: {vehicle.gc_collections}')
+    if vehicle.tick_peak_bytes:
+        peaks = vehicle.tick_peak_bytes
+        print(f'Allocated per tick (tracemalloc): peak avg '
+              f'{sum(peaks) / len(peaks) / 1024:.1f} kB, max '
+              f'{max(peaks) / 1024:.1f} kB, retained '
+              f'{sum(vehicle.tick_retained_bytes) / 1024:.1f} kB over all '
+              f'ticks')
+    pt = PrettyTable()
+    pt.field_names = ['part', 'count', 'avg', 'max'] \
+        + [f'{p}%' for p in PROFILE_PERCENTILES]
+    for entry in vehicle.parts:
+        stats = vehicle.profiler.stats(entry['part'])
+        if stats['count'] == 0:
+            continue
+        row = [entry['part'].__class__.__name__, stats['count']]
+        row += ['%.3f' % stats[f] for f in pt.field_names[2:]]
+        pt.add_row(row)
+    print('Part latencies in ms:')
+    print(pt)
@@ -2,7 +2,8 @@ import tempfile
 
 from tensorflow.python.keras import activations
 from tensorflow.python.keras import backend as K
-from tensorflow.python.keras.models import load_model
+from tensorflow.python.keras.layers import Input
+from tensorflow.python.keras.models import clone_model, load_model
 import tensorflow as tf
 import cv2
 from matplotlib import cm
@@ -14,6 +15,8 @@ from donkeycar.utils import *
 
 
 DEG_TO_RAD = math.pi / 180.0
+# number of records which are read at once
+READ_BATCH = 100
 
 
 def apply_modifications(model, custom_objects=None):
@@ -113,11 +116,8 @@ class MakeMovie(object):
         num_frames = self.end_index - start
 
         # Move to the correct offset
-        self.current = 0
-        self.iterator = self.tub.__iter__()
-        while self.current < start:
-            self.iterator.next()
-            self.current += 1
+        self.current = start
+        self.iterator = self.read_records(start)
 
         self.scale = args.scale
         self.keras_part = None
@@ -133,6 +133,15 @@ class MakeMovie(object):
         clip = mpy.VideoClip(self.make_frame, duration=((num_frames - 1) / self.cfg.DRIVE_LOOP_HZ))
         clip.write_videofile(args.out, fps=self.cfg.DRIVE_LOOP_HZ)
 
+    def read_records(self, start):
+        '''
+        Yield the records from start to the end index, reading them in
+        batches of consecutive positions instead of all at once.
+        '''
+        for batch_start in range(start, self.end_index, READ_BATCH):
+            batch_end = min(batch_start + READ_BATCH, self.end_index)
+            yield from self.tub.read_many(range(batch_start, batch_end))
+
     @staticmethod
     def draw_line_into_image(angle, throttle, is_left, img, color):
         import cv2
@@ -196,7 +205,7 @@ class MakeMovie(object):
 
         if self.keras_part is None or type(self.keras_part) is not KerasCategorical:
             return        
-        pred_img = normalize_image(img)
+        pred_img = self.keras_part.prepare_image(img)
         angle_binned, _ = self.keras_part.interpreter.predict(pred_img, other_arr=None)
 
         x = 4
@@ -235,6 +244,14 @@ class MakeMovie(object):
             model.layers[li].activation = activations.linear
         # build salient model and optimizer
         sal_model = apply_modifications(model)
+        if sal_model.inputs[0].dtype == tf.uint8:
+            # there is no gradient through the cast to the uint8 input, so
+            # the image scaling layer of the clone gets the float image
+            float_model = clone_model(
+                sal_model,
+                input_tensors=Input(shape=sal_model.inputs[0].shape[1:]))
+            float_model.set_weights(sal_model.get_weights())
+            sal_model = float_model
         self.sal_model = sal_model
         return True
 
@@ -278,8 +295,8 @@ class MakeMovie(object):
             grey_img = rgb2gray(img)
             img = grey_img.reshape(grey_img.shape + (1,))
 
-        norm_img = normalize_image(img)
-        salient_mask = self.compute_visualisation_mask(norm_img)
+        model_img = self.keras_part.prepare_image(img)
+        salient_mask = self.compute_visualisation_mask(model_img)
         salient_mask_stacked = cm.inferno(salient_mask)[:,:,0:3]
         salient_mask_stacked = cv2.GaussianBlur(salient_mask_stacked,(3,3),cv2.BORDER_DEFAULT)
         blend = cv2.addWeighted(img.astype('float32'), alpha, salient_mask_stacked.astype('float32'), beta, 0)
@@ -296,8 +313,8 @@ class MakeMovie(object):
         if self.current >= self.end_index:
             return None
 
-        rec = self.iterator.next()
-        img_path = os.path.join(self.tub.images_base_path, rec['cam/image_array'])
+        rec = next(self.iterator)
+        img_path = self.tub.image_source(rec['cam/image_array'])
         image_input = img_to_arr(Image.open(img_path))
         image = image_input
         
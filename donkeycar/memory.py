@@ -5,6 +5,91 @@ Created on Sun Jun 25 11:07:48 2017
 
 @author: wroscoe
 """
+from collections.abc import MutableMapping
+from operator import itemgetter
+
+
+class SlotStore(MutableMapping):
+    """
+    A dictionary like store which keeps the values in a flat list. Every
+    channel name is resolved once to an integer slot, so readers and writers
+    which know their slots don't need any string keyed lookups. Channels
+    which are not yet known get a new slot when they are written.
+    """
+    def __init__(self, items=None, keys=()):
+        self.index = {}
+        self.values_list = []
+        for key in keys:
+            self.slot(key)
+        if items:
+            for key, value in items.items():
+                self[key] = value
+
+    def slot(self, key):
+        """
+        Return the slot of the channel, creating it if necessary. Newly
+        created slots hold None.
+        """
+        slot = self.index.get(key)
+        if slot is None:
+            slot = len(self.values_list)
+            self.index[key] = slot
+            self.values_list.append(None)
+        return slot
+
+    def getter(self, keys):
+        """
+        Return a function without arguments which returns the values of the
+        channels as a tuple.
+        """
+        values = self.values_list
+        slots = [self.slot(key) for key in keys]
+        if len(slots) == 0:
+            return tuple
+        if len(slots) == 1:
+            slot = slots[0]
+            return lambda: (values[slot],)
+        get = itemgetter(*slots)
+        return lambda: get(values)
+
+    def setter(self, keys):
+        """
+        Return a function which writes its argument into the channels, with
+        the same semantics as Memory.put().
+        """
+        values = self.values_list
+        slots = [self.slot(key) for key in keys]
+        if len(slots) == 1:
+            slot = slots[0]
+
+            def put(outputs):
+                values[slot] = outputs
+        else:
+            def put(outputs):
+                for i, slot in enumerate(slots):
+                    try:
+                        values[slot] = outputs[i]
+                    except IndexError as e:
+                        error = str(e) + ' issue with keys: ' + str(keys[i])
+                        raise IndexError(error)
+        return put
+
+    def __getitem__(self, key):
+        return self.values_list[self.index[key]]
+
+    def __setitem__(self, key, value):
+        self.values_list[self.slot(key)] = value
+
+    def __delitem__(self, key):
+        # slots are never reused, so compiled getters and setters stay valid
+        raise TypeError('Channels can not be removed from a SlotStore')
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
 
 class Memory:
     """
@@ -58,4 +143,21 @@ class Memory:
     
     def items(self):
         return self.d.items()
+
+    def compile(self, keys=()):
+        """
+        Switch the memory to a slot backed store, where each of the given
+        channels and all channels in the memory get an integer slot. The
+        memory API keeps working, but compiled getters and setters from the
+        returned store avoid string keyed lookups. Compiled channels which
+        were never written read as None.
+
+        :param keys:    channel names to assign slots to
+        :return:        the SlotStore backing the memory
+        """
+        if not isinstance(self.d, SlotStore):
+            self.d = SlotStore(self.d)
+        for key in keys:
+            self.d.slot(key)
+        return self.d
         
\ No newline at end of file
@@ -5,6 +5,7 @@ import numpy as np
 from PIL import Image
 import glob
 from donkeycar.utils import rgb2gray
+from donkeycar.utilities.handoff import LatestValue
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -15,6 +16,24 @@ class CameraError(Exception):
 
 
 class BaseCamera:
+    """
+    Frames assigned to self.frame are published through the LatestValue in
+    self.latest, so the vehicle can tell new frames from repeated ones. Set
+    self.frame only once per captured frame, with the final image.
+    """
+
+    @property
+    def frame(self):
+        latest = self.__dict__.get('latest')
+        return latest.value if latest is not None else None
+
+    @frame.setter
+    def frame(self, value):
+        latest = self.__dict__.get('latest')
+        if latest is None:
+            self.latest = LatestValue(value)
+        else:
+            latest.put(value)
 
     def run_threaded(self):
         return self.frame
@@ -62,9 +81,10 @@ class PiCamera(BaseCamera):
 
     def run(self):
         # grab the next frame from the camera buffer
-        self.frame = self.camera.capture_array("main")
+        frame = self.camera.capture_array("main")
         if self.image_d == 1:
-            self.frame = rgb2gray(self.frame)
+            frame = rgb2gray(frame)
+        self.frame = frame
 
         return self.frame
 
@@ -161,9 +181,10 @@ class Webcam(BaseCamera):
             snapshot = self.cam.get_image()
             if snapshot is not None:
                 snapshot1 = pygame.transform.scale(snapshot, self.resolution)
-                self.frame = pygame.surfarray.pixels3d(pygame.transform.rotate(pygame.transform.flip(snapshot1, True, False), 90))
+                frame = pygame.surfarray.pixels3d(pygame.transform.rotate(pygame.transform.flip(snapshot1, True, False), 90))
                 if self.image_d == 1:
-                    self.frame = rgb2gray(frame)
+                    frame = rgb2gray(frame)
+                self.frame = frame
 
         return self.frame
 
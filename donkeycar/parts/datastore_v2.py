@@ -1,11 +1,17 @@
 import atexit
 import json
+from bisect import bisect_left, bisect_right
+from itertools import groupby
 import mmap
 import os
+import struct
+import threading
 import time
 import logging
 from pathlib import Path
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
 NEWLINE = '\n'
@@ -55,7 +61,7 @@ class Seekable(object):
     def __enter__(self):
         return self
 
-    def writeline(self, contents):
+    def writeline(self, contents, flush=True):
         if self.method == 'r':
             raise RuntimeError(f'Seekable {self.file} is read-only.')
 
@@ -70,7 +76,18 @@ class Seekable(object):
         self.line_lengths.append(offset)
         self.cumulative_lengths.append(self.total_length)
         self.file.write(line)
+        if flush:
+            self.file.flush()
+
+    def flush(self):
+        self.file.flush()
+
+    def sync(self):
+        """
+        Flush and make sure the contents are on the disk.
+        """
         self.file.flush()
+        os.fsync(self.file.fileno())
 
     def _line_start_offset(self, line_number):
         return self._offset_until(line_number - 1)
@@ -138,6 +155,56 @@ class Seekable(object):
         self.close()
 
 
+class CatalogIndex(object):
+    '''
+    Append only binary index of a Catalog. It holds the end offset of each
+    line as a fixed width little endian uint64, so adding a record appends
+    8 bytes, no matter how long the catalog is.
+    '''
+    OFFSET = struct.Struct('<Q')
+
+    def __init__(self, catalog_path):
+        path = Path(catalog_path)
+        self.path = path.with_name(f'{path.stem}.catalog_index')
+        self.file = None
+
+    def read_offsets(self):
+        if not self.path.exists():
+            return []
+        data = self.path.read_bytes()
+        # ignore an entry which was only partially written
+        data = data[:len(data) - len(data) % self.OFFSET.size]
+        return [offset for offset, in self.OFFSET.iter_unpack(data)]
+
+    def append(self, offset, flush=True):
+        if self.file is None:
+            self.file = open(self.path, 'ab')
+        self.file.write(self.OFFSET.pack(offset))
+        if flush:
+            self.file.flush()
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def sync(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def rewrite(self, offsets):
+        if self.file is not None:
+            self.file.close()
+        with open(self.path, 'wb') as f:
+            f.write(b''.join(self.OFFSET.pack(o) for o in offsets))
+        self.file = None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
 class Catalog(object):
     '''
     A new line delimited file that has records delimited by newlines. \n
@@ -145,28 +212,81 @@ class Catalog(object):
     [ json object record ] \n
     [ json object record ] \n
     ...
+
+    The line offsets are kept in a CatalogIndex. If the index does not match
+    the catalog after a crash, it is rebuilt from the catalog, dropping a
+    partially written last line.
     '''
     def __init__(self, path, read_only=False, start_index=0):
         self.path = Path(os.path.expanduser(path))
         self.manifest = CatalogMetadata(self.path,
                                         read_only=read_only,
                                         start_index=start_index)
+        self.index = CatalogIndex(self.path)
+        offsets = self._read_offsets(read_only)
+        line_lengths = [end - start for start, end
+                        in zip([0] + offsets[:-1], offsets)]
         self.seekable = Seekable(self.path.as_posix(),
-                                 line_lengths=self.manifest.line_lengths(),
+                                 line_lengths=line_lengths,
                                  read_only=read_only)
+        if not offsets and not read_only and self.seekable.has_content():
+            # the catalog was scanned, store its offsets
+            self.index.rewrite(self.seekable.cumulative_lengths)
+
+    def _read_offsets(self, read_only):
+        """
+        Read the line offsets from the index, or return an empty list if they
+        need to be rebuilt from the catalog.
+        """
+        offsets = self.index.read_offsets()
+        legacy = not offsets and not self.index.path.exists()
+        if legacy:
+            # catalogs of older versions keep the line lengths in the
+            # catalog manifest
+            total = 0
+            for length in self.manifest.line_lengths():
+                total += length
+                offsets.append(total)
+        size = self.path.stat().st_size if self.path.exists() else 0
+        if (offsets[-1] if offsets else 0) == size:
+            if legacy and offsets and not read_only:
+                self.index.rewrite(offsets)
+            return offsets
+        logger.warning(f'Rebuilding index of catalog {self.path}')
+        if not read_only:
+            self._truncate_partial_line()
+        return []
+
+    def _truncate_partial_line(self):
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(NEWLINE.encode()) + 1
+            if end < len(data):
+                logger.warning(f'Dropping partially written record of '
+                               f'{self.path}')
+                f.truncate(end)
 
     def _exit_handler(self):
         self.close()
 
-    def write_record(self, record):
-        # Add record and update manifest
+    def write_record(self, record, flush=True):
+        # Add record and append its end offset to the index
         contents = json.dumps(record, allow_nan=False, sort_keys=True)
-        self.seekable.writeline(contents)
-        line_lengths = self.seekable.line_lengths
-        self.manifest.update_line_lengths(line_lengths)
+        self.seekable.writeline(contents, flush)
+        self.index.append(self.seekable.total_length, flush)
+
+    def flush(self):
+        # the catalog goes first, so the index never points past its end
+        self.seekable.flush()
+        self.index.flush()
+
+    def sync(self):
+        self.seekable.sync()
+        self.index.sync()
 
     def close(self):
         self.manifest.close()
+        self.index.close()
         self.seekable.close()
 
 
@@ -195,15 +315,13 @@ class CatalogMetadata(object):
             created_at = time.time()
             self.contents['created_at'] = created_at
             self.contents['start_index'] = start_index
+            # line offsets are kept in the catalog index, the empty list
+            # makes older versions scan the catalog instead
             self.contents['line_lengths'] = list()
             self._update()
 
-    def update_line_lengths(self, new_lengths):
-        self.contents['line_lengths'] = new_lengths
-        self._update()
-
     def line_lengths(self):
-        return self.contents['line_lengths']
+        return self.contents.get('line_lengths', [])
 
     def start_index(self):
         return self.contents['start_index']
@@ -217,6 +335,150 @@ class CatalogMetadata(object):
         self.seekeable.close()
 
 
+class IndexRuns(object):
+    '''
+    A set of record indexes stored as sorted, disjoint runs [start, end).
+    Deleted records usually come in blocks, so a tub with many deletions
+    has few runs. Besides the set operations it supports rank and select,
+    to map between record indexes and positions of the records which are
+    not in the set.
+    '''
+    def __init__(self, indexes=()):
+        self.starts = []
+        self.ends = []
+        self.count = 0
+        # number of indexes in the runs before each run, built on demand
+        self._before = None
+        self.update(indexes)
+
+    @classmethod
+    def from_runs(cls, runs):
+        index_runs = cls()
+        for start, end in runs:
+            index_runs.add_range(start, end)
+        return index_runs
+
+    def runs(self):
+        return [[start, end] for start, end in zip(self.starts, self.ends)]
+
+    @staticmethod
+    def _to_runs(indexes):
+        if isinstance(indexes, IndexRuns):
+            return list(zip(indexes.starts, indexes.ends))
+        if isinstance(indexes, range) and indexes.step == 1:
+            return [(indexes.start, indexes.stop)] if indexes else []
+        if isinstance(indexes, int):
+            indexes = [indexes]
+        runs = []
+        for index in sorted(set(indexes)):
+            if runs and runs[-1][1] == index:
+                runs[-1][1] = index + 1
+            else:
+                runs.append([index, index + 1])
+        return runs
+
+    def add_range(self, start, end):
+        if start >= end:
+            return
+        # runs which overlap or touch [start, end) are merged into it
+        first = bisect_left(self.ends, start)
+        last = bisect_right(self.starts, end)
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+        self.count += (end - start) - sum(
+            e - s for s, e in zip(self.starts[first:last],
+                                  self.ends[first:last]))
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+        self._before = None
+
+    def remove_range(self, start, end):
+        if start >= end:
+            return
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end)
+        if first >= last:
+            return
+        kept_starts, kept_ends = [], []
+        if self.starts[first] < start:
+            kept_starts.append(self.starts[first])
+            kept_ends.append(start)
+        if self.ends[last - 1] > end:
+            kept_starts.append(end)
+            kept_ends.append(self.ends[last - 1])
+        self.count -= sum(e - s for s, e in zip(self.starts[first:last],
+                                                self.ends[first:last])) \
+            - sum(e - s for s, e in zip(kept_starts, kept_ends))
+        self.starts[first:last] = kept_starts
+        self.ends[first:last] = kept_ends
+        self._before = None
+
+    def update(self, indexes):
+        for start, end in self._to_runs(indexes):
+            self.add_range(start, end)
+
+    def difference_update(self, indexes):
+        for start, end in self._to_runs(indexes):
+            self.remove_range(start, end)
+
+    def run_end(self, index):
+        '''
+        :return:    end of the run which contains index, or index if it is
+                    not in the set
+        '''
+        i = bisect_right(self.starts, index) - 1
+        return self.ends[i] if i >= 0 and index < self.ends[i] else index
+
+    def __contains__(self, index):
+        i = bisect_right(self.starts, index) - 1
+        return i >= 0 and index < self.ends[i]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            yield from range(start, end)
+
+    def __eq__(self, other):
+        if isinstance(other, IndexRuns):
+            return self.starts == other.starts and self.ends == other.ends
+        return set(self) == set(other)
+
+    def _counts_before(self):
+        if self._before is None:
+            self._before = [0]
+            for start, end in zip(self.starts, self.ends):
+                self._before.append(self._before[-1] + end - start)
+        return self._before
+
+    def rank(self, index):
+        '''
+        :return:    number of indexes in the set which are smaller than index
+        '''
+        i = bisect_right(self.starts, index) - 1
+        if i < 0:
+            return 0
+        return self._counts_before()[i] + min(index, self.ends[i]) \
+            - self.starts[i]
+
+    def select_missing(self, positions):
+        '''
+        Map positions among the indexes which are not in the set to the
+        indexes, i.e. the n-th index not in the set for each n.
+
+        :param positions:   iterable of non negative positions
+        :return:            list of indexes
+        '''
+        before = self._counts_before()
+        # number of indexes not in the set before each run
+        missing_before = [start - count
+                          for start, count in zip(self.starts, before)]
+        return [position + before[bisect_right(missing_before, position)]
+                for position in positions]
+
+
 class Manifest(object):
     '''
     A newline delimited file, with the following format.
@@ -226,10 +488,15 @@ class Manifest(object):
     [ json object with user metadata ]\n
     [ json object with manifest metadata ]\n
     [ json object with catalog metadata ]\n
+
+    The catalog metadata is flushed at most every flush_interval_s seconds
+    while records are written, and on close. After a crash the index of the
+    next record is recovered from the last catalog. Writing and deleting
+    records is thread safe.
     '''
 
     def __init__(self, base_path, inputs=[], types=[], metadata=[],
-                 max_len=1000, read_only=False):
+                 max_len=1000, read_only=False, flush_interval_s=1.0):
         self.base_path = Path(os.path.expanduser(base_path)).absolute()
         self.manifest_path = Path(os.path.join(self.base_path, 'manifest.json'))
         self.inputs = inputs
@@ -242,7 +509,13 @@ class Manifest(object):
         self.current_index = 0
         self.catalog_paths = list()
         self.catalog_metadata = dict()
-        self.deleted_indexes = set()
+        self.deleted_indexes = IndexRuns()
+        # read only catalogs for random access, by catalog number
+        self._readers = dict()
+        self.flush_interval_s = flush_interval_s
+        self._last_flush = time.monotonic()
+        self._is_dirty = False
+        self.lock = threading.RLock()
         self._updated_session = False
         self._is_closed = False
         has_catalogs = False
@@ -276,6 +549,7 @@ class Manifest(object):
             self.current_catalog = Catalog(last_known_catalog,
                                            read_only=self.read_only,
                                            start_index=self.current_index)
+            self._recover_current_index()
         # Create a new session_id, which will be added to each record in the
         # tub, when Tub.write_record() is called.
         self.session_id = self.create_new_session_id()
@@ -287,28 +561,40 @@ class Manifest(object):
         # Automatically save config when program ends
         atexit.register(exit_hook)
 
-    def write_record(self, record):
-        new_catalog = self.current_index > 0 \
-                      and (self.current_index % self.max_len) == 0
-        if new_catalog:
-            self._add_catalog()
-
-        self.current_catalog.write_record(record)
-        self.current_index += 1
-        # Update metadata to keep track of the last index
-        self._update_catalog_metadata(update=True)
-        # Set session_id update status to True if this method is called at
-        # least once. Then session id metadata  will be updated when the
-        # session gets closed
-        if not self._updated_session:
-            self._updated_session = True
+    def write_record(self, record, flush=True):
+        """
+        Append a record to the current catalog.
+
+        :param record:  the record
+        :param flush:   if the catalog files are flushed, otherwise the
+                        caller can write a batch of records and flush() once
+        """
+        with self.lock:
+            new_catalog = self.current_index > 0 \
+                          and (self.current_index % self.max_len) == 0
+            if new_catalog:
+                self._add_catalog()
+
+            self.current_catalog.write_record(record, flush)
+            self.current_index += 1
+            # Update metadata to keep track of the last index. It can be
+            # recovered from the catalogs, so it is only flushed periodically.
+            self._is_dirty = True
+            if flush:
+                self.flush()
+            # Set session_id update status to True if this method is called at
+            # least once. Then session id metadata  will be updated when the
+            # session gets closed
+            if not self._updated_session:
+                self._updated_session = True
 
     def delete_records(self, record_indexes):
         # Does not actually delete the record, but marks it as deleted.
         if isinstance(record_indexes, int):
             record_indexes = {record_indexes}
-        self.deleted_indexes.update(record_indexes)
-        self._update_catalog_metadata(update=True)
+        with self.lock:
+            self.deleted_indexes.update(record_indexes)
+            self._update_catalog_metadata(update=True)
         if record_indexes:
             logger.info(f'Deleting {len(record_indexes)} records: '
                         f'{min(record_indexes)} - {max(record_indexes)}')
@@ -317,8 +603,9 @@ class Manifest(object):
         # Does not actually delete the record, but marks it as deleted.
         if isinstance(record_indexes, int):
             record_indexes = {record_indexes}
-        self.deleted_indexes.difference_update(record_indexes)
-        self._update_catalog_metadata(update=True)
+        with self.lock:
+            self.deleted_indexes.difference_update(record_indexes)
+            self._update_catalog_metadata(update=True)
         if record_indexes:
             logger.info(f'Restored records {min(record_indexes)} - '
                         f'{max(record_indexes)}')
@@ -337,6 +624,42 @@ class Manifest(object):
         if current_catalog:
             current_catalog.close()
 
+    def _recover_current_index(self):
+        """
+        Set the index of the next record from the last catalog, in case the
+        catalog metadata was not flushed before a crash.
+        """
+        catalog = self.current_catalog
+        index = catalog.manifest.start_index() + catalog.seekable.lines()
+        if index > self.current_index:
+            logger.warning(f'Recovered {index - self.current_index} records '
+                           f'missing in the manifest of {self.base_path}')
+            self.current_index = index
+            if not self.read_only:
+                self._update_catalog_metadata(update=True)
+
+    def flush(self, force=False):
+        """
+        Flush the catalog and write pending changes of the catalog metadata,
+        if flush_interval_s passed since they were last written.
+
+        :param force:   if pending metadata is written in any case
+        """
+        with self.lock:
+            self.current_catalog.flush()
+            if self._is_dirty and (force or time.monotonic() - self._last_flush
+                                   >= self.flush_interval_s):
+                self._update_catalog_metadata(update=True)
+
+    def sync(self):
+        """
+        Flush and make sure catalog and manifest are on the disk.
+        """
+        with self.lock:
+            self.flush(force=True)
+            self.current_catalog.sync()
+            self.seekeable.sync()
+
     def _read_metadata(self, metadata=[]):
         self.metadata = dict()
         for kv in metadata:
@@ -369,7 +692,13 @@ class Manifest(object):
         self.catalog_paths = catalog_metadata['paths']
         self.current_index = catalog_metadata['current_index']
         self.max_len = catalog_metadata['max_len']
-        self.deleted_indexes = set(catalog_metadata['deleted_indexes'])
+        if 'deleted_runs' in catalog_metadata:
+            self.deleted_indexes = IndexRuns.from_runs(
+                catalog_metadata['deleted_runs'])
+        else:
+            # older versions store the list of all deleted indexes
+            self.deleted_indexes = IndexRuns(
+                catalog_metadata['deleted_indexes'])
 
     def _write_contents(self):
         self.seekeable.truncate_until_end(0)
@@ -387,9 +716,11 @@ class Manifest(object):
         catalog_metadata['paths'] = self.catalog_paths
         catalog_metadata['current_index'] = self.current_index
         catalog_metadata['max_len'] = self.max_len
-        catalog_metadata['deleted_indexes'] = sorted(list(self.deleted_indexes))
+        catalog_metadata['deleted_runs'] = self.deleted_indexes.runs()
         self.catalog_metadata = catalog_metadata
         self.seekeable.writeline(json.dumps(catalog_metadata))
+        self._is_dirty = False
+        self._last_flush = time.monotonic()
 
     def _update_session_info(self):
         """ Creates a new session id and appends it to the metadata."""
@@ -412,27 +743,102 @@ class Manifest(object):
     def add_deleted_indexes(self, indexes):
         if isinstance(indexes, int):
             indexes = {indexes}
-        self.deleted_indexes.update(indexes)
-        self._update_catalog_metadata(update=True)
+        with self.lock:
+            self.deleted_indexes.update(indexes)
+            self._update_catalog_metadata(update=True)
 
     def close(self):
         """ Closing tub closes open files for catalog, catalog manifest and
             manifest.json"""
         # If records were received, write updated session_id dictionary into
         # the metadata, otherwise keep the session_id information unchanged
-        if self._updated_session:
-            logger.info(f'Saving new session {self.session_id[1]}')
-            self._update_session_info()
-            self.write_metadata()
-        self.current_catalog.close()
-        self.seekeable.close()
-        self._is_closed = True
+        with self.lock:
+            if not self.read_only:
+                self.flush(force=True)
+            if self._updated_session:
+                logger.info(f'Saving new session {self.session_id[1]}')
+                self._update_session_info()
+                self.write_metadata()
+            self.current_catalog.close()
+            for catalog in self._readers.values():
+                catalog.close()
+            self._readers.clear()
+            self.seekeable.close()
+            self._is_closed = True
         logger.info(f'Closing manifest {self.base_path}')
 
     def write_metadata(self):
         self.seekeable.update_line(3, json.dumps(self.metadata))
         self.seekeable.update_line(4, json.dumps(self.manifest_metadata))
 
+    def record_indexes(self, positions):
+        """
+        Map positions of records, counting only the records which are not
+        deleted, to their record indexes.
+
+        :param positions:   iterable of positions in [0, len(manifest))
+        :return:            list of record indexes
+        """
+        with self.lock:
+            return self.deleted_indexes.select_missing(positions)
+
+    def read_records(self, indexes):
+        """
+        Read records by their record index, without checking if they are
+        deleted. The reads are grouped by catalog and each record is read
+        at its offset from the catalog index.
+
+        :param indexes: iterable of record indexes
+        :return:        list of records in the order of the indexes
+        """
+        indexes = list(indexes)
+        records = [None] * len(indexes)
+        order = sorted(range(len(indexes)), key=indexes.__getitem__)
+        with self.lock:
+            for catalog_number, group in groupby(
+                    order, key=lambda i: indexes[i] // self.max_len):
+                group = list(group)
+                lines = self._read_lines(catalog_number,
+                                         [indexes[i] for i in group])
+                for i, contents in zip(group, lines):
+                    records[i] = json.loads(contents)
+        return records
+
+    def _read_lines(self, catalog_number, indexes):
+        """
+        Read the catalog lines of sorted record indexes of one catalog.
+        """
+        if not 0 <= catalog_number < len(self.catalog_paths) \
+                or indexes[-1] >= self.current_index or indexes[0] < 0:
+            raise IndexError(f'Record indexes {indexes[0]} - {indexes[-1]} '
+                             f'out of range [0, {self.current_index})')
+        is_current = catalog_number == len(self.catalog_paths) - 1 \
+            and not self.read_only
+        if is_current:
+            catalog = self.current_catalog
+            catalog.seekable.flush()
+        else:
+            catalog = self._readers.get(catalog_number)
+            start_index = catalog_number * self.max_len
+            if catalog is None \
+                    or indexes[-1] - start_index >= catalog.seekable.lines():
+                # not opened yet, or the catalog has grown since
+                if catalog is not None:
+                    catalog.close()
+                catalog = Catalog(
+                    os.path.join(self.base_path,
+                                 self.catalog_paths[catalog_number]),
+                    read_only=True)
+                self._readers[catalog_number] = catalog
+        start_index = catalog.manifest.start_index()
+        lines = []
+        for index in indexes:
+            catalog.seekable.seek_line_start(index - start_index + 1)
+            lines.append(catalog.seekable.readline())
+        if is_current:
+            catalog.seekable.seek_end_of_file()
+        return lines
+
     def __iter__(self):
         return ManifestIterator(self)
 
@@ -477,7 +883,10 @@ class ManifestIterator(object):
                 current_index = self.current_index
                 self.current_index += 1
                 if current_index in self.manifest.deleted_indexes:
-                    # Skip over index, because it has been marked deleted
+                    # Skip over the whole run of deleted records, up to the
+                    # end of this catalog
+                    self._skip_to(
+                        self.manifest.deleted_indexes.run_end(current_index))
                     continue
                 else:
                     try:
@@ -490,7 +899,397 @@ class ManifestIterator(object):
                 self.current_catalog = None
                 self.current_catalog_index += 1
 
+    def _skip_to(self, index):
+        seekable = self.current_catalog.seekable
+        start_index = self.current_catalog.manifest.start_index()
+        index = min(index, start_index + seekable.lines())
+        if index > self.current_index:
+            seekable.seek_line_start(index - start_index + 1)
+            self.current_index = index
+
     next = __next__
 
     def __len__(self):
         return self.manifest.__len__()
+
+
+class ImageSegments(object):
+    '''
+    Encoded images of a tub, packed into one segment file per catalog
+    instead of one file per image. The images of catalog_<n> are appended
+    to images/catalog_<n>.images and each image adds a line
+
+    [ name ] [ offset ] [ length ] \n
+
+    to the text index images/catalog_<n>.images_index. The index is written
+    after the image, so after a crash it never points past the end of its
+    segment. Segments are read through mmap.
+    '''
+    SEGMENT = '.images'
+    INDEX = '.images_index'
+    _readers = dict()
+
+    def __init__(self, images_path, read_only=False):
+        self.path = Path(os.path.expanduser(images_path))
+        self.read_only = read_only
+        # image name -> (segment, offset, length)
+        self.locations = dict()
+        # segment -> number of index bytes which were read
+        self.index_sizes = dict()
+        self.maps = dict()
+        self.segment = None
+        self.data_file = None
+        self.index_file = None
+        self.lock = threading.Lock()
+        self._read_indexes()
+
+    @classmethod
+    def reader(cls, images_path):
+        '''
+        Shared read only segments of an images folder, for readers which only
+        know the path of the images, like the records of the training data.
+        '''
+        key = os.path.realpath(os.path.expanduser(images_path))
+        reader = cls._readers.get(key)
+        if reader is None:
+            reader = cls._readers[key] = ImageSegments(key, read_only=True)
+        return reader
+
+    @classmethod
+    def release(cls, images_path):
+        '''
+        Close the shared reader of an images folder, after its segments were
+        replaced.
+        '''
+        key = os.path.realpath(os.path.expanduser(images_path))
+        reader = cls._readers.pop(key, None)
+        if reader is not None:
+            reader.close()
+
+    @classmethod
+    def segment_name(cls, segment):
+        return f'catalog_{segment}'
+
+    def _segment_path(self, segment, suffix):
+        return self.path / f'{self.segment_name(segment)}{suffix}'
+
+    def has_segments(self):
+        return len(self.index_sizes) > 0
+
+    def _read_indexes(self):
+        if not self.path.is_dir():
+            return
+        for index_path in self.path.glob(f'*{self.INDEX}'):
+            segment = int(index_path.name[:-len(self.INDEX)].split('_')[-1])
+            self._read_index(segment)
+
+    def _read_index(self, segment):
+        '''
+        Read the index lines of a segment, which were added since the last
+        read. A partially written last line is ignored.
+        '''
+        start = self.index_sizes.get(segment, 0)
+        with open(self._segment_path(segment, self.INDEX), 'rb') as f:
+            f.seek(start)
+            data = f.read()
+        end = data.rfind(NEWLINE.encode()) + 1
+        for line in data[:end].decode().splitlines():
+            name, offset, length = line.rsplit(' ', 2)
+            self.locations[name] = (segment, int(offset), int(length))
+        self.index_sizes[segment] = start + end
+
+    def __contains__(self, name):
+        return name in self.locations
+
+    def read(self, name):
+        '''
+        Return the encoded image of the given name, or None if it is not in
+        a segment.
+        '''
+        location = self.locations.get(name)
+        if location is None and self.read_only and self.has_segments():
+            # the tub might be written while it is read
+            with self.lock:
+                self._read_indexes()
+            location = self.locations.get(name)
+        if location is None:
+            return None
+        segment, offset, length = location
+        if segment == self.segment and self.data_file is not None:
+            self.data_file.flush()
+        with self.lock:
+            data_map = self.maps.get(segment)
+            if data_map is None or offset + length > len(data_map):
+                if data_map is not None:
+                    data_map.close()
+                with open(self._segment_path(segment, self.SEGMENT),
+                          'rb') as f:
+                    data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[segment] = data_map
+            return data_map[offset:offset + length]
+
+    def append(self, segment, name, data, flush=True):
+        '''
+        Append an encoded image to a segment. Segments are written one after
+        the other, appending to an earlier segment closes the current one.
+        '''
+        if self.read_only:
+            raise RuntimeError(f'Cannot write images of read only tub '
+                               f'{self.path}')
+        if segment != self.segment:
+            self._open_segment(segment)
+        offset = self.data_file.tell()
+        self.data_file.write(data)
+        line = f'{name} {offset} {len(data)}{NEWLINE}'.encode()
+        self.index_file.write(line)
+        self.locations[name] = (segment, offset, len(data))
+        self.index_sizes[segment] = self.index_sizes.get(segment, 0) \
+            + len(line)
+        if flush:
+            self.flush()
+
+    def _open_segment(self, segment):
+        self._close_files()
+        self.path.mkdir(parents=True, exist_ok=True)
+        index_path = self._segment_path(segment, self.INDEX)
+        if index_path.exists():
+            # drop a partially written index line
+            with open(index_path, 'rb+') as f:
+                data = f.read()
+                f.truncate(data.rfind(NEWLINE.encode()) + 1)
+        self.data_file = open(self._segment_path(segment, self.SEGMENT), 'ab')
+        self.index_file = open(index_path, 'ab')
+        self.segment = segment
+
+    def flush(self):
+        # the images go first, so the index never points past their end
+        if self.data_file is not None:
+            self.data_file.flush()
+            self.index_file.flush()
+
+    def sync(self):
+        if self.data_file is not None:
+            self.flush()
+            os.fsync(self.data_file.fileno())
+            os.fsync(self.index_file.fileno())
+
+    def remove(self):
+        '''
+        Delete all segments and their indexes.
+        '''
+        self.close()
+        for segment in list(self.index_sizes):
+            for suffix in (self.SEGMENT, self.INDEX):
+                path = self._segment_path(segment, suffix)
+                if path.exists():
+                    path.unlink()
+        self.locations.clear()
+        self.index_sizes.clear()
+
+    def _close_files(self):
+        if self.data_file is not None:
+            self.data_file.close()
+            self.index_file.close()
+        self.data_file = self.index_file = None
+        self.segment = None
+
+    def close(self):
+        self._close_files()
+        with self.lock:
+            for data_map in self.maps.values():
+                data_map.close()
+            self.maps.clear()
+
+
+class ColumnStore(object):
+    '''
+    Typed column files of the numeric channels of a tub, which are appended
+    next to the json catalogs and memory mapped for analysis. Each channel
+    is a file of raw little endian values in the columns folder of the tub:
+    float channels as float32, int channels as int64, booleans as uint8 and
+    vector or list channels as rows of float32 of the width of the first
+    value. Row i holds record index i; missing floats are NaN, missing ints
+    and booleans are 0. The widths are kept in columns/columns.json.
+    '''
+    FOLDER = 'columns'
+    DTYPES = {'float': '<f4', 'int': '<i8', 'boolean': 'u1',
+              'vector': '<f4', 'list': '<f4'}
+    PRIVATE = {'_index': 'int', '_timestamp_ms': 'int'}
+
+    def __init__(self, base_path, inputs, types, read_only=False):
+        self.path = Path(os.path.expanduser(base_path)) / self.FOLDER
+        self.read_only = read_only
+        self.types = dict(self.PRIVATE)
+        self.types.update((key, input_type) for key, input_type
+                          in zip(inputs, types) if input_type in self.DTYPES)
+        self.files = dict()
+        self.meta = dict(widths=dict(), excluded=list())
+        meta_path = self.path / 'columns.json'
+        if meta_path.exists():
+            with open(meta_path) as f:
+                self.meta.update(json.load(f))
+        for key in self.meta['excluded']:
+            self.types.pop(key, None)
+        self.rows = min(self._rows(key) for key in self.types
+                        if self._stored(key))
+
+    @staticmethod
+    def file_name(key):
+        return key.replace('/', '_')
+
+    def _file_path(self, key):
+        return self.path / self.file_name(key)
+
+    def dtype(self, key):
+        return np.dtype(self.DTYPES[self.types[key]])
+
+    def width(self, key):
+        return self.meta['widths'].get(key, 1)
+
+    def _rows(self, key):
+        path = self._file_path(key)
+        if not path.exists():
+            return 0
+        return path.stat().st_size // (self.dtype(key).itemsize
+                                       * self.width(key))
+
+    def _is_vector(self, key):
+        return self.types[key] in ('vector', 'list')
+
+    def _stored(self, key):
+        # vector columns are stored from their first value, which gives the
+        # width of their rows
+        return not self._is_vector(key) or key in self.meta['widths']
+
+    def _column(self, key, values, width=None):
+        '''
+        Convert the values of a channel to the rows of its column file.
+        '''
+        dtype = self.dtype(key)
+        if not self._is_vector(key):
+            missing = np.nan if dtype.kind == 'f' else 0
+            return np.array([missing if v is None else v for v in values],
+                            dtype=dtype)
+        column = np.full((len(values), width or self.width(key)), np.nan,
+                         dtype=dtype)
+        for row, value in zip(column, values):
+            if value is not None:
+                # longer vectors are cut, shorter ones padded with NaN
+                value = value[:len(row)]
+                row[:len(value)] = value
+        return column
+
+    def append(self, records, flush=True):
+        '''
+        Append the rows of records, which have consecutive record indexes
+        starting at self.rows. Raises a ValueError if the first record is
+        not the next row.
+        '''
+        if self.read_only:
+            raise RuntimeError(f'Columns {self.path} are read-only.')
+        if not records:
+            return
+        if records[0].get('_index') != self.rows:
+            raise ValueError(f'Record index {records[0].get("_index")} does '
+                             f'not follow the {self.rows} rows of the '
+                             f'columns')
+        self.path.mkdir(exist_ok=True)
+        for key in list(self.types):
+            values = [record.get(key) for record in records]
+            padding = 0
+            if not self._stored(key):
+                first = next((v for v in values if v is not None), None)
+                if first is None:
+                    continue
+                self.meta['widths'][key] = len(first)
+                self._write_meta()
+                padding = self.rows
+            try:
+                column = self._column(key, [None] * padding + values)
+            except (TypeError, ValueError) as e:
+                logger.warning(f'Channel {key} is not stored as a column: {e}')
+                self._exclude(key)
+                continue
+            file = self.files.get(key)
+            if file is None:
+                file = self.files[key] = open(self._file_path(key), 'ab')
+            file.write(column.tobytes())
+        self.rows += len(records)
+        if flush:
+            self.flush()
+
+    def _exclude(self, key):
+        self.types.pop(key)
+        self.meta['excluded'].append(key)
+        file = self.files.pop(key, None)
+        if file is not None:
+            file.close()
+        if self._file_path(key).exists():
+            self._file_path(key).unlink()
+        self._write_meta()
+
+    def _write_meta(self):
+        self.path.mkdir(exist_ok=True)
+        with open(self.path / 'columns.json', 'w') as f:
+            json.dump(self.meta, f)
+
+    def truncate(self, rows):
+        '''
+        Drop the rows from the given row on, e.g. rows of records which did
+        not make it into the catalog before a crash.
+        '''
+        self.close()
+        for key in self.types:
+            path = self._file_path(key)
+            if path.exists():
+                with open(path, 'rb+') as f:
+                    f.truncate(rows * self.dtype(key).itemsize
+                               * self.width(key))
+        self.rows = min(self.rows, rows)
+
+    def read(self, key, records=None):
+        '''
+        :param key:     channel of the column
+        :param records: records which follow the stored rows, e.g. of a
+                        read-only tub whose columns are behind its catalogs;
+                        their rows are converted in memory and appended
+        :return:        array of the column with a row per record index and
+                        a second dimension for vectors. Without records it
+                        is a read-only memory map of the column file.
+        '''
+        if key not in self.types:
+            raise KeyError(f'{key} is no column, columns are '
+                           f'{sorted(self.types)}')
+        values = [record.get(key) for record in records or []]
+        width = self.width(key)
+        if not self._stored(key):
+            width = next((len(v) for v in values if v is not None), 1)
+        shape = (self.rows, width) if self._is_vector(key) else (self.rows,)
+        path = self._file_path(key)
+        if not self._stored(key):
+            column = np.full(shape, np.nan, dtype=self.dtype(key))
+        elif self.rows == 0 or not path.exists():
+            column = np.zeros(shape, dtype=self.dtype(key))
+        else:
+            # flush what was appended, the memory map reads the file
+            if key in self.files:
+                self.files[key].flush()
+            column = np.memmap(path, dtype=self.dtype(key), mode='r',
+                               shape=shape)
+        if not values:
+            return column
+        return np.concatenate([column, self._column(key, values, width)])
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+
+    def sync(self):
+        for file in self.files.values():
+            file.flush()
+            os.fsync(file.fileno())
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files.clear()
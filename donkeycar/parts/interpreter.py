@@ -2,7 +2,7 @@ import os
 from abc import ABC, abstractmethod
 import logging
 import numpy as np
-from typing import Union, Sequence, List
+from typing import Union, Sequence, List, Optional
 
 try:
     import tensorflow as tf
@@ -125,6 +125,10 @@ class Interpreter(ABC):
     def get_input_shape(self, input_name):
         pass
 
+    def get_input_dtype(self, input_name) -> Optional[np.dtype]:
+        """ Numpy type of a model input, None if it is not known """
+        return None
+
     def predict(self, img_arr: np.ndarray, *other_arr: np.ndarray) \
             -> Sequence[Union[float, np.ndarray]]:
         """
@@ -177,6 +181,13 @@ class KerasInterpreter(Interpreter):
         assert self.model, 'Model not set'
         return self.shapes[0][input_name]
 
+    def get_input_dtype(self, input_name):
+        assert self.model, 'Model not set'
+        inputs = dict(zip(self.input_keys, self.model.inputs))
+        if input_name not in inputs:
+            return None
+        return np.dtype(tf.as_dtype(inputs[input_name].dtype).as_numpy_dtype)
+
     def compile(self, **kwargs):
         assert self.model, 'Model not set'
         self.model.compile(**kwargs)
@@ -293,6 +304,7 @@ class TfLite(Interpreter):
         self.interpreter = None
         self.runner = None
         self.signatures = None
+        self.input_dtypes = None
     
     def load(self, model_path):
         assert os.path.splitext(model_path)[1] == '.tflite', \
@@ -305,13 +317,17 @@ class TfLite(Interpreter):
         self.runner = self.interpreter.get_signature_runner()
         self.input_keys = self.signatures['serving_default']['inputs']
         self.output_keys = self.signatures['serving_default']['outputs']
+        self.input_dtypes = {k: self.get_input_dtype(k)
+                             for k in self.input_keys}
 
     def compile(self, **kwargs):
         pass
 
     def predict_from_dict(self, input_dict):
         for k, v in input_dict.items():
-            input_dict[k] = self.expand_and_convert(v)
+            dtype = self.input_dtypes.get(k)
+            input_dict[k] = self.expand_and_convert(
+                v, np.float32 if dtype is None else dtype)
         outputs = self.runner(**input_dict)
         ret = list(outputs[k][0] for k in self.output_keys)
         return ret if len(ret) > 1 else ret[0]
@@ -324,12 +340,19 @@ class TfLite(Interpreter):
                 return detail['shape']
         raise RuntimeError(f'{input_name} not found in TFlite model')
 
+    def get_input_dtype(self, input_name):
+        assert self.interpreter is not None, "Need to load tflite model first"
+        for detail in self.interpreter.get_input_details():
+            if detail['name'] == f"serving_default_{input_name}:0":
+                return np.dtype(detail['dtype'])
+        return None
+
     @staticmethod
-    def expand_and_convert(arr):
+    def expand_and_convert(arr, dtype=np.float32):
         """ Helper function. """
         # expand each input to shape from [x, y, z] to [1, x, y, z] and
-        # convert to float32 for expression:
-        arr_exp = np.expand_dims(arr, axis=0).astype(np.float32)
+        # convert to the input type of the model, float32 or uint8:
+        arr_exp = np.expand_dims(arr, axis=0).astype(dtype, copy=False)
         return arr_exp
 
 
@@ -353,6 +376,12 @@ class TensorRT(Interpreter):
         assert self.graph_func, "Requires loadin the tensorrt model first"
         return self.graph_func.structured_input_signature[1][input_name].shape
 
+    def get_input_dtype(self, input_name):
+        if self.graph_func is None:
+            return None
+        spec = self.graph_func.structured_input_signature[1].get(input_name)
+        return None if spec is None else np.dtype(spec.dtype.as_numpy_dtype)
+
     def compile(self, **kwargs):
         pass
 
@@ -382,8 +411,10 @@ class TensorRT(Interpreter):
             logger.error(f'Could not load TensorRT model because: {e}')
 
     def predict_from_dict(self, input_dict):
+        signature = self.graph_func.structured_input_signature[1]
         for k, v in input_dict.items():
-            input_dict[k] = self.expand_and_convert(v)
+            dtype = signature[k].dtype if k in signature else tf.float32
+            input_dict[k] = self.expand_and_convert(v, dtype)
         out_list = self.graph_func(**input_dict)
         # Squeeze here because we send a batch of size one, so pick first
         # element. To return the order of outputs as defined in the model we
@@ -394,9 +425,11 @@ class TensorRT(Interpreter):
         return outputs if len(outputs) > 1 else outputs[0]
 
     @staticmethod
-    def expand_and_convert(arr):
+    def expand_and_convert(arr, dtype=None):
         """ Helper function. """
         # expand each input to shape from [x, y, z] to [1, x, y, z] and
-        # convert to float32 for expression:
+        # convert to the input type of the model, float32 or uint8:
         arr_exp = np.expand_dims(arr, axis=0)
-        return tf.convert_to_tensor(value=arr_exp, dtype=tf.float32)
+        dtype = tf.float32 if dtype is None else dtype
+        return tf.convert_to_tensor(value=arr_exp.astype(dtype.as_numpy_dtype,
+                                                         copy=False))
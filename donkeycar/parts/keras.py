@@ -26,7 +26,7 @@ try:
     from tensorflow.python.data.ops.dataset_ops import DatasetV1, DatasetV2
     from tensorflow.keras.layers import (Dense, Input, Convolution2D,
         MaxPooling2D, Activation, Dropout, Flatten, LSTM, BatchNormalization,
-        Conv3D, MaxPooling3D, Conv2DTranspose)
+        Conv3D, MaxPooling3D, Conv2DTranspose, Rescaling)
     from tensorflow.keras.layers import TimeDistributed as TD
     from tensorflow.keras.backend import concatenate
     from tensorflow.keras.models import Model
@@ -53,9 +53,12 @@ class KerasPilot(ABC):
     """
     def __init__(self,
                  interpreter: Interpreter = KerasInterpreter(),
-                 input_shape: Tuple[int, ...] = (120, 160, 3)) -> None:
+                 input_shape: Tuple[int, ...] = (120, 160, 3),
+                 uint8_input: bool = False) -> None:
         # self.model: Optional[Model] = None
         self.input_shape = input_shape
+        # if the model takes uint8 images and normalises them in the graph
+        self.uint8_input = uint8_input
         self.optimizer = "adam"
         self.interpreter = interpreter
         self.interpreter.set_model(self)
@@ -64,6 +67,10 @@ class KerasPilot(ABC):
     def load(self, model_path: str) -> None:
         logger.info(f'Loading model {model_path}')
         self.interpreter.load(model_path)
+        # feed the images the way the loaded model was built
+        dtype = self.interpreter.get_input_dtype('img_in')
+        if dtype is not None:
+            self.uint8_input = dtype == np.uint8
 
     def load_weights(self, model_path: str, by_name: bool = True) -> None:
         self.interpreter.load_weights(model_path, by_name=by_name)
@@ -96,6 +103,16 @@ class KerasPilot(ABC):
     def seq_size(self) -> int:
         return 0
 
+    def prepare_image(self, img_arr: np.ndarray) -> np.ndarray:
+        """
+        Converts a uint8 image into the model input. Models with uint8 input
+        normalise the image in the graph, so it is passed unchanged.
+
+        :param img_arr:     uint8 [0,255] numpy array with image data
+        :return:            the image or the [0,1] float32 image
+        """
+        return img_arr if self.uint8_input else normalize_image(img_arr)
+
     def run(self, img_arr: np.ndarray, *other_arr: List[float]) \
             -> Tuple[Union[float, np.ndarray], ...]:
         """
@@ -107,7 +124,7 @@ class KerasPilot(ABC):
                             state vector in the Behavioural model
         :return:            tuple of (angle, throttle)
         """
-        norm_img_arr = normalize_image(img_arr)
+        norm_img_arr = self.prepare_image(img_arr)
         np_other_array = tuple(np.array(arr) for arr in other_arr)
         # create dictionary on the fly, we expect the order of the arguments:
         # img_arr, *other_arr to exactly match the order of the
@@ -149,9 +166,11 @@ class KerasPilot(ABC):
               verbose: int = 1,
               min_delta: float = .0005,
               patience: int = 5,
-              show_plot: bool = False):
+              show_plot: bool = False,
+              extra_callbacks: Sequence['keras.callbacks.Callback'] = ()):
         """
-        trains the model
+        trains the model, extra_callbacks are passed to fit() next to early
+        stopping and checkpointing
         """
         assert isinstance(self.interpreter, KerasInterpreter)
         model = self.interpreter.model
@@ -164,7 +183,7 @@ class KerasPilot(ABC):
             ModelCheckpoint(monitor='val_loss',
                             filepath=model_path,
                             save_best_only=True,
-                            verbose=verbose)]
+                            verbose=verbose)] + list(extra_callbacks)
 
         tic = datetime.datetime.now()
         logger.info('////////// Starting training //////////')
@@ -240,9 +259,12 @@ class KerasPilot(ABC):
                                   f'pipeline')
 
     def output_types(self) -> Tuple[Dict[str, np.typename], ...]:
-        """ Used in tf.data, assume all types are doubles"""
+        """ Used in tf.data, assume all types are doubles, except for the
+        image which is float or uint8 """
         shapes = self.output_shapes()
         types = tuple({k: tf.float64 for k in d} for d in shapes)
+        if 'img_in' in types[0]:
+            types[0]['img_in'] = tf.uint8 if self.uint8_input else tf.float32
         return types
 
     def output_shapes(self):
@@ -270,12 +292,13 @@ class KerasCategorical(KerasPilot):
     def __init__(self,
                  interpreter: Interpreter = KerasInterpreter(),
                  input_shape: Tuple[int, ...] = (120, 160, 3),
-                 throttle_range: float = 0.5):
+                 throttle_range: float = 0.5,
+                 **kwargs):
         self.throttle_range = throttle_range
-        super().__init__(interpreter, input_shape)
+        super().__init__(interpreter, input_shape, **kwargs)
 
     def create_model(self):
-        return default_categorical(self.input_shape)
+        return default_categorical(self.input_shape, self.uint8_input)
 
     def compile(self):
         self.interpreter.compile(
@@ -324,12 +347,14 @@ class KerasLinear(KerasPilot):
     def __init__(self,
                  interpreter: Interpreter = KerasInterpreter(),
                  input_shape: Tuple[int, ...] = (120, 160, 3),
-                 num_outputs: int = 2):
+                 num_outputs: int = 2,
+                 **kwargs):
         self.num_outputs = num_outputs
-        super().__init__(interpreter, input_shape)
+        super().__init__(interpreter, input_shape, **kwargs)
 
     def create_model(self):
-        return default_n_linear(self.num_outputs, self.input_shape)
+        return default_n_linear(self.num_outputs, self.input_shape,
+                                self.uint8_input)
 
     def compile(self):
         self.interpreter.compile(optimizer=self.optimizer, loss='mse')
@@ -380,7 +405,8 @@ class KerasMemory(KerasLinear):
 
     def create_model(self):
         return default_memory(self.input_shape,
-                              self.mem_length, self.mem_depth)
+                              self.mem_length, self.mem_depth,
+                              self.uint8_input)
 
     def load(self, model_path: str) -> None:
         super().load(model_path)
@@ -396,7 +422,7 @@ class KerasMemory(KerasLinear):
             Tuple[Union[float, np.ndarray], ...]:
         # Only called at start to fill the previous values
         np_mem_arr = np.array(self.mem_seq).reshape((2 * self.mem_length,))
-        norm_img_arr = normalize_image(img_arr)
+        norm_img_arr = self.prepare_image(img_arr)
         # create dictionary on the fly, we expect the order of the arguments:
         # img_arr, *other_arr to exactly match the order of the
         # self.output_shape() first dictionary keys, because that's how we
@@ -451,11 +477,12 @@ class KerasMemory(KerasLinear):
 class KerasInferred(KerasPilot):
     def __init__(self,
                  interpreter: Interpreter = KerasInterpreter(),
-                 input_shape: Tuple[int, ...] = (120, 160, 3)):
-        super().__init__(interpreter, input_shape)
+                 input_shape: Tuple[int, ...] = (120, 160, 3),
+                 **kwargs):
+        super().__init__(interpreter, input_shape, **kwargs)
 
     def create_model(self):
-        return default_n_linear(1, self.input_shape)
+        return default_n_linear(1, self.input_shape, self.uint8_input)
 
     def compile(self):
         self.interpreter.compile(optimizer=self.optimizer, loss='mse')
@@ -489,15 +516,17 @@ class KerasIMU(KerasPilot):
     def __init__(self,
                  interpreter: Interpreter = KerasInterpreter(),
                  input_shape: Tuple[int, ...] = (120, 160, 3),
-                 num_outputs: int = 2, num_imu_inputs: int = 6):
+                 num_outputs: int = 2, num_imu_inputs: int = 6,
+                 **kwargs):
         self.num_outputs = num_outputs
         self.num_imu_inputs = num_imu_inputs
-        super().__init__(interpreter, input_shape)
+        super().__init__(interpreter, input_shape, **kwargs)
 
     def create_model(self):
         return default_imu(num_outputs=self.num_outputs,
                            num_imu_inputs=self.num_imu_inputs,
-                           input_shape=self.input_shape)
+                           input_shape=self.input_shape,
+                           uint8_input=self.uint8_input)
 
     def compile(self):
         self.interpreter.compile(optimizer=self.optimizer, loss='mse')
@@ -546,13 +575,15 @@ class KerasBehavioral(KerasCategorical):
                  interpreter: Interpreter = KerasInterpreter(),
                  input_shape: Tuple[int, ...] = (120, 160, 3),
                  throttle_range: float = 0.5,
-                 num_behavior_inputs: int = 2):
+                 num_behavior_inputs: int = 2,
+                 **kwargs):
         self.num_behavior_inputs = num_behavior_inputs
-        super().__init__(interpreter, input_shape, throttle_range)
+        super().__init__(interpreter, input_shape, throttle_range, **kwargs)
 
     def create_model(self):
         return default_bhv(num_bvh_inputs=self.num_behavior_inputs,
-                           input_shape=self.input_shape)
+                           input_shape=self.input_shape,
+                           uint8_input=self.uint8_input)
 
     def x_transform(
             self,
@@ -584,13 +615,15 @@ class KerasLocalizer(KerasPilot):
     def __init__(self,
                  interpreter: Interpreter = KerasInterpreter(),
                  input_shape: Tuple[int, ...] = (120, 160, 3),
-                 num_locations: int = 8):
+                 num_locations: int = 8,
+                 **kwargs):
         self.num_locations = num_locations
-        super().__init__(interpreter, input_shape)
+        super().__init__(interpreter, input_shape, **kwargs)
 
     def create_model(self):
         return default_loc(num_locations=self.num_locations,
-                           input_shape=self.input_shape)
+                           input_shape=self.input_shape,
+                           uint8_input=self.uint8_input)
 
     def compile(self):
         self.interpreter.compile(optimizer=self.optimizer, metrics=['acc'],
@@ -628,10 +661,11 @@ class KerasLSTM(KerasPilot):
                  interpreter: Interpreter = KerasInterpreter(),
                  input_shape: Tuple[int, ...] = (120, 160, 3),
                  seq_length=3,
-                 num_outputs=2):
+                 num_outputs=2,
+                 **kwargs):
         self.num_outputs = num_outputs
         self.seq_length = seq_length
-        super().__init__(interpreter, input_shape)
+        super().__init__(interpreter, input_shape, **kwargs)
         self.img_seq = deque()
         self.optimizer = "rmsprop"
 
@@ -641,7 +675,8 @@ class KerasLSTM(KerasPilot):
     def create_model(self):
         return rnn_lstm(seq_length=self.seq_length,
                         num_outputs=self.num_outputs,
-                        input_shape=self.input_shape)
+                        input_shape=self.input_shape,
+                        uint8_input=self.uint8_input)
 
     def compile(self):
         self.interpreter.compile(optimizer=self.optimizer, loss='mse')
@@ -679,7 +714,7 @@ class KerasLSTM(KerasPilot):
         self.img_seq.append(img_arr)
         new_shape = (self.seq_length, *self.input_shape)
         img_arr = np.array(self.img_seq).reshape(new_shape)
-        img_arr_norm = normalize_image(img_arr)
+        img_arr_norm = self.prepare_image(img_arr)
         input_dict = {'img_in': img_arr_norm}
         return self.inference_from_dict(input_dict)
 
@@ -707,10 +742,11 @@ class Keras3D_CNN(KerasPilot):
                  interpreter: Interpreter = KerasInterpreter(),
                  input_shape: Tuple[int, ...] = (120, 160, 3),
                  seq_length=20,
-                 num_outputs=2):
+                 num_outputs=2,
+                 **kwargs):
         self.num_outputs = num_outputs
         self.seq_length = seq_length
-        super().__init__(interpreter, input_shape)
+        super().__init__(interpreter, input_shape, **kwargs)
         self.img_seq = deque()
 
     def seq_size(self) -> int:
@@ -718,7 +754,8 @@ class Keras3D_CNN(KerasPilot):
 
     def create_model(self):
         return build_3d_cnn(self.input_shape, s=self.seq_length,
-                            num_outputs=self.num_outputs)
+                            num_outputs=self.num_outputs,
+                            uint8_input=self.uint8_input)
 
     def compile(self):
         self.interpreter.compile(loss='mse', optimizer=self.optimizer)
@@ -756,7 +793,7 @@ class Keras3D_CNN(KerasPilot):
         self.img_seq.append(img_arr)
         new_shape = (self.seq_length, *self.input_shape)
         img_arr = np.array(self.img_seq).reshape(new_shape)
-        img_arr_norm = normalize_image(img_arr)
+        img_arr_norm = self.prepare_image(img_arr)
         input_dict = {'img_in': img_arr_norm}
         return self.inference_from_dict(input_dict)
 
@@ -779,12 +816,14 @@ class KerasLatent(KerasPilot):
     def __init__(self,
                  interpreter: Interpreter = KerasInterpreter(),
                  input_shape: Tuple[int, ...] = (120, 160, 3),
-                 num_outputs: int = 2):
+                 num_outputs: int = 2,
+                 **kwargs):
         self.num_outputs = num_outputs
-        super().__init__(interpreter, input_shape)
+        super().__init__(interpreter, input_shape, **kwargs)
 
     def create_model(self):
-        return default_latent(self.num_outputs, self.input_shape)
+        return default_latent(self.num_outputs, self.input_shape,
+                              self.uint8_input)
 
     def compile(self):
         loss = {"img_out": "mse", "n_outputs0": "mse", "n_outputs1": "mse"}
@@ -843,10 +882,28 @@ def core_cnn_layers(img_in, drop, l4_stride=1):
     return x
 
 
-def default_n_linear(num_outputs, input_shape=(120, 160, 3)):
+def image_input(input_shape, uint8_input=False):
+    """
+    Creates the image input layer of a model. With uint8_input the model
+    takes uint8 images and scales them to [0, 1] in its first layer, which
+    carries through the TFLite and TensorRT conversion.
+
+    :param input_shape:     shape of the image input
+    :param uint8_input:     if the model takes uint8 images
+    :return:                tuple of the input layer and the [0, 1] image
+    """
+    if not uint8_input:
+        img_in = Input(shape=input_shape, name='img_in')
+        return img_in, img_in
+    img_in = Input(shape=input_shape, name='img_in', dtype='uint8')
+    return img_in, Rescaling(ONE_BYTE_SCALE, name='img_scale')(img_in)
+
+
+def default_n_linear(num_outputs, input_shape=(120, 160, 3),
+                     uint8_input=False):
     drop = 0.2
-    img_in = Input(shape=input_shape, name='img_in')
-    x = core_cnn_layers(img_in, drop)
+    img_in, x = image_input(input_shape, uint8_input)
+    x = core_cnn_layers(x, drop)
     x = Dense(100, activation='relu', name='dense_1')(x)
     x = Dropout(drop)(x)
     x = Dense(50, activation='relu', name='dense_2')(x)
@@ -861,13 +918,14 @@ def default_n_linear(num_outputs, input_shape=(120, 160, 3)):
     return model
 
 
-def default_memory(input_shape=(120, 160, 3), mem_length=3, mem_depth=0):
+def default_memory(input_shape=(120, 160, 3), mem_length=3, mem_depth=0,
+                   uint8_input=False):
     drop = 0.2
     drop2 = 0.1
     logger.info(f'Creating memory model with length {mem_length}, depth '
                 f'{mem_depth}')
-    img_in = Input(shape=input_shape, name='img_in')
-    x = core_cnn_layers(img_in, drop)
+    img_in, x = image_input(input_shape, uint8_input)
+    x = core_cnn_layers(x, drop)
     mem_in = Input(shape=(2 * mem_length,), name='mem_in')
     y = mem_in
     for i in range(mem_depth):
@@ -888,10 +946,10 @@ def default_memory(input_shape=(120, 160, 3), mem_length=3, mem_depth=0):
     return model
 
 
-def default_categorical(input_shape=(120, 160, 3)):
+def default_categorical(input_shape=(120, 160, 3), uint8_input=False):
     drop = 0.2
-    img_in = Input(shape=input_shape, name='img_in')
-    x = core_cnn_layers(img_in, drop, l4_stride=2)
+    img_in, x = image_input(input_shape, uint8_input)
+    x = core_cnn_layers(x, drop, l4_stride=2)
     x = Dense(100, activation='relu', name="dense_1")(x)
     x = Dropout(drop)(x)
     x = Dense(50, activation='relu', name="dense_2")(x)
@@ -906,12 +964,12 @@ def default_categorical(input_shape=(120, 160, 3)):
     return model
 
 
-def default_imu(num_outputs, num_imu_inputs, input_shape):
+def default_imu(num_outputs, num_imu_inputs, input_shape, uint8_input=False):
     drop = 0.2
-    img_in = Input(shape=input_shape, name='img_in')
+    img_in, x = image_input(input_shape, uint8_input)
     imu_in = Input(shape=(num_imu_inputs,), name="imu_in")
 
-    x = core_cnn_layers(img_in, drop)
+    x = core_cnn_layers(x, drop)
     x = Dense(100, activation='relu')(x)
     x = Dropout(.1)(x)
     
@@ -934,14 +992,14 @@ def default_imu(num_outputs, num_imu_inputs, input_shape):
     return model
 
 
-def default_bhv(num_bvh_inputs, input_shape):
+def default_bhv(num_bvh_inputs, input_shape, uint8_input=False):
     drop = 0.2
-    img_in = Input(shape=input_shape, name='img_in')
+    img_in, x = image_input(input_shape, uint8_input)
     # tensorflow is ordering the model inputs alphabetically in tensorrt,
     # so behavior must come after image, hence we put an x here in front.
     bvh_in = Input(shape=(num_bvh_inputs,), name="xbehavior_in")
 
-    x = core_cnn_layers(img_in, drop)
+    x = core_cnn_layers(x, drop)
     x = Dense(100, activation='relu')(x)
     x = Dropout(.1)(x)
     
@@ -966,11 +1024,11 @@ def default_bhv(num_bvh_inputs, input_shape):
     return model
 
 
-def default_loc(num_locations, input_shape):
+def default_loc(num_locations, input_shape, uint8_input=False):
     drop = 0.2
-    img_in = Input(shape=input_shape, name='img_in')
+    img_in, x = image_input(input_shape, uint8_input)
 
-    x = core_cnn_layers(img_in, drop)
+    x = core_cnn_layers(x, drop)
     x = Dense(100, activation='relu')(x)
     x = Dropout(drop)(x)
     
@@ -992,14 +1050,14 @@ def default_loc(num_locations, input_shape):
     return model
 
 
-def rnn_lstm(seq_length=3, num_outputs=2, input_shape=(120, 160, 3)):
+def rnn_lstm(seq_length=3, num_outputs=2, input_shape=(120, 160, 3),
+             uint8_input=False):
     # add sequence length dimensions as keras time-distributed expects shape
     # of (num_samples, seq_length, input_shape)
     img_seq_shape = (seq_length,) + input_shape
-    img_in = Input(shape=img_seq_shape, name='img_in')
+    img_in, x = image_input(img_seq_shape, uint8_input)
     drop_out = 0.3
 
-    x = img_in
     x = TD(Convolution2D(24, (5, 5), strides=(2, 2), activation='relu'))(x)
     x = TD(Dropout(drop_out))(x)
     x = TD(Convolution2D(32, (5, 5), strides=(2, 2), activation='relu'))(x)
@@ -1026,19 +1084,19 @@ def rnn_lstm(seq_length=3, num_outputs=2, input_shape=(120, 160, 3)):
     return model
 
 
-def build_3d_cnn(input_shape, s, num_outputs):
+def build_3d_cnn(input_shape, s, num_outputs, uint8_input=False):
     """
     Credit: https://github.com/jessecha/DNRacing/blob/master/3D_CNN_Model/model.py
 
     :param input_shape:     image input shape
     :param s:               sequence length
     :param num_outputs:     output dimension
+    :param uint8_input:     if the model takes uint8 images
     :return:                keras model
     """
     drop = 0.5
     input_shape = (s, ) + input_shape
-    img_in = Input(shape=input_shape, name='img_in')
-    x = img_in
+    img_in, x = image_input(input_shape, uint8_input)
     # Second layer
     x = Conv3D(
             filters=16, kernel_size=(3, 3, 3), strides=(1, 3, 3),
@@ -1085,13 +1143,12 @@ def build_3d_cnn(input_shape, s, num_outputs):
     return model
 
 
-def default_latent(num_outputs, input_shape):
+def default_latent(num_outputs, input_shape, uint8_input=False):
     # TODO: this auto-encoder should run the standard cnn in encoding and
     #  have corresponding decoder. Also outputs should be reversed with
     #  images at end.
     drop = 0.2
-    img_in = Input(shape=input_shape, name='img_in')
-    x = img_in
+    img_in, x = image_input(input_shape, uint8_input)
     x = Convolution2D(24, 5, strides=2, activation='relu', name="conv2d_1")(x)
     x = Dropout(drop)(x)
     x = Convolution2D(32, 5, strides=2, activation='relu', name="conv2d_2")(x)
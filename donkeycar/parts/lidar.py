@@ -14,6 +14,7 @@ import pickle
 import serial
 import numpy as np
 from donkeycar.utils import norm_deg, dist, deg2rad, arr_to_img
+from donkeycar.utilities.handoff import LatestValue
 from PIL import Image, ImageDraw
 
 logger = logging.getLogger("donkeycar.parts.lidar")
@@ -132,6 +133,10 @@ class RPLidar2(object):
         self.total_measurements = 0
         self.iter_measurements = self.lidar.iter_measurements()
         self.measurement_batch_ms = batch_ms
+        # snapshot of the measurements after each full scan for
+        # run_threaded(), so the drive loop never sees the buffer while
+        # poll() is changing it
+        self.latest = LatestValue([])
 
         self.running = True
 
@@ -148,6 +153,9 @@ class RPLidar2(object):
 
                 # check for start of new scan
                 if new_scan:
+                    # hand the completed scan to run_threaded(), one copy
+                    # of the buffer per scan
+                    self.latest.put(list(self.measurements), now)
                     self.full_scan_count += 1
                     self.full_scan_index = 0
                     self.measurement_count = self.measurement_index  # this full scan
@@ -185,11 +193,14 @@ class RPLidar2(object):
                         #       of measurements.  This list may include
                         #       measurements from the current full scan and
                         #       from the previous full scan.  So if
-                        #       run_threaded() is called rapidly
-                        #       (faster than the scan rate of the lidar),
-                        #       then the returned scans will have some new
-                        #       values and some values that may have been
-                        #       seen in the previous scan.  The scan:index
+                        #       run() is called rapidly (faster than the
+                        #       scan rate of the lidar), then the returned
+                        #       scans will have some new values and some
+                        #       values that may have been seen in the
+                        #       previous scan.  run_threaded() returns the
+                        #       buffer as of the last completed scan, so it
+                        #       repeats a scan until the next one completes.
+                        #       The scan:index
                         #       pair can be used to
                         #       to 'diff' scans to see which measurements
                         #       are are 'new' and which measurements are
@@ -236,7 +247,7 @@ class RPLidar2(object):
 
     def run_threaded(self):
         if self.running:
-            return self.measurements
+            return self.latest.value
         return []
     
     def run(self):
@@ -5,7 +5,7 @@ from donkeycar.utils import train_test_split
 from donkeycar.parts.tub_v2 import Tub
 from torchvision import transforms
 from typing import List, Any
-from donkeycar.pipeline.types import TubRecord, TubDataset
+from donkeycar.pipeline.types import ImageCache, TubRecord, TubDataset
 from donkeycar.pipeline.sequence import TubSequence
 import pytorch_lightning as pl
 
@@ -134,10 +134,12 @@ class TorchTubDataModule(pl.LightningDataModule):
                                         and trainer.test. Defaults to None.
         """
         # Loop through all the different tubs and load all the records for each of them
+        image_cache = ImageCache.from_config(self.config)
         for tub in self.tubs:
             for underlying in tub:
                 record = TubRecord(self.config, tub.base_path,
-                                   underlying=underlying)
+                                   underlying=underlying,
+                                   image_cache=image_cache)
                 self.records.append(record)
 
         train_records, val_records = train_test_split(
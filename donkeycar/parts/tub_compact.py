@@ -0,0 +1,215 @@
+"""
+Compaction of tubs, which removes deleted records from the catalogs and
+their images from disk.
+"""
+
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from donkeycar.parts.datastore_v2 import ColumnStore, ImageSegments, \
+    Manifest
+from donkeycar.parts.tub_index import INDEX_FOLDER
+from donkeycar.parts.tub_v2 import ORIGINAL_INDEXES, Tub
+from donkeycar.pipeline.frame_cache import FRAME_FOLDER
+
+logger = logging.getLogger(__name__)
+
+# folder in the tub, where the compacted tub is prepared
+STAGING = 'compaction'
+IMAGE_TYPES = ('image_array', 'gray16_array')
+
+
+def _image_keys(manifest):
+    return [key for key, input_type in zip(manifest.inputs, manifest.types)
+            if input_type in IMAGE_TYPES]
+
+
+def _record_chunks(manifest):
+    """
+    Yield the records which are not deleted, one list per catalog.
+    """
+    for start in range(0, manifest.current_index, manifest.max_len):
+        end = min(start + manifest.max_len, manifest.current_index)
+        indexes = [i for i in range(start, end)
+                   if i not in manifest.deleted_indexes]
+        yield manifest.read_records(indexes)
+
+
+def _mark(path, contents=''):
+    with open(path, 'w') as f:
+        f.write(contents)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def compaction_report(tub_path):
+    """
+    Count what compacting a tub would remove.
+
+    :param tub_path:    path of the tub
+    :return:            dict with the number of records, deleted records,
+                        image files and packed images, and of the images
+                        which no record refers to
+    """
+    tub = Tub(os.path.expanduser(tub_path), read_only=True)
+    try:
+        image_keys = _image_keys(tub.manifest)
+        referenced = set()
+        for records in _record_chunks(tub.manifest):
+            referenced.update(record[key] for record in records
+                              for key in image_keys if record.get(key))
+        files = [name for name in os.listdir(tub.images_base_path)
+                 if not name.startswith('catalog_')]
+        packed = list(tub.images.locations)
+        return {'records': tub.manifest.current_index,
+                'deleted': len(tub.manifest.deleted_indexes),
+                'image_files': len(files),
+                'packed_images': len(packed),
+                'unreferenced_images':
+                    len(set(files + packed) - referenced)}
+    finally:
+        tub.close()
+
+
+def compact_tub(tub_path):
+    """
+    Rewrite a tub without its deleted records. The records are renumbered
+    and their images renamed to match. The index each record had when it
+    was recorded is kept in original_indexes.npy, see
+    Tub.original_indexes(). Images of deleted records and images which no
+    record refers to are removed; packed images stay packed.
+
+    The compacted tub is first written to a staging folder in the tub, which
+    is restarted from scratch if it was interrupted. Then the files are
+    swapped in steps which are recorded in the staging folder, so an
+    interrupted swap is resumed by calling compact_tub() again.
+
+    :param tub_path:    path of the tub
+    :return:            tuple of the number of kept and removed records
+    """
+    tub_path = Path(os.path.expanduser(tub_path)).absolute()
+    staging = tub_path / STAGING
+    if not (staging / 'staged').exists():
+        if staging.exists():
+            logger.info(f'Restarting interrupted compaction of {tub_path}')
+            shutil.rmtree(staging)
+        _stage(tub_path, staging)
+    else:
+        logger.info(f'Resuming interrupted compaction of {tub_path}')
+    info = json.loads((staging / 'staged').read_text())
+    _swap(tub_path, staging, info)
+    logger.info(f'Compacted {tub_path}: kept {info["kept"]} records, '
+                f'removed {info["removed"]}')
+    return info['kept'], info['removed']
+
+
+def _stage(tub_path, staging):
+    """
+    Write the records which are not deleted into a new tub in the staging
+    folder. Packed images are copied into new segments, image files are only
+    listed for renaming.
+    """
+    tub = Tub(tub_path.as_posix(), read_only=True)
+    manifest = tub.manifest
+    original_indexes = tub._original_indexes()
+    image_keys = _image_keys(manifest)
+    compacted = Manifest(staging, inputs=manifest.inputs,
+                         types=manifest.types, max_len=manifest.max_len)
+    segments = ImageSegments(staging / Tub.images())
+    columns = ColumnStore(staging, manifest.inputs, manifest.types)
+    renames = []
+    kept_originals = []
+    missing = 0
+    try:
+        for records in _record_chunks(manifest):
+            for record in records:
+                index = compacted.current_index
+                kept_originals.append(int(original_indexes[record['_index']]))
+                for key in image_keys:
+                    name = record.get(key)
+                    if not name:
+                        continue
+                    new_name = Tub._image_file_name(index, key,
+                                                    os.path.splitext(name)[1])
+                    data = tub.images.read(name)
+                    if data is not None:
+                        segments.append(index // manifest.max_len, new_name,
+                                        data, flush=False)
+                    elif os.path.exists(os.path.join(tub.images_base_path,
+                                                     name)):
+                        renames.append((name, new_name))
+                    else:
+                        missing += 1
+                    record[key] = new_name
+                record['_index'] = index
+                compacted.write_record(record, flush=False)
+            columns.append(records, flush=False)
+        segments.sync()
+        columns.sync()
+        # keep the sessions and metadata of the tub, compacting is no session
+        compacted.metadata = manifest.metadata
+        compacted.manifest_metadata = manifest.manifest_metadata
+        compacted._updated_session = False
+        compacted.write_metadata()
+        compacted.sync()
+    finally:
+        segments.close()
+        columns.close()
+        compacted.close()
+        tub.close()
+    if missing:
+        logger.warning(f'{missing} images of {tub_path} are missing')
+    # the last entry continues the numbering for new records
+    np.save(staging / ORIGINAL_INDEXES,
+            np.array(kept_originals + [int(original_indexes[-1])],
+                     dtype=np.int64))
+    removed = manifest.current_index - len(kept_originals)
+    _mark(staging / 'staged', json.dumps({'kept': len(kept_originals),
+                                          'removed': removed,
+                                          'renames': renames}))
+
+
+def _swap(tub_path, staging, info):
+    """
+    Replace the catalogs and images of the tub with the staged ones. Each
+    step is either repeatable or recorded as done.
+    """
+    images = tub_path / Tub.images()
+    staged_images = staging / Tub.images()
+    staged_images.mkdir(exist_ok=True)
+    if not (staging / 'moved').exists():
+        # image files of kept records are moved to the staging folder under
+        # their new names, which could clash with old names in the tub
+        for name, new_name in info['renames']:
+            if (images / name).exists():
+                os.replace(images / name, staged_images / new_name)
+        _mark(staging / 'moved')
+    if not (staging / 'cleared').exists():
+        # what's left are images of deleted records, unreferenced images and
+        # the old segments
+        for path in images.iterdir():
+            if path.is_file():
+                path.unlink()
+        for path in tub_path.glob('catalog_*'):
+            path.unlink()
+        shutil.rmtree(tub_path / INDEX_FOLDER, ignore_errors=True)
+        shutil.rmtree(tub_path / ColumnStore.FOLDER, ignore_errors=True)
+        # the frames are stored by record index, which changed
+        shutil.rmtree(tub_path / FRAME_FOLDER, ignore_errors=True)
+        _mark(staging / 'cleared')
+    for path in staged_images.iterdir():
+        os.replace(path, images / path.name)
+    if (staging / ColumnStore.FOLDER).exists():
+        os.replace(staging / ColumnStore.FOLDER, tub_path / ColumnStore.FOLDER)
+    for path in staging.glob('catalog_*'):
+        os.replace(path, tub_path / path.name)
+    for name in (ORIGINAL_INDEXES, 'manifest.json'):
+        if (staging / name).exists():
+            os.replace(staging / name, tub_path / name)
+    shutil.rmtree(staging)
+    ImageSegments.release(images)
@@ -0,0 +1,331 @@
+"""
+Compiled index of the records of a tub, so the training data of large tubs
+is loaded without parsing the json lines of every catalog.
+"""
+
+import json
+import logging
+import os
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+from donkeycar.parts.datastore_v2 import Catalog
+
+logger = logging.getLogger(__name__)
+
+INDEX_FOLDER = 'record_index'
+INDEX_VERSION = 1
+# numpy types of the scalar record types, the others are stored as strings
+SCALAR_TYPES = {'float': 'f8', 'int': 'i8', 'boolean': '?'}
+STRING_TYPES = ('str', 'image_array', 'gray16_array', 'image')
+PRIVATE_KEYS = {'_index': 'int', '_timestamp_ms': 'int', '_session_id': 'str'}
+
+
+class TubIndex(object):
+    """
+    The records of a tub as columns of numpy structured arrays, one array per
+    catalog. Scalar values are numpy columns, image names, session ids and
+    other strings are byte strings, and lists are json strings. A boolean
+    _present column holds which keys a record has.
+
+    The arrays are cached as .npy files in the record_index folder of the
+    tub and memory mapped when loaded. A catalog is compiled again only if
+    its size or modification time changed, so a growing tub only recompiles
+    its last catalog. Deleted records are taken from the manifest, as they
+    change without changing the catalogs.
+    """
+    def __init__(self, tub, cache=True, executor=None):
+        """
+        :param tub:         the tub
+        :param cache:       if the arrays are cached in the tub
+        :param executor:    optional concurrent.futures executor, which
+                            compiles the catalogs in the background
+        """
+        self.tub = tub
+        self.manifest = tub.manifest
+        self.path = Path(self.manifest.base_path) / INDEX_FOLDER
+        self.cache = cache
+        self.types = dict(PRIVATE_KEYS)
+        self.types.update(zip(self.manifest.inputs, self.manifest.types))
+        self.keys = sorted(self.types)
+        self.key_numbers = {key: i for i, key in enumerate(self.keys)}
+        self.compiled = 0
+        self.compile_time = 0.0
+        self._arrays = None
+        self._jobs = self._submit(executor)
+        if executor is None:
+            self._arrays = self._collect()
+
+    def _meta_path(self):
+        return self.path / 'index.json'
+
+    def _read_meta(self):
+        try:
+            with open(self._meta_path()) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return dict()
+        if meta.get('version') != INDEX_VERSION \
+                or meta.get('types') != self.types:
+            return dict()
+        return meta.get('catalogs', dict())
+
+    def _submit(self, executor):
+        """
+        Start compiling the catalogs which are not cached, in the executor
+        if one is given.
+        """
+        cached = self._read_meta() if self.cache else dict()
+        jobs = []
+        for catalog_name in self.manifest.catalog_paths:
+            catalog_path = Path(self.manifest.base_path) / catalog_name
+            stat = catalog_path.stat()
+            key = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            array_path = self.path / f'{Path(catalog_name).stem}.npy'
+            if cached.get(catalog_name) == key and array_path.exists():
+                job = None
+            else:
+                args = (catalog_path.as_posix(), self.types,
+                        array_path.as_posix() if self.cache else None)
+                job = executor.submit(compile_catalog, *args) if executor \
+                    else compile_catalog(*args)
+            jobs.append((catalog_name, key, array_path, job))
+        return jobs
+
+    @property
+    def arrays(self):
+        """
+        The arrays of all catalogs, waits for the catalogs being compiled.
+        """
+        if self._arrays is None:
+            self._arrays = self._collect()
+        return self._arrays
+
+    def _collect(self):
+        arrays = []
+        catalogs = dict()
+        saved = True
+        for catalog_name, key, array_path, job in self._jobs:
+            if job is None:
+                array = np.load(array_path, mmap_mode='r')
+            else:
+                if isinstance(job, Future):
+                    job = job.result()
+                array, seconds = job
+                self.compiled += 1
+                self.compile_time += seconds
+                if array is None:
+                    # the worker saved it, which spares sending it back
+                    array = np.load(array_path, mmap_mode='r')
+                else:
+                    saved = False
+            catalogs[catalog_name] = key
+            arrays.append(array)
+        self._jobs = None
+        if self.compiled and self.cache and saved:
+            self._write_meta(catalogs)
+        if self.compiled:
+            logger.info(f'Compiled {self.compiled} of {len(arrays)} catalogs '
+                        f'of tub {self.manifest.base_path}')
+        return arrays
+
+    def _write_meta(self, catalogs):
+        try:
+            temp_path = self._meta_path().with_suffix('.tmp')
+            with open(temp_path, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'types': self.types,
+                           'catalogs': catalogs}, f)
+            os.replace(temp_path, self._meta_path())
+        except OSError as e:
+            logger.warning(f'Could not cache the record index: {e}')
+
+    def __len__(self):
+        """ Number of records, including the deleted ones """
+        return sum(len(array) for array in self.arrays)
+
+    def deleted_mask(self):
+        """
+        :return:    boolean array, which is True for the deleted records
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        for start, end in self.manifest.deleted_indexes.runs():
+            mask[start:end] = True
+        return mask
+
+    def column(self, key, include_deleted=False):
+        """
+        :return:    numpy array of a scalar or string key of all records
+        """
+        column = np.concatenate([array[key] for array in self.arrays]) \
+            if self.arrays else np.zeros(0)
+        return column if include_deleted else column[~self.deleted_mask()]
+
+    def value(self, array_number, row, key):
+        array = self.arrays[array_number]
+        key_number = self.key_numbers.get(key)
+        if key_number is None or not array['_present'][row, key_number]:
+            raise KeyError(key)
+        value = array[key][row]
+        record_type = self.types[key]
+        if record_type in SCALAR_TYPES:
+            return value.item()
+        if record_type in STRING_TYPES:
+            return value.decode()
+        return json.loads(value)
+
+    def present_keys(self, array_number, row):
+        present = self.arrays[array_number]['_present'][row]
+        return [key for key, has_key in zip(self.keys, present) if has_key]
+
+    def records(self):
+        """
+        :return:    list of IndexRecord of the records which are not deleted
+        """
+        records = []
+        alive = ~self.deleted_mask()
+        start = 0
+        for array_number, array in enumerate(self.arrays):
+            rows = np.flatnonzero(alive[start:start + len(array)])
+            records += [IndexRecord(self, array_number, row)
+                        for row in rows.tolist()]
+            start += len(array)
+        return records
+
+
+def compile_catalog(catalog_path, types, array_path=None):
+    """
+    Parse the records of a catalog into a structured array, see TubIndex.
+    This runs in the worker processes of TubDataset, so the array is saved
+    to array_path by the worker and only returned if there is no path or it
+    could not be saved.
+
+    :param catalog_path:    path of the catalog
+    :param types:           dict of the record types of the keys
+    :param array_path:      path of the .npy file to save the array to
+    :return:                tuple of the array or None, and the seconds it
+                            took
+    """
+    start = time.perf_counter()
+    keys = sorted(types)
+    catalog = Catalog(catalog_path, read_only=True)
+    records = []
+    try:
+        catalog.seekable.seek_line_start(1)
+        while True:
+            contents = catalog.seekable.readline()
+            if not contents:
+                break
+            records.append(json.loads(contents))
+    finally:
+        catalog.close()
+    unknown = set().union(*records) - set(keys) if records else set()
+    if unknown:
+        raise ValueError(f'Records of {catalog_path} have keys {unknown} '
+                         f'which are not inputs of the tub')
+
+    fields = []
+    columns = dict()
+    present = np.zeros((len(records), len(keys)), dtype=bool)
+    for key_number, key in enumerate(keys):
+        values = [record.get(key) for record in records]
+        present[:, key_number] = [value is not None for value in values]
+        record_type = types[key]
+        if record_type in SCALAR_TYPES:
+            dtype = SCALAR_TYPES[record_type]
+            column = np.array([0 if value is None else value
+                               for value in values], dtype=dtype)
+        else:
+            encode = str if record_type in STRING_TYPES else json.dumps
+            column = np.array([b'' if value is None
+                               else encode(value).encode()
+                               for value in values], dtype=bytes)
+            if column.dtype.itemsize == 0:
+                column = column.astype('S1')
+            dtype = column.dtype
+        fields.append((key, dtype))
+        columns[key] = column
+    fields.append(('_present', '?', (len(keys),)))
+    array = np.zeros(len(records), dtype=fields)
+    for key, column in columns.items():
+        array[key] = column
+    array['_present'] = present
+    if array_path is not None and _save_array(array, array_path):
+        array = None
+    return array, time.perf_counter() - start
+
+
+def _save_array(array, array_path):
+    try:
+        os.makedirs(os.path.dirname(array_path), exist_ok=True)
+        # write and rename, so a reader never maps a partial file
+        temp_path = array_path[:-len('.npy')] + '.tmp.npy'
+        np.save(temp_path, array)
+        os.replace(temp_path, array_path)
+        return True
+    except OSError as e:
+        logger.warning(f'Could not cache the record index: {e}')
+        return False
+
+
+class IndexRecord(MutableMapping):
+    """
+    A record dict which reads its values from a TubIndex when they are
+    accessed. Assigned values are kept in the record. Pickling turns it
+    into a plain dict, so records can be sent to other processes.
+    """
+    __slots__ = ('index', 'array_number', 'row', 'changes')
+
+    def __init__(self, index, array_number, row):
+        self.index = index
+        self.array_number = array_number
+        self.row = row
+        self.changes = None
+
+    def __getitem__(self, key):
+        if self.changes is not None and key in self.changes:
+            value = self.changes[key]
+            if value is _DELETED:
+                raise KeyError(key)
+            return value
+        return self.index.value(self.array_number, self.row, key)
+
+    def __setitem__(self, key, value):
+        if self.changes is None:
+            self.changes = dict()
+        self.changes[key] = value
+
+    def __delitem__(self, key):
+        self[key]
+        self[key] = _DELETED
+
+    def _keys(self):
+        keys = self.index.present_keys(self.array_number, self.row)
+        if self.changes is not None:
+            keys += [key for key in self.changes if key not in keys]
+            keys = [key for key in keys if self.changes.get(key) is not _DELETED]
+        return keys
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __copy__(self):
+        record = IndexRecord(self.index, self.array_number, self.row)
+        record.changes = None if self.changes is None else dict(self.changes)
+        return record
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+# marks keys which were deleted from an IndexRecord
+_DELETED = object()
@@ -1,18 +1,116 @@
 import atexit
+import operator
 import os
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from io import BytesIO
 import json
 
 import numpy as np
 from PIL import Image
 import logging
 
-from donkeycar.parts.datastore_v2 import Manifest, ManifestIterator
+from donkeycar.parts.datastore_v2 import Catalog, ColumnStore, \
+    ImageSegments, Manifest, ManifestIterator
 
 
 logger = logging.getLogger(__name__)
 
+JPEG_ENCODERS = ('pil', 'cv2')
+# one file per image, or images packed into a segment file per catalog
+IMAGE_STORAGES = ('files', 'packed')
+# indexes which the records of a compacted tub had when they were recorded
+ORIGINAL_INDEXES = 'original_indexes.npy'
+# the PIL default, so both encoders produce similar files
+DEFAULT_JPEG_QUALITY = 75
+
+
+class ImageEncoder(object):
+    """
+    Encodes the images of tub records, image_array as JPEG with PIL or
+    opencv and gray16_array as 16 bit PNG. With workers, a batch of images is
+    encoded in a thread pool; PIL and opencv release the GIL while encoding,
+    so the images of multiple cameras or depth frames are encoded in
+    parallel.
+    """
+    def __init__(self, encoder='pil', quality=DEFAULT_JPEG_QUALITY, workers=0):
+        if encoder not in JPEG_ENCODERS:
+            raise ValueError(f"encoder must be one of {JPEG_ENCODERS}, not "
+                             f"{encoder}")
+        self.encoder = encoder
+        self.quality = quality
+        if encoder == 'cv2':
+            import cv2
+            self.cv2 = cv2
+        self.pool = ThreadPoolExecutor(workers,
+                                       thread_name_prefix='image-encoder') \
+            if workers > 0 else None
+
+    def encode(self, image, input_type, quality=None):
+        """
+        :return:    the encoded image as bytes
+        """
+        buffer = BytesIO()
+        if input_type == 'gray16_array':
+            Image.fromarray(np.uint16(image)).save(buffer, format='PNG')
+            return buffer.getvalue()
+        image = np.uint8(image)
+        quality = quality or self.quality
+        if self.encoder == 'cv2':
+            if image.ndim == 3 and image.shape[2] == 3:
+                # opencv expects BGR
+                image = image[..., ::-1]
+            ok, encoded = self.cv2.imencode(
+                '.jpg', image, [self.cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ok:
+                raise IOError('Could not encode image')
+            return encoded.tobytes()
+        Image.fromarray(image).save(buffer, format='JPEG', quality=quality)
+        return buffer.getvalue()
+
+    def encode_all(self, jobs):
+        """
+        Encode a list of images
+
+        :param jobs:    list of (image, input_type, quality) tuples
+        :return:        list with the bytes of each image or the exception
+                        if it failed
+        """
+        if self.pool is None or len(jobs) < 2:
+            return [self._try_encode(*job) for job in jobs]
+        futures = [self.pool.submit(self._try_encode, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+    def _try_encode(self, *job):
+        try:
+            return self.encode(*job)
+        except Exception as e:
+            return e
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def image_source(images_path, name, segments=None):
+    """
+    Return what PIL can open for an image of a tub: the path of the image
+    file, or a file object of the image if it is packed in a segment.
+
+    :param images_path: images folder of the tub
+    :param name:        image name from the record
+    :param segments:    ImageSegments of the tub, the shared reader of the
+                        folder if None
+    """
+    segments = segments or ImageSegments.reader(images_path)
+    data = segments.read(name) if segments.has_segments() else None
+    if data is None:
+        return os.path.join(images_path, name)
+    return BytesIO(data)
+
 
 class Tub(object):
     """
@@ -21,12 +119,19 @@ class Tub(object):
     """
 
     def __init__(self, base_path, inputs=[], types=[], metadata=[],
-                 max_catalog_len=1000, read_only=False):
+                 max_catalog_len=1000, read_only=False, image_encoder='pil',
+                 image_quality=DEFAULT_JPEG_QUALITY, encoder_workers=0,
+                 image_storage='files'):
+        if image_storage not in IMAGE_STORAGES:
+            raise ValueError(f"image_storage must be one of {IMAGE_STORAGES}, "
+                             f"not {image_storage}")
         self.base_path = base_path
         self.images_base_path = os.path.join(self.base_path, Tub.images())
         self.inputs = inputs
         self.types = types
         self.metadata = metadata
+        self.encoder = ImageEncoder(image_encoder, image_quality,
+                                    encoder_workers)
         self.manifest = Manifest(base_path, inputs=inputs, types=types,
                                  metadata=metadata, max_len=max_catalog_len,
                                  read_only=read_only)
@@ -34,10 +139,116 @@ class Tub(object):
         # Create images folder if necessary
         if not os.path.exists(self.images_base_path):
             os.makedirs(self.images_base_path, exist_ok=True)
+        # images can be read from both layouts, new ones are written to the
+        # given storage
+        self.image_storage = image_storage
+        self.images = ImageSegments(self.images_base_path, read_only=read_only)
+        self.columns = ColumnStore(base_path, self.manifest.inputs,
+                                   self.manifest.types, read_only=read_only)
+        self._open_columns()
 
-    def write_record(self, record=None):
+    def write_record(self, record=None, flush=True, image_quality=None):
         """
         Can handle various data types including images.
+
+        :param record:          dict of the values to write. If it contains
+                                a _timestamp_ms, it is used instead of the
+                                current time.
+        :param flush:           if the catalog is flushed after the record
+        :param image_quality:   JPEG quality of image_array values, defaults
+                                to the quality of the tub
+        """
+        error = self.write_records([record], flush, image_quality)[0]
+        if error:
+            raise error
+
+    def write_records(self, records, flush=True, image_quality=None):
+        """
+        Write a batch of records. The images of all records are encoded
+        together, in parallel if the tub has encoder workers, then the
+        records are appended to the catalog in their order.
+
+        :param records:         list of record dicts, see write_record()
+        :param flush:           if the catalog is flushed after the batch
+        :param image_quality:   JPEG quality of image_array values
+        :return:                list with the exception of each record
+                                which could not be written or None
+        """
+        contents = []
+        jobs = []
+        owners = []
+        for i, record in enumerate(records):
+            record_jobs = []
+            contents.append(self._record_contents(record, record_jobs,
+                                                  image_quality))
+            jobs += record_jobs
+            owners += [i] * len(record_jobs)
+        errors = [None] * len(records)
+        images = [[] for _ in records]
+        written = []
+        encoded = self.encoder.encode_all([job[1:] for job in jobs])
+        for i, job, data in zip(owners, jobs, encoded):
+            if isinstance(data, Exception):
+                errors[i] = errors[i] or data
+            else:
+                images[i].append((job[0], data))
+        try:
+            for record_contents, record_images, error \
+                    in zip(contents, images, errors):
+                if error:
+                    logger.error(f'Failed saving images of record: {error}')
+                    continue
+                # only records which are written get an index, which names
+                # their images
+                index = self.manifest.current_index
+                record_contents['_index'] = index
+                named_images = []
+                for (key, extension), data in record_images:
+                    name = Tub._image_file_name(index, key, extension)
+                    record_contents[key] = name
+                    named_images.append((name, data))
+                self._write_images(index, named_images)
+                self.manifest.write_record(record_contents, flush=False)
+                written.append(record_contents)
+        finally:
+            # the records in the catalog get their rows, even if a later
+            # record of the batch failed
+            if self.columns_synced:
+                self._append_columns(written)
+        if flush:
+            self.flush()
+        return errors
+
+    def _append_columns(self, records):
+        try:
+            self.columns.append(records, flush=False)
+        except ValueError as e:
+            # the columns are out of line with the catalogs, rebuild the
+            # rows from the first one which differs
+            logger.warning(f'Catching up columns of tub {self.base_path}: {e}')
+            self.columns.truncate(min(self.columns.rows,
+                                      records[0]['_index']))
+            self._catch_up_columns()
+
+    def _write_images(self, index, images):
+        """
+        Store the encoded images of the record with the given index, before
+        the record is written, so a record never refers to a missing image.
+        """
+        for name, data in images:
+            if self.image_storage == 'packed':
+                segment = index // self.manifest.max_len
+                self.images.append(segment, name, data, flush=False)
+            else:
+                with open(os.path.join(self.images_base_path, name), 'wb') \
+                        as f:
+                    f.write(data)
+
+    def _record_contents(self, record, jobs, image_quality):
+        """
+        Convert the values of a record for the catalog. The encoding jobs of
+        the images are added to jobs, with the key and file extension the
+        image is named by once the record gets its index.
         """
         contents = dict()
         for key, value in record.items():
@@ -60,35 +271,153 @@ class Tub(object):
                     contents[key] = value.tolist()
                 elif input_type == 'list' or input_type == 'vector':
                     contents[key] = list(value)
-                elif input_type == 'image_array':
-                    # Handle image array
-                    image = Image.fromarray(np.uint8(value))
-                    name = Tub._image_file_name(self.manifest.current_index, key)
-                    image_path = os.path.join(self.images_base_path, name)
-                    image.save(image_path)
-                    contents[key] = name
-                elif input_type == 'gray16_array':
-                    # save np.uint16 as a 16bit png
-                    image = Image.fromarray(np.uint16(value))
-                    name = Tub._image_file_name(self.manifest.current_index, key, ext='.png')
-                    image_path = os.path.join(self.images_base_path, name)
-                    image.save(image_path)
-                    contents[key]=name
+                elif input_type in ('image_array', 'gray16_array'):
+                    # image_array is saved as jpeg, gray16_array as 16bit png
+                    extension = '.jpg' if input_type == 'image_array' \
+                        else '.png'
+                    jobs.append(((key, extension), value, input_type,
+                                 image_quality))
+                    # named when the record is written
+                    contents[key] = None
 
         # Private properties
-        contents['_timestamp_ms'] = int(round(time.time() * 1000))
-        contents['_index'] = self.manifest.current_index
+        contents['_timestamp_ms'] = record.get('_timestamp_ms') \
+            or int(round(time.time() * 1000))
         contents['_session_id'] = self.manifest.session_id[1]
-        self.manifest.write_record(contents)
+        return contents
+
+    def flush(self):
+        self.images.flush()
+        self.manifest.flush()
+        self.columns.flush()
+
+    def sync(self):
+        self.images.sync()
+        self.manifest.sync()
+        self.columns.sync()
+
+    def _open_columns(self):
+        """
+        Line the column files up with the catalogs. Rows of records which
+        are not in the catalogs are dropped. If the columns are behind by at
+        most a catalog, e.g. after a crash, they are caught up; otherwise,
+        like in tubs recorded before there were columns, they are caught up
+        by the first to_frame() call.
+        """
+        current_index = self.manifest.current_index
+        self._column_records = None
+        if self.columns.read_only:
+            self.columns.rows = min(self.columns.rows, current_index)
+            self.columns_synced = self.columns.rows == current_index
+            return
+        self.columns.truncate(min(self.columns.rows, current_index))
+        self.columns_synced = \
+            current_index - self.columns.rows <= self.manifest.max_len
+        if self.columns_synced:
+            self._catch_up_columns()
+
+    def _missing_column_records(self):
+        """
+        Yield the records which are in the catalogs but not in the columns,
+        one list per catalog.
+        """
+        start, end = self.columns.rows, self.manifest.current_index
+        while start < end:
+            stop = min((start // self.manifest.max_len + 1)
+                       * self.manifest.max_len, end)
+            yield self.manifest.read_records(range(start, stop))
+            start = stop
+
+    def _catch_up_columns(self):
+        for records in self._missing_column_records():
+            self.columns.append(records, flush=False)
+        self.columns.flush()
+        self.columns_synced = True
+
+    def column(self, key, include_deleted=False):
+        """
+        Values of a numeric channel of all records, from the column files of
+        the tub. Float, int and boolean channels give one dimensional
+        arrays, vectors and lists two dimensional ones. Missing floats are
+        NaN, missing ints and booleans 0.
+
+        :param key:             channel, or _index or _timestamp_ms
+        :param include_deleted: if the deleted records are included, then
+                                row i is the record with index i
+        :return:                numpy array, a read-only memory map of the
+                                column file if the deleted records are
+                                included or there are none
+        """
+        if not self.columns_synced:
+            if self.columns.read_only:
+                # read-only tubs keep the missing rows in memory
+                if self._column_records is None:
+                    self._column_records = [
+                        record for records in self._missing_column_records()
+                        for record in records]
+            else:
+                self._catch_up_columns()
+        column = self.columns.read(key, self._column_records)
+        if include_deleted or not self.manifest.deleted_indexes:
+            return column
+        alive = np.ones(len(column), dtype=bool)
+        for start, end in self.manifest.deleted_indexes.runs():
+            alive[start:end] = False
+        return column[alive]
+
+    def to_frame(self, columns=None, include_deleted=False):
+        """
+        The numeric channels of the records as a pandas DataFrame, indexed
+        by the record index. Vector and list channels are split into one
+        column per element, named <key>_<i>. The frame shares the memory
+        maps of the column files, see column(), so it is read-only.
+
+        :param columns:         channels to include, defaults to all numeric
+                                channels and _timestamp_ms
+        :param include_deleted: if the deleted records are included
+        :return:                pandas DataFrame
+        """
+        import pandas as pd
+
+        if columns is None:
+            columns = [key for key in self.columns.types if key != '_index']
+        data = dict()
+        for key in columns:
+            column = self.column(key, include_deleted)
+            if column.ndim == 2:
+                for i in range(column.shape[1]):
+                    data[f'{key}_{i}'] = column[:, i]
+            else:
+                data[key] = column
+        index = pd.Index(self.column('_index', include_deleted),
+                         name='_index')
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def image_source(self, name):
+        """
+        Return the path of an image of a record or, if it is packed in a
+        segment, a file object of it. Both can be opened by PIL.
+        """
+        return image_source(self.images_base_path, name, self.images)
+
+    def read_image(self, name):
+        """
+        :return:    the encoded image of a record as bytes
+        """
+        data = self.images.read(name)
+        if data is None:
+            with open(os.path.join(self.images_base_path, name), 'rb') as f:
+                data = f.read()
+        return data
 
     def delete_records(self, record_indexes):
         self.manifest.delete_records(record_indexes)
 
     def delete_last_n_records(self, n):
-        # build ordered list of non-deleted indexes
-        all_alive_indexes = sorted(set(range(self.manifest.current_index))
-                                   - self.manifest.deleted_indexes)
-        to_delete_indexes = all_alive_indexes[-n:]
+        # indexes of the last n records which are not deleted yet
+        length = len(self)
+        to_delete_indexes = self.manifest.record_indexes(
+            range(max(length - n, 0), length))
         self.manifest.delete_records(to_delete_indexes)
 
     def restore_records(self, record_indexes):
@@ -96,6 +425,9 @@ class Tub(object):
 
     def close(self):
         logger.info(f'Closing tub {self.base_path}')
+        self.encoder.close()
+        self.images.close()
+        self.columns.close()
         self.manifest.close()
 
     def __iter__(self):
@@ -104,6 +436,65 @@ class Tub(object):
     def __len__(self):
         return self.manifest.__len__()
 
+    def __getitem__(self, key):
+        """
+        Random access to the records, like to a list of the records which
+        are not deleted: tub[i] is the i-th record of iter(tub).
+
+        :param key: position or slice of positions
+        :return:    record dict or list of record dicts
+        """
+        if isinstance(key, slice):
+            return self.read_many(range(*key.indices(len(self))))
+        return self.read_many([key])[0]
+
+    def original_indexes(self):
+        """
+        Indexes which the records had when they were recorded. They differ
+        from the record indexes after the tub was compacted, see
+        donkeycar.parts.tub_compact; records written after the compaction
+        keep their index.
+
+        :return:    numpy array with the original index of each record index
+        """
+        return self._original_indexes()[:-1]
+
+    def _original_indexes(self):
+        """
+        Original indexes of the records and, as last entry, the one of the
+        next record. This is what a compaction stores, records which are
+        written later are counted on from the last entry.
+        """
+        current_index = self.manifest.current_index
+        path = os.path.join(self.base_path, ORIGINAL_INDEXES)
+        if not os.path.exists(path):
+            return np.arange(current_index + 1)
+        stored = np.load(path)
+        kept, next_index = stored[:-1], stored[-1]
+        return np.concatenate([kept[:current_index], np.arange(
+            next_index, next_index + current_index - len(kept) + 1)])
+
+    def read_many(self, positions):
+        """
+        Read the records at the given positions, grouped by catalog.
+
+        :param positions:   positions of the records, negative positions
+                            count from the end
+        :return:            list of record dicts in the order of positions
+        """
+        length = len(self)
+        normalized = []
+        for position in positions:
+            position = operator.index(position)
+            if position < 0:
+                position += length
+            if not 0 <= position < length:
+                raise IndexError(f'Record {position} out of range of tub with '
+                                 f'{length} records')
+            normalized.append(position)
+        indexes = self.manifest.record_indexes(normalized)
+        return self.manifest.read_records(indexes)
+
     @classmethod
     def images(cls):
         return 'images'
@@ -116,13 +507,112 @@ class Tub(object):
         return name
 
 
+def _image_names(tub):
+    """
+    Yield the index and image names of all records of a tub, including the
+    deleted ones, which can still be restored.
+    """
+    image_keys = [key for key, input_type
+                  in zip(tub.manifest.inputs, tub.manifest.types)
+                  if input_type in ('image_array', 'gray16_array')]
+    for catalog_path in tub.manifest.catalog_paths:
+        catalog = Catalog(os.path.join(tub.base_path, catalog_path),
+                          read_only=True)
+        try:
+            catalog.seekable.seek_line_start(1)
+            while True:
+                contents = catalog.seekable.readline()
+                if not contents:
+                    break
+                record = json.loads(contents)
+                for key in image_keys:
+                    if record.get(key):
+                        yield record['_index'], record[key]
+        finally:
+            catalog.close()
+
+
+def pack_images(tub_path):
+    """
+    Convert the image files of a tub into packed segments. The image files
+    are deleted after all segments were written to disk, so an interrupted
+    conversion is finished by running it again. The catalogs are only read.
+
+    :param tub_path:    path of the tub
+    :return:            number of packed images
+    """
+    tub = Tub(tub_path, read_only=True)
+    segments = ImageSegments(tub.images_base_path)
+    packed = []
+    try:
+        for index, name in _image_names(tub):
+            path = os.path.join(tub.images_base_path, name)
+            if not os.path.exists(path):
+                continue
+            if name not in segments:
+                with open(path, 'rb') as f:
+                    segments.append(index // tub.manifest.max_len, name,
+                                    f.read(), flush=False)
+            # files left by an interrupted conversion are already packed
+            packed.append(path)
+        segments.sync()
+        for path in packed:
+            os.remove(path)
+    finally:
+        segments.close()
+        tub.close()
+    ImageSegments.release(tub.images_base_path)
+    logger.info(f'Packed {len(packed)} images of tub {tub_path}')
+    return len(packed)
+
+
+def unpack_images(tub_path):
+    """
+    Convert the packed segments of a tub back into one file per image. Each
+    file is written under a temporary name and renamed when complete, and
+    files which exist are skipped, so an interrupted conversion is finished
+    by running it again.
+
+    :param tub_path:    path of the tub
+    :return:            number of unpacked images
+    """
+    images_path = os.path.join(tub_path, Tub.images())
+    segments = ImageSegments(images_path)
+    try:
+        names = list(segments.locations)
+        for name in names:
+            path = os.path.join(images_path, name)
+            if os.path.exists(path):
+                continue
+            with open(path + '.tmp', 'wb') as f:
+                f.write(segments.read(name))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+        segments.remove()
+    finally:
+        segments.close()
+    ImageSegments.release(images_path)
+    logger.info(f'Unpacked {len(names)} images of tub {tub_path}')
+    return len(names)
+
+
 class TubWriter(object):
     """
     A Donkey part, which can write records to the datastore.
     """
+    # keep running even if nobody reads the record count
+    has_side_effects = True
+
     def __init__(self, base_path, inputs=[], types=[], metadata=[],
-                 max_catalog_len=1000):
-        self.tub = Tub(base_path, inputs, types, metadata, max_catalog_len)
+                 max_catalog_len=1000, image_encoder='pil',
+                 image_quality=DEFAULT_JPEG_QUALITY, encoder_workers=0,
+                 image_storage='files'):
+        self.tub = Tub(base_path, inputs, types, metadata, max_catalog_len,
+                       image_encoder=image_encoder,
+                       image_quality=image_quality,
+                       encoder_workers=encoder_workers,
+                       image_storage=image_storage)
 
     def run(self, *args):
         assert len(self.tub.inputs) == len(args), \
@@ -131,6 +621,9 @@ class TubWriter(object):
         self.tub.write_record(record)
         return self.tub.manifest.current_index
 
+    def delete_last_n_records(self, n):
+        self.tub.delete_last_n_records(n)
+
     def __iter__(self):
         return self.tub.__iter__()
 
@@ -141,6 +634,218 @@ class TubWriter(object):
         self.close()
 
 
+BACKPRESSURE_POLICIES = ('drop_oldest', 'block', 'degrade')
+
+
+class _DeleteRecords:
+    """
+    Queue item of the AsyncTubWriter, which deletes the last n records once
+    the records queued before it are written.
+    """
+    def __init__(self, n):
+        self.n = n
+
+
+class AsyncTubWriter(TubWriter):
+    """
+    A TubWriter which takes image encoding and file writes out of the drive
+    loop. run() only puts the record into a bounded queue and a writer
+    thread encodes and appends the queued records in batches, with one flush
+    per batch and an fsync every fsync_interval_s seconds.
+
+    When the writer can't keep up and the queue is full, the backpressure
+    policy decides:
+        drop_oldest: the oldest queued record is dropped
+        block:       run() waits for space in the queue
+        degrade:     images are saved with degraded_quality while the queue
+                     is more than half full, if it gets full run() waits
+
+    Besides the number of records, run() outputs the queue depth and the
+    number of lost records, which were dropped or failed to be written.
+    Failed batches are logged and the writer continues. If the writer thread dies anyway, its exception is kept in
+    error and run() and close() write the records in the calling thread.
+
+    delete_last_n_records() drops the records which are still queued first
+    and lets the writer thread delete the rest, once it wrote the records
+    queued before.
+    """
+    def __init__(self, base_path, inputs=[], types=[], metadata=[],
+                 max_catalog_len=1000, image_encoder='pil',
+                 image_quality=DEFAULT_JPEG_QUALITY, encoder_workers=0,
+                 image_storage='files', queue_size=64,
+                 backpressure='drop_oldest', batch_size=16,
+                 fsync_interval_s=1.0, degraded_quality=50):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"backpressure must be one of "
+                             f"{BACKPRESSURE_POLICIES}, not {backpressure}")
+        super().__init__(base_path, inputs, types, metadata, max_catalog_len,
+                         image_encoder, image_quality, encoder_workers,
+                         image_storage)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.backpressure = backpressure
+        self.batch_size = batch_size
+        self.fsync_interval_s = fsync_interval_s
+        self.degraded_quality = degraded_quality
+        self.num_records = self.tub.manifest.current_index
+        self.dropped = 0
+        self.degraded = 0
+        # queued records removed by delete_last_n_records()
+        self.erased = 0
+        # records the writer failed to write
+        self.failed = 0
+        # exception which ended the writer thread
+        self.error = None
+        self.thread = threading.Thread(target=self._write_loop, daemon=True,
+                                       name='AsyncTubWriter')
+        self.thread.start()
+
+    def run(self, *args):
+        assert len(self.tub.inputs) == len(args), \
+            f'Expected {len(self.tub.inputs)} inputs but received {len(args)}'
+        record = dict(zip(self.tub.inputs, args))
+        record['_timestamp_ms'] = int(round(time.time() * 1000))
+        if not self.thread.is_alive():
+            self._write_directly([record])
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                if self.backpressure == 'drop_oldest':
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                        self.num_records -= 1
+                    except queue.Empty:
+                        pass
+                    # the drive loop is the only producer, so there is space
+                    self.queue.put_nowait(record)
+                elif not self._put(record):
+                    self._write_directly([record])
+        self.num_records += 1
+        return self.num_records - self.erased - self.failed, \
+            self.queue.qsize(), self.dropped + self.failed
+
+    def delete_last_n_records(self, n):
+        """
+        Delete the last n records. Records which are still queued are
+        dropped from the queue, the remaining deletion is queued behind the
+        records the writer thread has yet to write.
+        """
+        erased = 0
+        with self.queue.mutex:
+            queued = self.queue.queue
+            while erased < n and queued and isinstance(queued[-1], dict):
+                queued.pop()
+                erased += 1
+            if erased:
+                self.queue.not_full.notify(erased)
+        self.erased += erased
+        remaining = n - erased
+        if remaining > 0:
+            deletion = _DeleteRecords(remaining)
+            if not self._put(deletion):
+                self._write_directly([deletion])
+
+    def _put(self, item):
+        """
+        Wait for space in the queue while the writer thread is alive.
+
+        :return:    if the item was queued
+        """
+        while self.thread.is_alive():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _write_directly(self, records):
+        """
+        Write the records left in the queue and the given ones in the
+        calling thread, once the writer thread died.
+        """
+        queued = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                queued.append(item)
+        self._write(queued + records)
+
+    def _write(self, items, image_quality=None):
+        """
+        Write the queued records and apply the queued deletions in their
+        order.
+        """
+        records = []
+        for item in items:
+            if isinstance(item, _DeleteRecords):
+                self._write_records(records, image_quality)
+                records = []
+                self.tub.delete_last_n_records(item.n)
+            else:
+                records.append(item)
+        self._write_records(records, image_quality)
+
+    def _write_records(self, records, image_quality):
+        if not records:
+            return
+        start = self.tub.manifest.current_index
+        try:
+            self.tub.write_records(records, image_quality=image_quality)
+        except Exception as e:
+            logger.exception(f'Failed writing records: {e}')
+        finally:
+            # records which are written got an index
+            self.failed += len(records) \
+                - (self.tub.manifest.current_index - start)
+
+    def _write_loop(self):
+        try:
+            last_sync = time.monotonic()
+            running = True
+            while running:
+                batch = [self.queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in batch:
+                    # stop marker, written by close()
+                    batch = batch[:batch.index(None)]
+                    running = False
+                try:
+                    quality = None
+                    if self.backpressure == 'degrade' \
+                            and self.queue.qsize() >= self.queue.maxsize // 2:
+                        quality = self.degraded_quality
+                    self._write(batch, image_quality=quality)
+                    if quality:
+                        self.degraded += len(batch)
+                    now = time.monotonic()
+                    if now - last_sync >= self.fsync_interval_s:
+                        self.tub.sync()
+                        last_sync = now
+                except Exception as e:
+                    logger.exception(f'Failed writing records: {e}')
+        except BaseException as e:
+            self.error = e
+            logger.exception(f'Tub writer thread died, records are written '
+                             f'in the drive loop: {e}')
+
+    def close(self):
+        # the writer drains the queue up to the stop marker
+        if self._put(None):
+            self.thread.join()
+        if self.error is not None:
+            self._write_directly([])
+        super().close()
+
+
 class TubWiper:
     """
     Donkey part which deletes a bunch of records from the end of tub.
@@ -151,7 +856,7 @@ class TubWiper:
     """
     def __init__(self, tub, num_records=20):
         """
-        :param tub: tub to operate on
+        :param tub: tub or tub writer to operate on
         :param num_records: number or records to delete
         """
         self._tub = tub
@@ -0,0 +1,192 @@
+"""
+On-disk cache of the decoded and transformed camera frames of a tub, so
+repeated trainings read uint8 frames from a memory map instead of decoding
+JPEGs and running the TRANSFORMATIONS again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from donkeycar.config import Config
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.utils import load_image
+
+logger = logging.getLogger(__name__)
+
+FRAME_FOLDER = 'frame_cache'
+FRAME_VERSION = 1
+IMAGE_KEY = 'cam/image_array'
+# config settings which change the frames, besides the names of the
+# transformations and the settings which start with a custom transformation
+FRAME_SETTINGS = ('IMAGE_W', 'IMAGE_H', 'IMAGE_DEPTH')
+FRAME_SETTING_PREFIXES = ('ROI_', 'CANNY_', 'BLUR_', 'RESIZE_', 'SCALE_')
+
+
+def frame_settings(config: Config) -> dict:
+    """
+    :return:    the config settings which the frames depend on
+    """
+    names = list(getattr(config, 'TRANSFORMATIONS', None) or [])
+    prefixes = FRAME_SETTING_PREFIXES + tuple(
+        name for name in names if name.startswith('CUSTOM'))
+    settings = {'TRANSFORMATIONS': names}
+    for key in dir(config):
+        if key in FRAME_SETTINGS or key.startswith(prefixes):
+            settings[key] = getattr(config, key)
+    # round trip, so tuples compare equal to the lists read back
+    return json.loads(json.dumps(settings, default=str))
+
+
+def frame_key(config: Config) -> str:
+    """
+    :return:    hash of the frame settings, which names the cache files.
+                Custom transformations are only hashed by their settings,
+                changing their code requires rebuilding the cache.
+    """
+    settings = json.dumps(frame_settings(config), sort_keys=True)
+    return hashlib.sha1(settings.encode()).hexdigest()[:16]
+
+
+def _transformation(config: Config):
+    if not getattr(config, 'TRANSFORMATIONS', None):
+        return None
+    # the transformations import opencv
+    from donkeycar.parts.image_transformations import ImageTransformations
+    return ImageTransformations(config, 'TRANSFORMATIONS')
+
+
+class FrameCache(object):
+    """
+    The frames of a tub for one set of transformation settings. They are
+    stored in frame_cache/<key>.npy in the tub, with a row per record index,
+    including the deleted records, and memory mapped when read. The
+    <key>.json file next to it is written last and marks the frames as
+    complete. Records written after the frames were built have no frame.
+    """
+    def __init__(self, tub_path: str, key: str) -> None:
+        self.path = Path(os.path.expanduser(tub_path)) / FRAME_FOLDER
+        self.key = key
+        with open(self.path / f'{key}.json') as f:
+            self.meta = json.load(f)
+        self.frames = np.load(self.path / f'{key}.npy', mmap_mode='r')
+        self.missing = set(self.meta['missing'])
+
+    @classmethod
+    def open(cls, tub_path: str, config: Config) -> Optional['FrameCache']:
+        """
+        :return:    the frames of the tub for the config, or None if they were
+                    not built
+        """
+        key = frame_key(config)
+        meta_path = Path(os.path.expanduser(tub_path)) / FRAME_FOLDER \
+            / f'{key}.json'
+        if not meta_path.exists():
+            return None
+        try:
+            cache = cls(tub_path, key)
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignoring frame cache {meta_path}: {e}')
+            return None
+        if cache.meta.get('version') != FRAME_VERSION:
+            return None
+        return cache
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def covers(self, tub: Tub) -> bool:
+        """
+        :return:    if the frames were built from all records of the tub
+        """
+        return self.meta['records'] >= tub.manifest.current_index
+
+    def __contains__(self, index: int) -> bool:
+        return index < len(self.frames) and index not in self.missing
+
+    def get(self, index: int) -> Optional[np.ndarray]:
+        """
+        :return:    read-only view of the frame of a record index, or None
+        """
+        if index not in self:
+            return None
+        return self.frames[index]
+
+
+def build_frame_cache(tub_path: str, config: Config,
+                      workers: Optional[int] = None) -> FrameCache:
+    """
+    Decode and transform the camera images of all records of a tub into a
+    FrameCache. An existing cache for the same settings is replaced.
+
+    :param tub_path:    path of the tub
+    :param config:      config with the image size and TRANSFORMATIONS
+    :param workers:     threads which decode the images, None for one per
+                        core
+    :return:            the new FrameCache
+    """
+    start = time.perf_counter()
+    key = frame_key(config)
+    tub = Tub(os.path.expanduser(tub_path), read_only=True)
+    path = Path(tub.base_path) / FRAME_FOLDER
+    path.mkdir(exist_ok=True)
+    manifest = tub.manifest
+    transformation = _transformation(config)
+
+    def load_frame(record):
+        name = record.get(IMAGE_KEY)
+        if not name:
+            return None
+        frame = load_image(tub.image_source(name), cfg=config)
+        if frame is None:
+            return None
+        if transformation:
+            frame = transformation.run(frame)
+        return np.asarray(frame, dtype=np.uint8)
+
+    (path / f'{key}.json').unlink(missing_ok=True)
+    temp_path = path / f'{key}.tmp.npy'
+    frames = None
+    missing = []
+    try:
+        with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+            for catalog_start in range(0, manifest.current_index,
+                                       manifest.max_len):
+                indexes = range(catalog_start,
+                                min(catalog_start + manifest.max_len,
+                                    manifest.current_index))
+                records = manifest.read_records(indexes)
+                for index, frame in zip(indexes,
+                                        executor.map(load_frame, records)):
+                    if frame is None:
+                        missing.append(index)
+                        continue
+                    if frames is None:
+                        frames = np.lib.format.open_memmap(
+                            temp_path, mode='w+', dtype=np.uint8,
+                            shape=(manifest.current_index,) + frame.shape)
+                    frames[index] = frame
+        if frames is None:
+            np.save(temp_path, np.zeros((0,), dtype=np.uint8))
+        else:
+            frames.flush()
+            del frames
+        os.replace(temp_path, path / f'{key}.npy')
+        with open(path / f'{key}.json', 'w') as f:
+            json.dump({'version': FRAME_VERSION,
+                       'settings': frame_settings(config),
+                       'records': manifest.current_index,
+                       'missing': missing}, f)
+    finally:
+        tub.close()
+        temp_path.unlink(missing_ok=True)
+    logger.info(f'Cached {manifest.current_index - len(missing)} frames of '
+                f'{tub_path} in {time.perf_counter() - start:.2f}s')
+    return FrameCache(tub_path, key)
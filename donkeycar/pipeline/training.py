@@ -12,10 +12,10 @@ from donkeycar.parts.interpreter import keras_model_to_tflite, \
     saved_model_to_tensor_rt
 from donkeycar.pipeline.database import PilotDatabase
 from donkeycar.pipeline.sequence import TubRecord, TubSequence, TfmIterator
-from donkeycar.pipeline.types import TubDataset
+from donkeycar.pipeline.types import Collator, ImageCache, TubDataset
 from donkeycar.pipeline.augmentations import ImageAugmentation
 from donkeycar.parts.image_transformations import ImageTransformations
-from donkeycar.utils import get_model_by_type, normalize_image, train_test_split
+from donkeycar.utils import get_model_by_type, train_test_split
 import tensorflow as tf
 import numpy as np
 
@@ -42,19 +42,35 @@ class BatchSequence(object):
         self.transformation = ImageTransformations(config, 'TRANSFORMATIONS')
         self.post_transformation = ImageTransformations(config,
                                                         'POST_TRANSFORMATIONS')
+        self.pretransformed = self._uses_frames(records)
         self.pipeline = self._create_pipeline()
 
     def __len__(self) -> int:
         return math.ceil(len(self.pipeline) / self.batch_size)
 
+    @staticmethod
+    def _uses_frames(records) -> bool:
+        """ If the records load pre-decoded frames, which went through the
+            TRANSFORMATIONS already, see donkey cache-tubs """
+        if isinstance(records, Collator):
+            flat = records.records
+        else:
+            flat = [r for record in records for r in
+                    (record if isinstance(record, list) else [record])]
+        with_frames = sum(r.frames is not None for r in flat)
+        if 0 < with_frames < len(flat):
+            raise ValueError('Either all or no records need to have frames')
+        return with_frames > 0
+
     def image_processor(self, img_arr):
         """ Transforms the image and augments it if in training. We are not
         calling the normalisation here, because then the normalised images
-        would get cached in the TubRecord, and they are 8 times larger (as
-        they are 64bit floats and not uint8) """
+        would get cached in the TubRecord, and they are 4 times larger (as
+        they are 32bit floats and not uint8) """
         assert img_arr.dtype == np.uint8, \
             f"image_processor requires uint8 array but not {img_arr.dtype}"
-        img_arr = self.transformation.run(img_arr)
+        if not self.pretransformed:
+            img_arr = self.transformation.run(img_arr)
         if self.is_train:
             img_arr = self.augmentation.run(img_arr)
         img_arr = self.post_transformation.run(img_arr)
@@ -68,8 +84,9 @@ class BatchSequence(object):
         def get_x(record: TubRecord) -> Dict[str, Union[float, np.ndarray]]:
             """ Extracting x from record for training"""
             out_dict = self.model.x_transform(record, self.image_processor)
-            # apply the normalisation here on the fly to go from uint8 -> float
-            out_dict['img_in'] = normalize_image(out_dict['img_in'])
+            # apply the normalisation here on the fly to go from uint8 ->
+            # float, unless the model normalises uint8 images in the graph
+            out_dict['img_in'] = self.model.prepare_image(out_dict['img_in'])
             return out_dict
 
         def get_y(record: TubRecord) -> Dict[str, Union[float, np.ndarray]]:
@@ -83,13 +100,68 @@ class BatchSequence(object):
         return pipeline
 
     def create_tf_data(self) -> tf.data.Dataset:
-        """ Assembles the tf data pipeline """
-        dataset = tf.data.Dataset.from_generator(
-            generator=lambda: self.pipeline,
-            output_types=self.model.output_types(),
-            output_shapes=self.model.output_shapes())
+        """ Assembles the tf data pipeline. With TRAIN_PIPELINE = 'parallel'
+            the records are loaded by parallel map calls, otherwise by a
+            single generator. """
+        if getattr(self.config, 'TRAIN_PIPELINE', 'generator') == 'parallel':
+            dataset = self._create_parallel_tf_data()
+        else:
+            dataset = tf.data.Dataset.from_generator(
+                generator=lambda: self.pipeline,
+                output_types=self.model.output_types(),
+                output_shapes=self.model.output_shapes())
         return dataset.repeat().batch(self.batch_size)
 
+    def _create_parallel_tf_data(self) -> tf.data.Dataset:
+        """ Builds the dataset from the record positions, which are mapped to
+            x and y in parallel calls. The transformations are python code,
+            so they run in tf.numpy_function, but image decoding, opencv and
+            albumentations release the GIL and run concurrently. The records
+            keep their order if TRAIN_DETERMINISTIC is set, otherwise
+            finished records are taken first. """
+        records = self.sequence.records
+        types = self.model.output_types()
+        shapes = self.model.output_shapes()
+        keys = [list(part_shapes) for part_shapes in shapes]
+        flat_types = [types[part][key] for part, part_keys in enumerate(keys)
+                      for key in part_keys]
+
+        def load(position):
+            record = records[position]
+            x_y = (self.pipeline.x_transform(record),
+                   self.pipeline.y_transform(record))
+            return [np.asarray(x_y[part][key],
+                               dtype=types[part][key].as_numpy_dtype)
+                    for part, part_keys in enumerate(keys)
+                    for key in part_keys]
+
+        def load_tensors(position):
+            flat = iter(tf.numpy_function(load, [position], flat_types))
+            x_y = []
+            for part, part_keys in enumerate(keys):
+                tensors = dict()
+                for key in part_keys:
+                    tensor = next(flat)
+                    tensor.set_shape(shapes[part][key])
+                    tensors[key] = tensor
+                x_y.append(tensors)
+            return tuple(x_y)
+
+        dataset = tf.data.Dataset.range(len(records))
+        return dataset.map(
+            load_tensors, num_parallel_calls=tf.data.AUTOTUNE,
+            deterministic=getattr(self.config, 'TRAIN_DETERMINISTIC', False))
+
+
+class ImageCacheStats(tf.keras.callbacks.Callback):
+    """ Logs the hit rate of the image cache after each epoch """
+    def __init__(self, image_cache: ImageCache) -> None:
+        super().__init__()
+        self.image_cache = image_cache
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.image_cache.log_stats(f'epoch {epoch + 1}')
+
 
 def get_model_train_details(database: PilotDatabase, model: str = None) \
         -> Tuple[str, int]:
@@ -130,8 +202,8 @@ def train(cfg: Config, tub_paths: str, model: str = None,
     logger.info(f'Records # Validation {len(validation_records)}')
     dataset.close()
 
+    train_kwargs = dict()
     # We need augmentation in validation when using crop / trapeze
-
     if 'fastai_' in model_type:
         from donkeycar.parts.pytorch.torch_data \
             import TorchTubDataset, get_default_transform
@@ -146,6 +218,9 @@ def train(cfg: Config, tub_paths: str, model: str = None,
         tune = tf.data.experimental.AUTOTUNE
         dataset_train = training_pipe.create_tf_data().prefetch(tune)
         dataset_validate = validation_pipe.create_tf_data().prefetch(tune)
+        if dataset.image_cache is not None:
+            train_kwargs['extra_callbacks'] = \
+                [ImageCacheStats(dataset.image_cache)]
 
         train_size = len(training_pipe)
         val_size = len(validation_pipe)
@@ -153,7 +228,8 @@ def train(cfg: Config, tub_paths: str, model: str = None,
     assert val_size > 0, "Not enough validation data, decrease the batch " \
                          "size or add more data."
     logger.info(f'Train with image caching: '
-                f'{getattr(cfg, "CACHE_IMAGES", "ARRAY")}')
+                f'{getattr(cfg, "CACHE_POLICY", "ARRAY")}, budget '
+                f'{getattr(cfg, "CACHE_SIZE_MB", None)} MB')
     history = kl.train(model_path=model_path,
                        train_data=dataset_train,
                        train_steps=train_size,
@@ -164,7 +240,8 @@ def train(cfg: Config, tub_paths: str, model: str = None,
                        verbose=cfg.VERBOSE_TRAIN,
                        min_delta=cfg.MIN_DELTA,
                        patience=cfg.EARLY_STOP_PATIENCE,
-                       show_plot=cfg.SHOW_PLOT)
+                       show_plot=cfg.SHOW_PLOT,
+                       **train_kwargs)
 
     # We are doing the tflite/trt conversion here on a previously saved model
     # and not on the kl.interpreter.model object directly. The reason is that
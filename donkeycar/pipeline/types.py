@@ -1,13 +1,20 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from copy import copy
+import multiprocessing as mp
 import os
+import threading
+import time
 from enum import Enum
-from typing import Any, List, Optional, TypeVar, Iterator, Iterable
+from typing import Any, List, Optional, TypeVar, Iterator, Sequence
 import logging
 import numpy as np
 from donkeycar.config import Config
-from donkeycar.parts.tub_v2 import Tub
+from donkeycar.parts.tub_index import TubIndex
+from donkeycar.pipeline.frame_cache import FrameCache, build_frame_cache
+from donkeycar.parts.tub_v2 import Tub, image_source
 from donkeycar.utils import load_image, load_pil_image, binary_to_img, \
-    img_to_arr, img_to_binary, arr_to_binary
+    img_to_arr, img_to_binary, arr_to_binary, arr_to_img
 from typing_extensions import TypedDict
 
 
@@ -41,28 +48,180 @@ TubRecordDict = TypedDict(
 )
 
 
+class ImageCache(object):
+    """
+    Memory bounded cache of the images of TubRecords. A TubDataset shares one
+    cache between its records, so training and validation records have one
+    budget. With the ARRAY policy, images are kept as arrays while they fit
+    into the budget. Beyond it the least recently used arrays are compressed
+    to JPEG, which takes about a tenth of the memory, and when only JPEGs are
+    left the least recently used ones are dropped. With the BINARY policy all
+    images are kept as JPEG. The cache is thread safe, as the parallel
+    training pipeline loads records in threads, and pickles as an empty
+    cache.
+    """
+    def __init__(self, max_bytes: Optional[int] = None,
+                 policy: CachePolicy = CachePolicy.ARRAY) -> None:
+        """
+        :param max_bytes:   memory budget, None for no limit
+        :param policy:      ARRAY or BINARY
+        """
+        if policy == CachePolicy.NOCACHE:
+            raise ValueError('ImageCache requires the ARRAY or BINARY policy')
+        self.max_bytes = max_bytes
+        self.policy = policy
+        # least recently used entries first, values are (image, bytes)
+        self.arrays: OrderedDict = OrderedDict()
+        self.binaries: OrderedDict = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.compressed = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_config(cls, config: Config) -> Optional['ImageCache']:
+        """
+        :return:    cache for CACHE_POLICY and CACHE_SIZE_MB, or None for the
+                    NOCACHE policy
+        """
+        policy = CachePolicy[getattr(config, 'CACHE_POLICY', 'ARRAY')]
+        if policy == CachePolicy.NOCACHE:
+            return None
+        size_mb = getattr(config, 'CACHE_SIZE_MB', None)
+        max_bytes = None if size_mb is None else int(size_mb * 2 ** 20)
+        return cls(max_bytes, policy)
+
+    def __reduce__(self):
+        return ImageCache, (self.max_bytes, self.policy)
+
+    def __len__(self) -> int:
+        return len(self.arrays) + len(self.binaries)
+
+    def get(self, key) -> Optional[np.ndarray]:
+        """
+        :return:    the cached image as uint8 array, or None
+        """
+        with self.lock:
+            for entries in (self.arrays, self.binaries):
+                entry = entries.get(key)
+                if entry is not None:
+                    entries.move_to_end(key)
+                    self.hits += 1
+                    break
+            else:
+                self.misses += 1
+                return None
+        if entries is self.arrays:
+            return entry[0]
+        return img_to_arr(binary_to_img(entry[0]))
+
+    def put(self, key, image: np.ndarray) -> None:
+        fits = self.max_bytes is None \
+            or self.bytes + image.nbytes <= self.max_bytes
+        if self.policy == CachePolicy.ARRAY and fits:
+            entries, entry = self.arrays, (image, image.nbytes)
+        else:
+            data = arr_to_binary(image)
+            entries, entry = self.binaries, (data, len(data))
+        with self.lock:
+            self._pop(key)
+            entries[key] = entry
+            self.bytes += entry[1]
+            victims = self._make_room()
+        self._compress(victims)
+
+    def _pop(self, key) -> None:
+        for entries in (self.arrays, self.binaries):
+            entry = entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+
+    def _over_budget(self) -> bool:
+        return self.max_bytes is not None and self.bytes > self.max_bytes
+
+    def _make_room(self) -> List:
+        """
+        Take the least recently used arrays out of the cache until it fits
+        into the budget, they are compressed outside of the lock. If there
+        are no arrays left, JPEGs are dropped.
+        """
+        victims = []
+        while self._over_budget() and self.arrays:
+            key, (image, size) = self.arrays.popitem(last=False)
+            self.bytes -= size
+            victims.append((key, image))
+        while self._over_budget() and self.binaries:
+            _, (_, size) = self.binaries.popitem(last=False)
+            self.bytes -= size
+            self.evicted += 1
+        return victims
+
+    def _compress(self, victims: List) -> None:
+        if not victims:
+            return
+        compressed = [(key, arr_to_binary(image)) for key, image in victims]
+        with self.lock:
+            for key, data in compressed:
+                # skip images which were cached again in the meantime
+                if key in self.arrays or key in self.binaries:
+                    continue
+                self.binaries[key] = (data, len(data))
+                self.bytes += len(data)
+                self.compressed += 1
+            self._make_room()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.arrays.clear()
+            self.binaries.clear()
+            self.bytes = 0
+
+    def log_stats(self, label: str = '') -> None:
+        """
+        Log the hit rate and size of the cache and reset the counters.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            rate = self.hits / lookups if lookups else 0.0
+            logger.info(f'Image cache {label}: {rate:.1%} hits of {lookups} '
+                        f'lookups, {len(self.arrays)} arrays and '
+                        f'{len(self.binaries)} JPEGs in '
+                        f'{self.bytes / 2 ** 20:.1f} MB, {self.compressed} '
+                        f'compressed, {self.evicted} dropped')
+            self.hits = self.misses = self.compressed = self.evicted = 0
+
+
 class TubRecord(object):
     def __init__(self, config: Config, base_path: str,
-                 underlying: TubRecordDict) -> None:
+                 underlying: TubRecordDict,
+                 image_cache: Optional[ImageCache] = None,
+                 frames: Optional[FrameCache] = None) -> None:
+        """
+        :param config:      donkey config
+        :param base_path:   path of the tub of the record
+        :param underlying:  the record dict
+        :param image_cache: cache of the loaded images, usually shared by
+                            the records of a TubDataset. Without one, the
+                            image is loaded on every call.
+        :param frames:      pre-decoded frames of the tub. If given, image()
+                            returns the frame, which already went through
+                            the TRANSFORMATIONS.
+        """
         self.config = config
         self.base_path = base_path
         self.underlying = underlying
-        self._cache_policy = CachePolicy[
-            getattr(self.config, 'CACHE_POLICY', 'ARRAY')]
-        self._cache_images = getattr(self.config, 'CACHE_IMAGES', True)
-        self._image: Optional[Any] = None
+        self.image_cache = image_cache
+        self.frames = frames
 
     def __copy__(self):
-        """ Make shallow copies of config and image and full copies of the rest.
+        """ Make shallow copies of config, image cache and frames and full
+        copies of the rest.
         :return TubRecord:    TubRecord copy
         """
-        tubrec = TubRecord(self.config,
-                           copy(self.base_path),
-                           copy(self.underlying))
-        tubrec._cache_policy = copy(self._cache_policy)
-        tubrec._cache_images = copy(self._cache_images)
-        tubrec._image = self._image
-        return tubrec
+        return TubRecord(self.config, copy(self.base_path),
+                         copy(self.underlying), self.image_cache, self.frames)
 
     def image(self, processor=None, as_nparray=True) -> np.ndarray:
         """
@@ -75,78 +234,39 @@ class TubRecord(object):
                             Image.open()
         :return:            Image
         """
-        if self._image is None:
-            _image = self._extract_image(as_nparray, processor)
-        else:
-            _image = self._image_from_cache(as_nparray)
-            if processor:
-                _image = processor(_image)
-        return _image
-
-    def _image_from_cache(self, as_nparray):
-        """
-        Cache policy only supports numpy array format
-        :return: Numpy array from cache
-        """
+        if self.frames is not None and as_nparray:
+            # a read-only view of the memory mapped frame
+            frame = self.frames.get(self.underlying['_index'])
+            if frame is not None:
+                return processor(frame) if processor else frame
+        _image = None
+        if self.image_cache is not None:
+            _image = self.image_cache.get(self._cache_key())
+        if _image is None:
+            return self._extract_image(as_nparray, processor)
         if not as_nparray:
-            return self._image
-
-        if self._cache_policy == CachePolicy.NOCACHE:
-            raise RuntimeError("Found cached image with policy NOCACHE")
-        elif self._cache_policy == CachePolicy.ARRAY:
-            return self._image
-        elif self._cache_policy == CachePolicy.BINARY:
-            return img_to_arr(binary_to_img(self._image))
-        else:
-            raise RuntimeError(f"Unhandled cache policy {self._cache_policy}")
-
-    def _load_image_and_cache(self, img_path):
-        # if no caching, just load but don't cache
-        if self._cache_policy == CachePolicy.NOCACHE:
-            _image = load_image(img_path, cfg=self.config)
-        # if caching full array, load and cache array
-        elif self._cache_policy == CachePolicy.ARRAY:
-            _image = load_image(img_path, cfg=self.config)
-            self._image = _image
-        # if caching is binary, only cache binary but return full array
-        elif self._cache_policy == CachePolicy.BINARY:
-            with open(img_path, 'rb') as f:
-                _image = f.read()
-                self._image = _image
-                _image = img_to_arr(binary_to_img(_image))
-        return _image
-
-    def _load_pil_image_and_cache(self, img_path):
-        _image = load_pil_image(img_path, cfg=self.config)
-        if self._cache_policy != CachePolicy.NOCACHE:
-            self._image = _image
+            _image = arr_to_img(_image)
+        if processor:
+            _image = processor(_image)
         return _image
 
-    def _cache_processed_image(self, image, as_nparray):
-        if not as_nparray:
-            if self._cache_policy != CachePolicy.NOCACHE:
-                self._image = image
-            return
-        # if numpy and array caching, cache the processed image
-        if self._cache_policy == CachePolicy.ARRAY:
-            self._image = image
-        # if numpy and binary caching, cache binary image, but return
-        # numpy
-        elif self._cache_policy == CachePolicy.BINARY:
-            self._image = arr_to_binary(image)
-        # in the case of no caching, nothing needs to be done here
+    def _cache_key(self):
+        return self.base_path, self.underlying['cam/image_array']
 
     def _extract_image(self, as_nparray, processor):
         image_path = self.underlying['cam/image_array']
-        full_path = os.path.join(self.base_path, 'images', image_path)
+        # a file path, or a file object if the image is in a packed segment
+        full_path = image_source(os.path.join(self.base_path, Tub.images()),
+                                 image_path)
         if as_nparray:
-            _image = self._load_image_and_cache(full_path)
+            _image = load_image(full_path, cfg=self.config)
         else:
-            _image = self._load_pil_image_and_cache(full_path)
+            _image = load_pil_image(full_path, cfg=self.config)
         if processor:
             # _image is now either numpy or PIL, so processing applies always
             _image = processor(_image)
-            self._cache_processed_image(_image, as_nparray)
+        if self.image_cache is not None:
+            self.image_cache.put(self._cache_key(), np.asarray(_image))
         return _image
 
     def __repr__(self) -> str:
@@ -155,7 +275,8 @@ class TubRecord(object):
 
 class TubDataset(object):
     """
-    Loads the dataset and creates a TubRecord list (or list of lists).
+    Loads the dataset and creates a TubRecord list, or a Collator of record
+    sequences if seq_size is given.
     """
 
     def __init__(self, config: Config, tub_paths: List[str],
@@ -167,18 +288,104 @@ class TubDataset(object):
         self.records: List[TubRecord] = list()
         self.train_filter = getattr(config, 'TRAIN_FILTER', None)
         self.seq_size = seq_size
+        self.image_cache = ImageCache.from_config(config)
+        self.frame_cache = getattr(config, 'FRAME_CACHE', 'use')
+
+    def _executor(self):
+        """
+        Process pool which compiles the catalogs of the record indexes, or
+        None if TUB_LOAD_WORKERS is 0.
+        """
+        workers = getattr(self.config, 'TUB_LOAD_WORKERS', None)
+        if workers == 0:
+            return None
+        start_method = 'fork' if 'fork' in mp.get_all_start_methods() \
+            else 'spawn'
+        return ProcessPoolExecutor(workers,
+                                   mp_context=mp.get_context(start_method))
+
+    def _tub_indexes(self):
+        """
+        Compiled record indexes of the tubs, with None for tubs which are
+        read from their catalogs. The catalogs of all tubs are compiled in
+        one process pool; the workers save the arrays in the tubs, so only
+        their load times are sent back.
+        """
+        if not getattr(self.config, 'TUB_RECORD_INDEX', True):
+            return [None] * len(self.tubs)
+        indexes = []
+        executor = self._executor()
+        try:
+            for tub in self.tubs:
+                try:
+                    indexes.append(TubIndex(tub, executor=executor))
+                except Exception as e:
+                    logger.warning(f'Reading tub {tub.base_path} without '
+                                   f'record index: {e}')
+                    indexes.append(None)
+            for i, index in enumerate(indexes):
+                if index is None:
+                    continue
+                try:
+                    # wait for the catalogs which are compiled
+                    index.arrays
+                except Exception as e:
+                    logger.warning(f'Reading tub {index.tub.base_path} '
+                                   f'without record index: {e}')
+                    indexes[i] = None
+        finally:
+            if executor:
+                executor.shutdown()
+        return indexes
+
+    def _frame_caches(self):
+        """
+        Pre-decoded frames of the tubs, see donkey cache-tubs. They are only
+        used if every tub has frames for all its records, so all records
+        either have transformed frames or not. In 'auto' mode missing or
+        outdated frames are built.
+        """
+        if self.frame_cache == 'off':
+            return [None] * len(self.tubs)
+        caches = []
+        for tub in self.tubs:
+            cache = FrameCache.open(tub.base_path, self.config)
+            if self.frame_cache == 'auto' \
+                    and (cache is None or not cache.covers(tub)):
+                cache = build_frame_cache(tub.base_path, self.config)
+            caches.append(cache)
+        if all(cache is not None and cache.covers(tub)
+               for cache, tub in zip(caches, self.tubs)):
+            return caches
+        if any(cache is not None for cache in caches):
+            logger.info('Decoding the images, as not all tubs have frames '
+                        'for all records; run donkey cache-tubs on them')
+        return [None] * len(self.tubs)
 
     def get_records(self):
         if not self.records:
             logger.info(f'Loading tubs from paths {self.tub_paths}')
-            for tub in self.tubs:
-                for underlying in tub:
-                    record = TubRecord(self.config, tub.base_path, underlying)
+            for tub, index, frames in zip(self.tubs, self._tub_indexes(),
+                                          self._frame_caches()):
+                start = time.perf_counter()
+                count = len(self.records)
+                for underlying in index.records() if index else tub:
+                    record = TubRecord(self.config, tub.base_path, underlying,
+                                       self.image_cache, frames)
                     if not self.train_filter or self.train_filter(record):
                         self.records.append(record)
+                seconds = time.perf_counter() - start
+                if index:
+                    # time of the workers reading the catalogs of this tub
+                    seconds += index.compile_time
+                    source = f'{index.compiled} of {len(index.arrays)} ' \
+                             f'catalogs compiled'
+                else:
+                    source = 'catalogs parsed'
+                logger.info(f'Loaded {len(self.records) - count} records of '
+                            f'{tub.base_path} in {seconds:.2f}s ({source})')
             if self.seq_size > 0:
-                seq = Collator(self.seq_size, self.records)
-                self.records = list(seq)
+                self.records = Collator(self.seq_size, self.records)
         return self.records
 
     def close(self):
@@ -186,15 +393,22 @@ class TubDataset(object):
             tub.close()
 
 
-class Collator(Iterable[List[TubRecord]]):
-    """ Builds a sequence of continuous records for RNN and similar models. """
-    def __init__(self, seq_length: int, records: List[TubRecord]):
+class Collator(Sequence[List[TubRecord]]):
+    """ Builds the sequences of continuous records for RNN and similar
+    models. The sequences are kept as rows of record positions in an int32
+    matrix, and a record list is only built when a sequence is accessed. """
+    def __init__(self, seq_length: int, records: List[TubRecord],
+                 windows: Optional[np.ndarray] = None):
         """
         :param seq_length:  length of sequence
         :param records:     input record list
+        :param windows:     positions of the records of each sequence, found
+                            in the records if not given
         """
         self.records = records
         self.seq_length = seq_length
+        self.windows = self.window_index(records, seq_length) \
+            if windows is None else windows
 
     @staticmethod
     def is_continuous(rec_1: TubRecord, rec_2: TubRecord) -> bool:
@@ -206,24 +420,62 @@ class Collator(Iterable[List[TubRecord]]):
         :return:        if first record is followed by second record
         """
         it_is = rec_1.underlying['_index'] == rec_2.underlying['_index'] - 1 \
+                and rec_1.base_path == rec_2.base_path \
+                and rec_1.underlying.get('_session_id') \
+                == rec_2.underlying.get('_session_id') \
                 and '__empty__' not in rec_1.underlying \
                 and '__empty__' not in rec_2.underlying
         return it_is
 
+    @staticmethod
+    def window_index(records: List[TubRecord], seq_length: int) \
+            -> np.ndarray:
+        """
+        Finds the runs of seq_length records, in which each record is
+        followed by the next one, see is_continuous().
+
+        :param records:     input record list
+        :param seq_length:  length of sequence
+        :return:            int32 array of shape (sequences, seq_length)
+                            with the positions of the records in each
+                            sequence
+        """
+        count = len(records)
+        if count < seq_length:
+            return np.zeros((0, seq_length), dtype=np.int32)
+        indexes = np.fromiter((r.underlying['_index'] for r in records),
+                              dtype=np.int64, count=count)
+        tubs_sessions = dict()
+        groups = np.fromiter(
+            (tubs_sessions.setdefault(
+                (r.base_path, r.underlying.get('_session_id')),
+                len(tubs_sessions)) for r in records),
+            dtype=np.int64, count=count)
+        empty = np.fromiter(('__empty__' in r.underlying for r in records),
+                            dtype=bool, count=count)
+        # breaks[i] is True if record i is not followed by record i + 1
+        breaks = (np.diff(indexes) != 1) | (np.diff(groups) != 0) \
+            | empty[:-1] | empty[1:]
+        # a sequence starting at i has no breaks between i and the end
+        breaks_before = np.concatenate(([0], np.cumsum(breaks)))
+        starts = np.flatnonzero(breaks_before[seq_length - 1:]
+                                == breaks_before[:count - seq_length + 1])
+        return (starts[:, np.newaxis] + np.arange(seq_length)) \
+            .astype(np.int32)
+
+    def __len__(self) -> int:
+        return len(self.windows)
+
+    def __getitem__(self, item):
+        """ Returns the record list of a sequence, or a Collator of the
+        sequences selected by a slice or an index array. """
+        if isinstance(item, (int, np.integer)):
+            return [self.records[i] for i in self.windows[item].tolist()]
+        return Collator(self.seq_length, self.records, self.windows[item])
+
     def __iter__(self) -> Iterator[List[TubRecord]]:
         """ Iterable interface. Returns a generator as Iterator. """
-        it = iter(self.records)
-        for this_record in it:
-            seq = [this_record]
-            seq_it = copy(it)
-            for next_record in seq_it:
-                if self.is_continuous(this_record, next_record) and \
-                        len(seq) < self.seq_length:
-                    seq.append(next_record)
-                    this_record = next_record
-                else:
-                    break
-            if len(seq) == self.seq_length:
-                yield seq
+        for window in self.windows.tolist():
+            yield [self.records[i] for i in window]
 
 
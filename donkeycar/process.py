@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Host a vehicle part in a child process.
+
+Heavy parts like the keras / tflite pilots, object detectors or lidar
+plotting compete with the drive loop for the GIL. A ProcessPart runs such a
+part in its own process, so it can use another core. Numpy arrays, like
+camera images, travel through shared memory slots and only their shape and
+dtype go through the control pipe. All other values are pickled, including
+lists like the measurements of the lidar parts.
+"""
+
+import logging
+import multiprocessing as mp
+import threading
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+from .utilities.handoff import LatestValue
+
+logger = logging.getLogger(__name__)
+
+# arrays smaller than this are pickled through the pipe
+MIN_SHARED_BYTES = 1024
+
+
+class SharedArray(NamedTuple):
+    """ Reference to an array in a shared memory block """
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class SharedArraySlots:
+    """
+    Shared memory blocks to pass numpy arrays between processes, one block
+    per argument position. The writer owns and unlinks its blocks, the
+    reader attaches to them by name and copies the arrays out, so a block
+    can be reused as soon as the reader answered. As every call waits for
+    its answer, there is never more than one array per position in flight
+    and a ring of blocks per position would only take more memory.
+    """
+    def __init__(self, min_bytes=MIN_SHARED_BYTES):
+        self.min_bytes = min_bytes
+        self.owned = {}
+        self.attached = {}
+
+    def encode(self, values):
+        """
+        Replace large arrays in values by references to shared memory
+        """
+        return tuple(self._write(i, v) if self._is_shared(v) else v
+                     for i, v in enumerate(values))
+
+    def decode(self, values):
+        """
+        Replace shared memory references in values by array copies
+        """
+        return tuple(self._read(i, v) if isinstance(v, SharedArray) else v
+                     for i, v in enumerate(values))
+
+    def _is_shared(self, value):
+        return isinstance(value, np.ndarray) and value.nbytes >= self.min_bytes
+
+    def _write(self, index, arr):
+        arr = np.ascontiguousarray(arr)
+        shm = self.owned.get(index)
+        if shm is None or shm.size < arr.nbytes:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = SharedMemory(create=True, size=arr.nbytes)
+            self.owned[index] = shm
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        return SharedArray(shm.name, arr.shape, arr.dtype.str)
+
+    def _read(self, index, ref):
+        shm = self.attached.get(index)
+        if shm is None or shm.name != ref.name:
+            if shm is not None:
+                # the writer replaced the block by a larger one
+                shm.close()
+            shm = SharedMemory(name=ref.name)
+            self.attached[index] = shm
+        view = np.ndarray(ref.shape, dtype=np.dtype(ref.dtype), buffer=shm.buf)
+        return view.copy()
+
+    def close(self):
+        for shm in self.attached.values():
+            shm.close()
+        self.attached.clear()
+        for shm in self.owned.values():
+            shm.close()
+            shm.unlink()
+        self.owned.clear()
+
+
+def _serve(part, conn, threaded, min_bytes):
+    """
+    Main function of the child process: runs requests from the pipe on the
+    part until shutdown.
+    """
+    slots = SharedArraySlots(min_bytes)
+    run = part.run
+    if threaded and hasattr(part, 'update') and hasattr(part, 'run_threaded'):
+        threading.Thread(target=part.update, daemon=True).start()
+        run = part.run_threaded
+    try:
+        while True:
+            command, args = conn.recv()
+            if command == 'shutdown':
+                break
+            try:
+                outputs = run(*slots.decode(args))
+                if isinstance(outputs, tuple):
+                    reply = ('tuple', slots.encode(outputs))
+                else:
+                    reply = ('value', slots.encode((outputs,)))
+            except Exception:
+                reply = ('error', traceback.format_exc())
+            conn.send(reply)
+    finally:
+        shutdown = getattr(part, 'shutdown', None)
+        if shutdown:
+            try:
+                shutdown()
+            except Exception:
+                logger.error(traceback.format_exc())
+        slots.close()
+        conn.close()
+
+
+class ProcessPart:
+    """
+    Proxy part which runs the wrapped part in a child process, with the same
+    run / run_threaded / shutdown contract.
+
+    Without threading, run() sends the inputs to the child and waits for the
+    outputs. With threading, run_threaded() only hands the inputs to the
+    update() thread, which forwards them to the child, and returns the
+    latest outputs, so the drive loop never waits for the child. If the
+    wrapped part is threaded itself, its update() runs in a thread of the
+    child process.
+
+    On Linux the child is forked, so the part does not need to be picklable.
+    Parts holding resources which don't survive a fork (e.g. an initialised
+    tensorflow session) should be created lazily in their first run().
+    """
+    def __init__(self, part, threaded=False, start_method=None,
+                 min_bytes=MIN_SHARED_BYTES):
+        """
+        :param part:            the part to host in the child process
+        :param threaded:        if run_threaded() should be asynchronous
+        :param start_method:    multiprocessing start method, defaults to
+                                fork where available
+        :param min_bytes:       arrays of at least this size are passed in
+                                shared memory
+        """
+        self.part = part
+        self.name = part.__class__.__name__
+        self.has_side_effects = getattr(part, 'has_side_effects', False)
+        if start_method is None:
+            start_method = 'fork' if 'fork' in mp.get_all_start_methods() \
+                else 'spawn'
+        ctx = mp.get_context(start_method)
+        self.conn, child_conn = ctx.Pipe()
+        self.slots = SharedArraySlots(min_bytes)
+        self.process = ctx.Process(target=_serve,
+                                   args=(part, child_conn, threaded, min_bytes),
+                                   name=f'part-{self.name}', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.lock = threading.Lock()
+        self.inputs = LatestValue()
+        self.latest = LatestValue()
+        self.new_inputs = threading.Event()
+        self.on = True
+        logger.info(f'Started {self.name} in process {self.process.pid}')
+
+    def _call(self, args):
+        with self.lock:
+            self.conn.send(('run', self.slots.encode(args)))
+            kind, outputs = self.conn.recv()
+        if kind == 'error':
+            raise RuntimeError(f'{self.name} failed in child process:\n'
+                               f'{outputs}')
+        outputs = self.slots.decode(outputs)
+        return outputs if kind == 'tuple' else outputs[0]
+
+    def run(self, *args):
+        return self._call(args)
+
+    def update(self):
+        seq = 0
+        while self.on:
+            if not self.new_inputs.wait(timeout=0.1):
+                continue
+            self.new_inputs.clear()
+            sample = self.inputs.get_if_newer(seq)
+            if sample is None or not self.on:
+                continue
+            seq = sample.seq
+            try:
+                self.latest.put(self._call(sample.value))
+            except (EOFError, OSError):
+                # child process went away during shutdown
+                break
+            except RuntimeError as e:
+                logger.error(e)
+
+    def run_threaded(self, *args):
+        self.inputs.put(args)
+        self.new_inputs.set()
+        return self.latest.value
+
+    def shutdown(self):
+        if not self.on:
+            return
+        self.on = False
+        self.new_inputs.set()
+        try:
+            with self.lock:
+                self.conn.send(('shutdown', None))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            logger.warning(f'Terminating process of {self.name}')
+            self.process.terminate()
+        self.conn.close()
+        self.slots.close()
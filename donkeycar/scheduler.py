@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Drift free scheduling of the vehicle drive loop.
+"""
+
+import logging
+import time
+
+from .utilities.histogram import WindowedHistogram
+
+logger = logging.getLogger(__name__)
+
+OVERRUN_POLICIES = ('skip', 'catchup', 'stretch')
+
+
+class LoopScheduler:
+    """
+    Schedules loop ticks at absolute deadlines on the monotonic clock, so
+    timing errors of single ticks don't accumulate. For better accuracy the
+    last spin_s seconds before a deadline can be busy waited instead of
+    slept, at the cost of cpu.
+
+    When a tick overruns its deadline, the overrun policy decides about the
+    next deadline:
+        skip:    drop the missed ticks and stay on the original time grid
+        catchup: run the missed ticks back to back, at most max_catchup of
+                 them, then fall back to skip
+        stretch: start the late tick immediately and begin a new time grid
+                 at its start, so the following tick is due one period
+                 later
+
+    The scheduler counts the missed deadlines and keeps a histogram of the
+    jitter, i.e. the lateness of each tick start against its deadline.
+    """
+    def __init__(self, rate_hz, overrun='skip', spin_s=0.0, max_catchup=5,
+                 window_s=10.0):
+        if rate_hz <= 0:
+            raise ValueError(f"rate_hz must be positive, not {rate_hz}")
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f"overrun must be one of {OVERRUN_POLICIES}, "
+                             f"not {overrun}")
+        self.period_ns = int(1e9 / rate_hz)
+        self.overrun = overrun
+        self.spin_ns = int(spin_s * 1e9)
+        self.max_catchup = max_catchup
+        self.jitter = WindowedHistogram(window_s=window_s)
+        self.deadline_ns = None
+        self.tick_start_ns = None
+        self.ticks = 0
+        self.missed = 0
+        self.last_jitter_ns = 0
+
+    def start(self):
+        """
+        Start the time grid, the first tick is due immediately.
+        """
+        self.deadline_ns = time.monotonic_ns()
+        self.begin_tick()
+
+    def begin_tick(self):
+        """
+        Mark the start of a tick and account its lateness as jitter.
+        """
+        now = time.monotonic_ns()
+        self.tick_start_ns = now
+        self.last_jitter_ns = max(0, now - self.deadline_ns)
+        self.jitter.record(self.last_jitter_ns * 1e-9, now * 1e-9)
+        self.ticks += 1
+
+    def wait(self):
+        """
+        Wait until the deadline of the next tick, then begin it.
+
+        :return:    the time in seconds the current tick exceeded its period
+                    or 0 if it finished in time
+        """
+        deadline = self.deadline_ns + self.period_ns
+        now = time.monotonic_ns()
+        overrun_ns = now - deadline
+        if overrun_ns > 0:
+            self.missed += 1
+            if self.overrun == 'stretch':
+                deadline = now
+            elif self.overrun == 'catchup' \
+                    and overrun_ns <= self.max_catchup * self.period_ns:
+                pass
+            else:
+                # skip the missed ticks, staying on the time grid
+                missed_ticks = overrun_ns // self.period_ns + 1
+                deadline += missed_ticks * self.period_ns
+                self.missed += missed_ticks - 1
+        self.deadline_ns = deadline
+        self._sleep_until(deadline)
+        self.begin_tick()
+        return max(0, overrun_ns) * 1e-9
+
+    def _sleep_until(self, deadline_ns):
+        remaining = deadline_ns - time.monotonic_ns() - self.spin_ns
+        if remaining > 0:
+            time.sleep(remaining * 1e-9)
+        if self.spin_ns:
+            while time.monotonic_ns() < deadline_ns:
+                pass
+
+    def stats(self, window=True):
+        """
+        Loop timing statistics
+
+        :param window:  if jitter percentiles cover only the recent window
+        :return:        dict with ticks, missed deadlines and jitter in ms
+        """
+        hist = self.jitter.window(time.monotonic_ns() * 1e-9) if window \
+            else self.jitter.total()
+        return {'ticks': self.ticks,
+                'missed': self.missed,
+                'jitter_ms': self.last_jitter_ns * 1e-6,
+                'jitter_p50_ms': hist.percentile(50) * 1000,
+                'jitter_p99_ms': hist.percentile(99) * 1000,
+                'jitter_max_ms': max(hist.max, 0) * 1000}
@@ -198,7 +198,7 @@ def drive(cfg, model_path=None, model_type=None):
         car.add(tub_writer, inputs=inputs, outputs=["tub/num_records"],
                 run_condition='recording')
     if not model_path and cfg.USE_RC:
-        tub_wiper = TubWiper(tub_writer.tub, num_records=cfg.DRIVE_LOOP_HZ)
+        tub_wiper = TubWiper(tub_writer, num_records=cfg.DRIVE_LOOP_HZ)
         car.add(tub_wiper, inputs=['user/wiper_on'])
     # start the car
     car.start(rate_hz=cfg.DRIVE_LOOP_HZ, max_loop_count=cfg.MAX_LOOPS)
@@ -488,13 +488,40 @@ LEARNING_RATE = 0.001
 LEARNING_RATE_DECAY = 0.0
 
 # Store images as 'ARRAY' (faster), 'BINARY', or 'NOCACHE' (saves RAM).
+# The cache holds up to CACHE_SIZE_MB megabytes, None for no limit. Beyond
+# it, ARRAY compresses the least recently used images to JPEG and drops the
+# least recently used JPEGs when only those are left.
 CACHE_POLICY = 'ARRAY'
+CACHE_SIZE_MB = 4096
+
+# Load training data with one 'generator' or in 'parallel' map calls, which
+# decode and augment images on all cores. TRAIN_DETERMINISTIC keeps the
+# order of the records in parallel mode, for reproducible runs.
+TRAIN_PIPELINE = 'generator'
+TRAIN_DETERMINISTIC = False
+
+# Compile the records of each tub into a binary index in the record_index
+# folder of the tub, so later trainings don't parse all catalogs again.
+# The catalogs are compiled by TUB_LOAD_WORKERS processes, None uses all
+# cores and 0 compiles them in the training process.
+TUB_RECORD_INDEX = True
+TUB_LOAD_WORKERS = None
+
+# Train from the decoded and transformed frames which 'donkey cache-tubs'
+# stores in the tubs for the current TRANSFORMATIONS settings. 'use' reads
+# them if all tubs have them, 'auto' also builds missing ones and 'off'
+# always decodes the images.
+FRAME_CACHE = 'use'
 
 # MODEL OPTIMIZATION
 # Automatically create TFLite model for faster inference on Pi.
 CREATE_TF_LITE = True
 CREATE_TENSOR_RT = False
 SAVE_MODEL_AS_H5 = False
+# Build models which take uint8 images and scale them to [0, 1] in their
+# first layer, so training and driving skip the conversion of every frame to
+# float. The uint8 input carries through the TFLite and TensorRT conversion.
+MODEL_UINT8_INPUT = False
 SEND_BEST_MODEL_TO_PI = False
 
 # Model Pruning (Remove weights to increase speed).
@@ -695,6 +722,27 @@ DRIVE_LOOP_HZ = 20
 # Max loops to run before quitting (useful for testing, None = infinite).
 MAX_LOOPS = None
 
+# What to do when a loop overruns its deadline: 'skip' the missed loops and
+# keep the timing grid, 'catchup' by running missed loops back to back, or
+# 'stretch' the timing grid from the late loop.
+DRIVE_LOOP_OVERRUN = 'skip'
+
+# Run independent parts of the loop concurrently in a thread pool. Parts are
+# ordered by their inputs and outputs, so results are the same as in the
+# serial loop.
+PARALLEL_PARTS = False
+
+# Write a trace of the drive loop to this file on shutdown, e.g.
+# '~/mycar/trace.json', which can be opened in https://ui.perfetto.dev.
+# With DRIVE_LOOP_TRACE_THREADS the update loops of threaded parts like the
+# camera are traced too.
+DRIVE_LOOP_TRACE = None
+DRIVE_LOOP_TRACE_THREADS = False
+
+# Take parts out of the drive loop whose outputs are never read by another
+# part. The dataflow of the parts is logged at start either way.
+SKIP_UNUSED_PARTS = False
+
 
 # AUTOMATION & BEHAVIORS
 
@@ -758,6 +806,27 @@ RECORD_DURING_AI = False
 # Create a new directory for every session (True) or append to existing (False).
 AUTO_CREATE_NEW_TUB = False
 
+# JPEG encoder of the recorded images, 'pil' or 'cv2', its quality and the
+# number of threads which encode the images of a record in parallel, e.g.
+# with a stereo camera or depth frames. 0 encodes in the writing thread.
+TUB_IMAGE_ENCODER = 'pil'
+TUB_IMAGE_QUALITY = 75
+TUB_ENCODER_WORKERS = 0
+# 'files' writes one file per image, 'packed' appends the images to one
+# segment file per catalog, which is much faster to copy and list. Convert
+# existing tubs with 'donkey tubpack'.
+TUB_IMAGE_STORAGE = 'files'
+
+# Write records in a background thread, so image encoding and disk writes
+# don't stall the drive loop. When the queue of pending records is full,
+# TUB_WRITE_BACKPRESSURE decides: 'drop_oldest' drops the oldest record,
+# 'block' waits for the writer and 'degrade' lowers the JPEG quality to
+# TUB_WRITE_DEGRADED_QUALITY while the queue is half full.
+TUB_WRITE_ASYNC = False
+TUB_WRITE_QUEUE_SIZE = 64
+TUB_WRITE_BACKPRESSURE = 'drop_oldest'
+TUB_WRITE_DEGRADED_QUALITY = 50
+
 # Console logging settings.
 HAVE_CONSOLE_LOGGING = True
 LOGGING_LEVEL = 'INFO'
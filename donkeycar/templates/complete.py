@@ -28,7 +28,7 @@ except:
 
 import donkeycar as dk
 from donkeycar.parts.transform import TriggeredCallback, DelayedTrigger
-from donkeycar.parts.tub_v2 import TubWriter
+from donkeycar.parts.tub_v2 import TubWriter, AsyncTubWriter
 from donkeycar.parts.datastore import TubHandler
 from donkeycar.parts.controller import LocalWebController, WebFpv, JoystickController
 from donkeycar.parts.throttle_filter import ThrottleFilter
@@ -543,8 +543,25 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
     tub_path = TubHandler(path=cfg.DATA_PATH).create_tub_path() if \
         cfg.AUTO_CREATE_NEW_TUB else cfg.DATA_PATH
     meta += getattr(cfg, 'METADATA', [])
-    tub_writer = TubWriter(tub_path, inputs=inputs, types=types, metadata=meta)
-    V.add(tub_writer, inputs=inputs, outputs=["tub/num_records"], run_condition='recording')
+    encoder_args = dict(
+        image_encoder=getattr(cfg, 'TUB_IMAGE_ENCODER', 'pil'),
+        image_quality=getattr(cfg, 'TUB_IMAGE_QUALITY', 75),
+        encoder_workers=getattr(cfg, 'TUB_ENCODER_WORKERS', 0),
+        image_storage=getattr(cfg, 'TUB_IMAGE_STORAGE', 'files'))
+    if getattr(cfg, 'TUB_WRITE_ASYNC', False):
+        tub_writer = AsyncTubWriter(
+            tub_path, inputs=inputs, types=types, metadata=meta,
+            **encoder_args,
+            queue_size=cfg.TUB_WRITE_QUEUE_SIZE,
+            backpressure=cfg.TUB_WRITE_BACKPRESSURE,
+            degraded_quality=cfg.TUB_WRITE_DEGRADED_QUALITY)
+        V.add(tub_writer, inputs=inputs,
+              outputs=["tub/num_records", "tub/queue_depth", "tub/dropped"],
+              run_condition='recording')
+    else:
+        tub_writer = TubWriter(tub_path, inputs=inputs, types=types, metadata=meta,
+                               **encoder_args)
+        V.add(tub_writer, inputs=inputs, outputs=["tub/num_records"], run_condition='recording')
 
     # Telemetry (we add the same metrics added to the TubHandler
     if cfg.HAVE_MQTT_TELEMETRY:
@@ -568,11 +585,18 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
     if has_input_controller:
         print("You can now move your controller to drive your car.")
         if isinstance(ctr, JoystickController):
-            ctr.set_tub(tub_writer.tub)
+            ctr.set_tub(tub_writer)
             ctr.print_controls()
 
+    if getattr(cfg, 'DRIVE_LOOP_TRACE', None):
+        V.enable_trace(path=cfg.DRIVE_LOOP_TRACE,
+                       threads=getattr(cfg, 'DRIVE_LOOP_TRACE_THREADS', False))
+
     # run the vehicle
-    V.start(rate_hz=cfg.DRIVE_LOOP_HZ, max_loop_count=cfg.MAX_LOOPS)
+    V.start(rate_hz=cfg.DRIVE_LOOP_HZ, max_loop_count=cfg.MAX_LOOPS,
+            parallel=getattr(cfg, 'PARALLEL_PARTS', False),
+            overrun=getattr(cfg, 'DRIVE_LOOP_OVERRUN', 'skip'),
+            skip_unused=getattr(cfg, 'SKIP_UNUSED_PARTS', False))
 
 
 class ToggleRecording:
@@ -209,7 +209,7 @@ def drive(cfg, use_joystick=False, camera_type='single', meta=[]):
     if has_input_controller:
         print("You can now move your controller to drive your car.")
         if isinstance(ctr, JoystickController):
-            ctr.set_tub(tub_writer.tub)
+            ctr.set_tub(tub_writer)
             ctr.print_controls()
 
     #
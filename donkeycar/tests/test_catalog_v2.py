@@ -5,6 +5,8 @@ import time
 import unittest
 from pathlib import Path
 
+import json
+
 from donkeycar.parts.datastore_v2 import Catalog, CatalogMetadata, Seekable
 
 
@@ -33,6 +35,54 @@ class TestCatalog(unittest.TestCase):
 
         self.assertEqual(count, 10)
 
+    def test_catalog_index_is_append_only(self):
+        catalog = Catalog(self._catalog_path)
+        manifest_size = os.path.getsize(catalog.manifest.manifest_path)
+        for i in range(0, 10):
+            catalog.write_record(self._newRecord())
+        catalog.close()
+        # the catalog manifest is not rewritten for each record
+        self.assertEqual(os.path.getsize(catalog.manifest.manifest_path),
+                         manifest_size)
+        self.assertEqual(os.path.getsize(catalog.index.path), 10 * 8)
+        catalog_2 = Catalog(self._catalog_path)
+        self.assertEqual(catalog_2.seekable.cumulative_lengths,
+                         catalog.seekable.cumulative_lengths)
+
+    def test_catalog_recovers_from_crash(self):
+        catalog = Catalog(self._catalog_path)
+        for i in range(0, 5):
+            catalog.write_record({'index': i})
+        catalog.close()
+        # the last index entry got lost and a record was only half written
+        with open(catalog.index.path, 'rb+') as f:
+            f.truncate(4 * 8 + 3)
+        with open(self._catalog_path, 'a') as f:
+            f.write('{"index": 5')
+
+        catalog_2 = Catalog(self._catalog_path)
+        self.assertEqual(catalog_2.seekable.lines(), 5)
+        catalog_2.write_record({'index': 5})
+        catalog_2.close()
+        catalog_3 = Catalog(self._catalog_path, read_only=True)
+        catalog_3.seekable.seek_line_start(6)
+        self.assertEqual(json.loads(catalog_3.seekable.readline()),
+                         {'index': 5})
+
+    def test_catalog_reads_legacy_line_lengths(self):
+        lines = [json.dumps({'index': i}) + '\n' for i in range(3)]
+        with open(self._catalog_path, 'w') as f:
+            f.writelines(lines)
+        manifest_path = os.path.join(self._path, 'test.catalog_manifest')
+        with open(manifest_path, 'w') as f:
+            f.write(json.dumps({'path': 'test.catalog_manifest',
+                                'created_at': time.time(), 'start_index': 0,
+                                'line_lengths': [len(l) for l in lines]}))
+            f.write('\n')
+        catalog = Catalog(self._catalog_path)
+        self.assertEqual(catalog.seekable.lines(), 3)
+        self.assertEqual(os.path.getsize(catalog.index.path), 3 * 8)
+
     def tearDown(self):
         shutil.rmtree(self._path)
 
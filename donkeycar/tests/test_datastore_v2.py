@@ -1,11 +1,13 @@
+import json
 import os
+import random
 import shutil
 import tempfile
 import time
 import unittest
 from pathlib import Path
 
-from donkeycar.parts.datastore_v2 import Manifest
+from donkeycar.parts.datastore_v2 import IndexRuns, Manifest
 
 
 class TestDatastore(unittest.TestCase):
@@ -44,6 +46,20 @@ class TestDatastore(unittest.TestCase):
 
         self.assertEqual((count - deleted), read_records)
 
+    def test_recover_unflushed_index(self):
+        manifest = Manifest(self._path, max_len=4, flush_interval_s=3600)
+        for i in range(10):
+            manifest.write_record(self._newRecord())
+        # simulate a crash, the manifest only knows about the catalogs
+        manifest.current_catalog.close()
+        manifest.seekeable.close()
+        manifest._is_closed = True
+
+        manifest_2 = Manifest(self._path)
+        self.assertEqual(manifest_2.current_index, 10)
+        self.assertEqual(len(list(manifest_2)), 10)
+        manifest_2.close()
+
     def test_delete_and_restore_by_set(self):
         manifest = Manifest(self._path, max_len=2)
         count = 10
@@ -67,6 +83,41 @@ class TestDatastore(unittest.TestCase):
 
         self.assertEqual(count, read_records)
 
+    def test_deleted_runs_are_persisted(self):
+        manifest = Manifest(self._path, max_len=3)
+        for i in range(12):
+            manifest.write_record({'i': i})
+        manifest.delete_records(range(2, 8))
+        manifest.delete_records({10})
+        manifest.close()
+
+        manifest_2 = Manifest(self._path, read_only=True)
+        self.assertEqual(manifest_2.deleted_indexes.runs(),
+                         [[2, 8], [10, 11]])
+        self.assertEqual([entry['i'] for entry in manifest_2],
+                         [0, 1, 8, 9, 11])
+        self.assertEqual(len(manifest_2), 5)
+        manifest_2.close()
+
+    def test_legacy_deleted_indexes(self):
+        manifest = Manifest(self._path, max_len=3)
+        for i in range(6):
+            manifest.write_record({'i': i})
+        manifest.close()
+        # older versions store a list of the deleted indexes
+        with open(os.path.join(self._path, 'manifest.json')) as f:
+            lines = f.readlines()
+        catalog_metadata = json.loads(lines[4])
+        del catalog_metadata['deleted_runs']
+        catalog_metadata['deleted_indexes'] = [1, 2, 4]
+        lines[4] = json.dumps(catalog_metadata) + '\n'
+        with open(os.path.join(self._path, 'manifest.json'), 'w') as f:
+            f.writelines(lines)
+
+        manifest_2 = Manifest(self._path, read_only=True)
+        self.assertEqual([entry['i'] for entry in manifest_2], [0, 3, 5])
+        manifest_2.close()
+
     def test_memory_mapped_read(self):
         manifest = Manifest(self._path, max_len=2)
         for i in range(10):
@@ -90,5 +141,44 @@ class TestDatastore(unittest.TestCase):
         return record
 
 
+class TestIndexRuns(unittest.TestCase):
+
+    def test_against_set(self):
+        rng = random.Random(0)
+        runs = IndexRuns()
+        reference = set()
+        for _ in range(300):
+            start = rng.randrange(200)
+            indexes = range(start, start + rng.randrange(1, 15))
+            if rng.random() < 0.6:
+                runs.update(indexes)
+                reference.update(indexes)
+            else:
+                runs.difference_update(indexes)
+                reference.difference_update(indexes)
+            self.assertEqual(len(runs), len(reference))
+            self.assertEqual(list(runs), sorted(reference))
+        # runs are disjoint and do not touch
+        for (_, end), (start, _) in zip(runs.runs(), runs.runs()[1:]):
+            self.assertLess(end, start)
+        missing = [i for i in range(300) if i not in reference]
+        self.assertEqual(runs.select_missing(range(len(missing))), missing)
+        for index in range(300):
+            self.assertEqual(index in runs, index in reference)
+            self.assertEqual(runs.rank(index),
+                             len([i for i in reference if i < index]))
+
+    def test_update_from_indexes(self):
+        runs = IndexRuns([5, 1, 2, 3, 9, 7])
+        self.assertEqual(runs.runs(), [[1, 4], [5, 6], [7, 8], [9, 10]])
+        runs.update(IndexRuns([4, 6, 8]))
+        self.assertEqual(runs.runs(), [[1, 10]])
+        self.assertEqual(runs.run_end(3), 10)
+        self.assertEqual(runs.run_end(12), 12)
+        runs.difference_update(5)
+        self.assertEqual(runs.runs(), [[1, 5], [6, 10]])
+        self.assertEqual(runs, {1, 2, 3, 4, 6, 7, 8, 9})
+
+
 if __name__ == '__main__':
     unittest.main()
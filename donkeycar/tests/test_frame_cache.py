@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from donkeycar.config import Config
+from donkeycar.parts.tub_compact import compact_tub
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.frame_cache import FRAME_FOLDER, FrameCache, \
+    build_frame_cache, frame_key
+from donkeycar.pipeline.types import TubDataset
+from donkeycar.utils import load_image
+
+
+class TestFrameCache(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self.cfg = Config()
+        self.cfg.IMAGE_W, self.cfg.IMAGE_H, self.cfg.IMAGE_DEPTH = 16, 8, 3
+        self.cfg.TUB_LOAD_WORKERS = 0
+        self.tub_paths = [os.path.join(self._path, f'tub_{i}')
+                          for i in range(2)]
+        rng = np.random.default_rng(0)
+        for path in self.tub_paths:
+            tub = Tub(path, ['cam/image_array', 'user/angle'],
+                      ['image_array', 'float'], max_catalog_len=3)
+            for i in range(5):
+                tub.write_record({'cam/image_array': rng.integers(
+                    0, 255, (8, 16, 3), dtype=np.uint8), 'user/angle': i})
+            tub.delete_records([1])
+            tub.close()
+
+    def test_frames_match_images(self):
+        os.remove(os.path.join(self.tub_paths[0], Tub.images(),
+                               '3_cam_image_array_.jpg'))
+        cache = build_frame_cache(self.tub_paths[0], self.cfg, workers=2)
+        self.assertEqual(cache.frames.shape, (5, 8, 16, 3))
+        self.assertEqual(cache.missing, {3})
+        self.assertIsNone(cache.get(3))
+        tub = Tub(self.tub_paths[0], read_only=True)
+        for record in tub.read_many([0, 1]):
+            image = load_image(tub.image_source(record['cam/image_array']),
+                               self.cfg)
+            np.testing.assert_array_equal(cache.get(record['_index']), image)
+        tub.close()
+        self.assertIsNotNone(FrameCache.open(self.tub_paths[0], self.cfg))
+        # other settings need other frames
+        self.cfg.ROI_CROP_TOP = 2
+        self.assertIsNone(FrameCache.open(self.tub_paths[0], self.cfg))
+
+    def test_dataset_uses_frames_of_all_tubs(self):
+        build_frame_cache(self.tub_paths[0], self.cfg)
+        # not all tubs have frames, so none are used
+        dataset = TubDataset(self.cfg, self.tub_paths)
+        self.assertTrue(all(r.frames is None for r in dataset.get_records()))
+        dataset.close()
+        self.cfg.FRAME_CACHE = 'auto'
+        dataset = TubDataset(self.cfg, self.tub_paths)
+        records = dataset.get_records()
+        self.assertEqual(len(records), 8)
+        image = records[1].image()
+        self.assertIsInstance(image, np.memmap)
+        self.assertFalse(image.flags.writeable)
+        self.assertEqual(records[1].image(processor=lambda x: x[:2]).shape,
+                         (2, 16, 3))
+        dataset.close()
+        self.cfg.FRAME_CACHE = 'off'
+        dataset = TubDataset(self.cfg, self.tub_paths)
+        self.assertTrue(all(r.frames is None for r in dataset.get_records()))
+        dataset.close()
+
+    def test_new_records_and_compaction(self):
+        self.cfg.FRAME_CACHE = 'auto'
+        cache = build_frame_cache(self.tub_paths[0], self.cfg)
+        tub = Tub(self.tub_paths[0])
+        self.assertTrue(cache.covers(tub))
+        tub.write_record({'cam/image_array': np.zeros((8, 16, 3), np.uint8),
+                          'user/angle': 5})
+        self.assertFalse(cache.covers(tub))
+        tub.close()
+        compact_tub(self.tub_paths[0])
+        self.assertFalse(os.path.exists(os.path.join(self.tub_paths[0],
+                                                     FRAME_FOLDER)))
+        dataset = TubDataset(self.cfg, self.tub_paths[:1])
+        records = dataset.get_records()
+        self.assertEqual(records[-1].frames.key, frame_key(self.cfg))
+        self.assertEqual(len(records[-1].frames), 5)
+        dataset.close()
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+
+if __name__ == '__main__':
+    unittest.main()
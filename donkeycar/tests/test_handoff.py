@@ -0,0 +1,39 @@
+import threading
+
+from donkeycar.utilities.handoff import LatestValue
+
+
+def test_latest_value_sequence():
+    latest = LatestValue()
+    assert latest.seq == 0
+    assert latest.value is None
+    assert latest.put('a', timestamp=10.0) == 1
+    sample = latest.get()
+    assert sample.value == 'a'
+    assert sample.seq == 1
+    assert sample.age(now=12.5) == 2.5
+    assert latest.get_if_newer(1) is None
+    latest.put('b')
+    assert latest.get_if_newer(1).value == 'b'
+
+
+def test_latest_value_consistent_across_threads():
+    latest = LatestValue((0, 0))
+    count = 20000
+
+    def produce():
+        for i in range(1, count + 1):
+            latest.put((i, i * 2))
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    last_seq = 0
+    while producer.is_alive() or last_seq < count:
+        sample = latest.get()
+        value, double = sample.value
+        # value and sequence number always belong together
+        assert double == 2 * value
+        assert sample.seq == value
+        assert sample.seq >= last_seq
+        last_seq = sample.seq
+    producer.join()
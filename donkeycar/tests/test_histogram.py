@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from donkeycar.utilities.histogram import LogHistogram, WindowedHistogram
+
+
+def test_log_histogram_percentiles():
+    values = np.random.default_rng(0).uniform(0.001, 0.1, 10000)
+    hist = LogHistogram()
+    hist.record_many(values)
+    assert hist.count == len(values)
+    assert hist.min == values.min()
+    assert hist.max == values.max()
+    assert hist.mean() == pytest.approx(values.mean())
+    for pct in (50, 90, 99):
+        assert hist.percentile(pct) == \
+            pytest.approx(np.percentile(values, pct), rel=1 / 16)
+
+
+def test_log_histogram_out_of_range():
+    hist = LogHistogram(lowest=1e-3, highest=1.0)
+    for value in (0.0, 1e-9, 5.0):
+        hist.record(value)
+    assert hist.counts[0] == 2
+    assert hist.counts[-1] == 1
+    assert hist.percentile(100) == 5.0
+
+
+def test_windowed_histogram():
+    hist = WindowedHistogram(window_s=1.0, slots=10, batch_size=8)
+    for i in range(100):
+        # one sample every 100ms, value 1ms for the first 5s then 2ms
+        value = 0.001 if i < 50 else 0.002
+        hist.record(value, i * 0.1)
+    window = hist.window(9.9)
+    assert window.count == 10
+    assert window.min == 0.002
+    assert hist.total().count == 100
+    assert hist.total().min == 0.001
+    # nothing recorded in the last second
+    assert hist.window(20.0).count == 0
@@ -83,3 +83,46 @@ def test_keras_vs_tflite_and_tensorrt(keras_pilot, tmp_dir):
 
 
 
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasLSTM])
+def test_uint8_input(keras_pilot, tmp_dir):
+    """ The uint8 model normalises the image in the graph, so with the
+        weights of the float model it gives the same output, also after
+        tflite conversion """
+    k_float = keras_pilot(interpreter=KerasInterpreter())
+    k_uint8 = keras_pilot(interpreter=KerasInterpreter(), uint8_input=True)
+    k_uint8.interpreter.model.set_weights(
+        k_float.interpreter.model.get_weights())
+    assert k_uint8.interpreter.get_input_dtype('img_in') == np.uint8
+    assert k_uint8.output_types()[0]['img_in'] == tf.uint8
+    tflite_model_path = os.path.join(tmp_dir, 'model.tflite')
+    keras_to_tflite(k_uint8.interpreter.model, tflite_model_path)
+    k_tflite = keras_pilot(interpreter=TfLite())
+    k_tflite.load(tflite_model_path)
+    assert k_tflite.uint8_input
+
+    img = get_test_img(k_float)
+    out = k_float.run(img)
+    assert k_uint8.run(img) == approx(out, rel=TOLERANCE, abs=TOLERANCE)
+    assert k_tflite.run(img) == approx(out, rel=TOLERANCE, abs=TOLERANCE)
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasCategorical])
+def test_uint8_input_tensorrt(keras_pilot, tmp_dir):
+    """ The TensorRT model of a uint8 model is fed the uint8 image """
+    if not has_trt_support():
+        pytest.skip('TensorRT is not supported')
+    k_float = keras_pilot(interpreter=KerasInterpreter())
+    k_uint8 = keras_pilot(interpreter=KerasInterpreter(), uint8_input=True)
+    k_uint8.interpreter.model.set_weights(
+        k_float.interpreter.model.get_weights())
+    savedmodel_path = os.path.join(tmp_dir, 'model.savedmodel')
+    k_uint8.interpreter.model.save(savedmodel_path)
+    k_trt = keras_pilot(interpreter=TensorRT())
+    k_trt.load(savedmodel_path)
+    assert k_trt.uint8_input
+
+    img = get_test_img(k_float)
+    out = k_float.run(img)
+    assert k_trt.run(img) == approx(out, rel=TOLERANCE, abs=TOLERANCE)
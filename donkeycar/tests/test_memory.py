@@ -66,3 +66,26 @@ class TestMemory(unittest.TestCase):
         mem.put(['myitem'], 888)
         
         assert dict(mem.items()) == {'myitem': 888}
+
+    def test_compile_keeps_values_and_api(self):
+        mem = Memory()
+        mem.put(['myitem'], 888)
+        store = mem.compile(['other'])
+        assert mem['myitem'] == 888
+        assert mem.get(['other', 'missing']) == [None, None]
+        mem['new'] = 1
+        mem.put(['a', 'b'], [2, 3])
+        assert mem.get(['new', 'a', 'b']) == [1, 2, 3]
+        assert store.getter(['a', 'b', 'myitem'])() == (2, 3, 888)
+
+    def test_compiled_setter(self):
+        mem = Memory()
+        store = mem.compile()
+        put_one = store.setter(['one'])
+        put_two = store.setter(['x', 'y'])
+        put_one((1, 2))
+        put_two([3, 4])
+        assert mem['one'] == (1, 2)
+        assert mem.get(['x', 'y']) == [3, 4]
+        with pytest.raises(IndexError):
+            put_two([5])
@@ -1,12 +1,14 @@
+import pickle
 import time
 import unittest
+from copy import copy
 from typing import List
 
 import numpy as np
 
 from donkeycar.config import Config
 from donkeycar.pipeline.sequence import TubSequence
-from donkeycar.pipeline.types import TubRecord
+from donkeycar.pipeline.types import CachePolicy, ImageCache, TubRecord
 
 
 def random_records(size: int = 100) -> List[TubRecord]:
@@ -164,5 +166,68 @@ class TestPipeline(unittest.TestCase):
             self.assertAlmostEqual(3 * ey, ty)
 
 
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # smooth images, so they compress like camera images
+        self.images = [np.repeat(rng.integers(0, 255, (12, 16, 3), np.uint8),
+                                 10, axis=0).repeat(10, axis=1)
+                       for _ in range(10)]
+        self.array_bytes = self.images[0].nbytes
+
+    def test_arrays_are_compressed_then_dropped(self):
+        cache = ImageCache(max_bytes=3 * self.array_bytes)
+        for i, image in enumerate(self.images[:3]):
+            cache.put(i, image)
+        self.assertEqual(len(cache.arrays), 3)
+        self.assertIs(cache.get(0), self.images[0])
+        # the least recently used array is compressed to make room
+        cache.put(3, self.images[3])
+        self.assertIn(1, cache.binaries)
+        self.assertEqual(cache.get(1).shape, self.images[1].shape)
+        self.assertLessEqual(cache.bytes, cache.max_bytes)
+        # with only JPEGs left the least recently used are dropped
+        small = ImageCache(max_bytes=self.array_bytes // 2)
+        for i, image in enumerate(self.images):
+            small.put(i, image)
+            self.assertLessEqual(small.bytes, small.max_bytes)
+        self.assertEqual(len(small.arrays), 0)
+        self.assertIsNone(small.get(0))
+        self.assertIsNotNone(small.get(9))
+        self.assertGreater(small.evicted, 0)
+        self.assertEqual((small.hits, small.misses), (1, 1))
+
+    def test_binary_policy_and_stats(self):
+        cache = ImageCache(policy=CachePolicy.BINARY)
+        cache.put('a', self.images[0])
+        self.assertEqual(len(cache.binaries), 1)
+        self.assertLess(cache.bytes, self.array_bytes)
+        cache.get('a')
+        cache.get('b')
+        with self.assertLogs('donkeycar.pipeline.types', 'INFO') as logs:
+            cache.log_stats('epoch 1')
+        self.assertIn('50.0% hits of 2 lookups', logs.output[0])
+        self.assertEqual(cache.hits, 0)
+        # pickles as an empty cache with the same budget
+        unpickled = pickle.loads(pickle.dumps(cache))
+        self.assertEqual((len(unpickled), unpickled.policy),
+                         (0, CachePolicy.BINARY))
+
+    def test_records_share_cache(self):
+        cfg = Config()
+        cfg.CACHE_SIZE_MB = 1
+        cache = ImageCache.from_config(cfg)
+        self.assertEqual(cache.max_bytes, 2 ** 20)
+        record = random_record()
+        record.image_cache = cache
+        cache.put(record._cache_key(), self.images[0])
+        self.assertIs(copy(record).image(), self.images[0])
+        self.assertEqual(record.image(processor=lambda x: x[:10]).shape,
+                         (10, 160, 3))
+        cfg.CACHE_POLICY = 'NOCACHE'
+        self.assertIsNone(ImageCache.from_config(cfg))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,97 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+import donkeycar as dk
+from donkeycar.process import ProcessPart, SharedArraySlots, SharedArray
+
+
+class _ImageStats:
+    """ Part which reports the process it runs in """
+    def __init__(self):
+        self.calls = 0
+
+    def run(self, img, scale):
+        self.calls += 1
+        return img * scale, float(img.mean()), os.getpid(), self.calls
+
+
+class _Failing:
+    def run(self):
+        raise ValueError('boom')
+
+
+def test_shared_array_slots_roundtrip():
+    writer, reader = SharedArraySlots(), SharedArraySlots()
+    img = np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+    encoded = writer.encode((img, 0.5, 'x'))
+    assert isinstance(encoded[0], SharedArray)
+    assert encoded[1:] == (0.5, 'x')
+    decoded = reader.decode(encoded)
+    np.testing.assert_array_equal(decoded[0], img)
+    reader.close()
+    writer.close()
+
+
+def test_shared_array_slots_detach_replaced_blocks():
+    writer, reader = SharedArraySlots(), SharedArraySlots()
+    small = np.ones((32, 32), dtype=np.uint8)
+    np.testing.assert_array_equal(reader.decode(writer.encode((small,)))[0],
+                                  small)
+    old_block = reader.attached[0]
+    large = np.full((64, 64), 2, dtype=np.uint8)
+    np.testing.assert_array_equal(reader.decode(writer.encode((large,)))[0],
+                                  large)
+    # the block of the smaller array was closed and replaced
+    assert old_block.buf is None
+    assert list(reader.attached) == [0]
+    assert reader.attached[0].name != old_block.name
+    reader.close()
+    writer.close()
+
+
+def test_process_part_run():
+    part = ProcessPart(_ImageStats())
+    try:
+        img = np.ones((120, 160, 3), dtype=np.float32)
+        for i in range(1, 4):
+            out, mean, pid, calls = part.run(img, 2.0)
+            np.testing.assert_array_equal(out, img * 2.0)
+            assert mean == 1.0
+            assert pid != os.getpid()
+            # state of the part is kept in the child process
+            assert calls == i
+    finally:
+        part.shutdown()
+    assert not part.process.is_alive()
+
+
+def test_process_part_raises_child_errors():
+    part = ProcessPart(_Failing())
+    try:
+        with pytest.raises(RuntimeError, match='boom'):
+            part.run()
+    finally:
+        part.shutdown()
+
+
+def test_vehicle_process_part_threaded():
+    vehicle = dk.Vehicle()
+    img = np.ones((120, 160, 3), dtype=np.uint8)
+    vehicle.mem.put(['cam/image_array', 'scale'], [img, 3])
+    vehicle.add(_ImageStats(), inputs=['cam/image_array', 'scale'],
+                outputs=['img', 'mean', 'pid', 'calls'], threaded=True,
+                process=True)
+    part = vehicle.parts[0]['part']
+    vehicle.parts[0]['thread'].start()
+    try:
+        deadline = time.time() + 10
+        while vehicle.mem.get(['calls'])[0] is None and time.time() < deadline:
+            vehicle.update_parts()
+            time.sleep(0.01)
+        assert vehicle.mem['mean'] == 1.0
+        assert vehicle.mem['img'].max() == 3
+    finally:
+        part.shutdown()
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from donkeycar.scheduler import LoopScheduler
+
+
+def test_scheduler_keeps_rate_without_drift():
+    scheduler = LoopScheduler(rate_hz=100)
+    scheduler.start()
+    start = time.monotonic()
+    for _ in range(20):
+        # some work which varies between ticks
+        time.sleep(0.002)
+        scheduler.wait()
+    elapsed = time.monotonic() - start
+    assert elapsed == pytest.approx(0.2, abs=0.02)
+    assert scheduler.ticks == 21
+
+
+@pytest.mark.parametrize('overrun, expected_missed', [
+    ('skip', 3), ('stretch', 1), ('catchup', 1)])
+def test_scheduler_overrun_policies(overrun, expected_missed):
+    scheduler = LoopScheduler(rate_hz=100, overrun=overrun)
+    scheduler.start()
+    deadline = scheduler.deadline_ns
+    # overrun the tick by about two and a half periods
+    time.sleep(0.035)
+    assert scheduler.wait() > 0
+    assert scheduler.missed == expected_missed
+    if overrun == 'skip':
+        # next deadline is still on the original grid
+        assert (scheduler.deadline_ns - deadline) % scheduler.period_ns == 0
+    elif overrun == 'catchup':
+        # the late tick runs immediately on its original deadline
+        assert scheduler.deadline_ns == deadline + scheduler.period_ns
+    assert scheduler.stats()['jitter_max_ms'] >= 0
+
+
+def test_scheduler_stretch_restarts_grid():
+    scheduler = LoopScheduler(rate_hz=100, overrun='stretch')
+    scheduler.start()
+    time.sleep(0.035)
+    before = time.monotonic_ns()
+    scheduler.wait()
+    after = time.monotonic_ns()
+    # the late tick is due at once, which starts the new time grid
+    late_deadline = scheduler.deadline_ns
+    assert before <= late_deadline <= after
+    assert scheduler.last_jitter_ns < scheduler.period_ns
+    # the following tick is due one period after the late tick
+    assert scheduler.wait() == 0
+    assert scheduler.deadline_ns == late_deadline + scheduler.period_ns
+    assert scheduler.tick_start_ns >= scheduler.deadline_ns
+
+
+def test_scheduler_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        LoopScheduler(rate_hz=10, overrun='later')
@@ -2,6 +2,7 @@ import os
 import subprocess
 import tarfile
 
+import donkeycar as dk
 from donkeycar import utils
 import pytest
 
@@ -81,3 +82,31 @@ def test_tubplot(cardir):
     print(f'List model dir: {os.listdir(model_dir)}')
     assert os.path.exists(model_path + '_pred.png')
 
+
+
+def test_bench_loop(tmpdir, capsys):
+    from donkeycar.management.bench import bench_loop, report
+    from donkeycar.vehicle import Vehicle
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    with tarfile.open(os.path.join(this_dir, 'tub', 'tub.tar.gz')) as file:
+        file.extractall(tmpdir)
+    template_dir = os.path.join(os.path.dirname(this_dir), 'templates')
+    cfg = dk.load_config(os.path.join(template_dir, 'cfg_complete.py'))
+    vehicle = bench_loop(cfg, os.path.join(tmpdir, 'tub'), ticks=50)
+    assert vehicle.result[0] == 50
+    assert {'MockCamera', 'LocalWebController', 'TubWriter'} \
+        <= set(vehicle.stand_ins)
+    report(vehicle)
+    out = capsys.readouterr().out
+    assert '50 ticks' in out
+    assert 'DriveMode' in out
+    assert 'tracemalloc' not in out
+    # the template only builds the bench vehicle while benchmarked
+    assert dk.vehicle.Vehicle is Vehicle
+
+    vehicle = bench_loop(cfg, os.path.join(tmpdir, 'tub'), ticks=20,
+                         trace_allocations=True)
+    assert len(vehicle.tick_peak_bytes) == 20
+    assert all(peak >= 0 for peak in vehicle.tick_peak_bytes)
+    report(vehicle)
+    assert 'Allocated per tick (tracemalloc)' in capsys.readouterr().out
@@ -0,0 +1,72 @@
+import json
+import threading
+
+import pytest
+
+from donkeycar.trace import TraceRecorder
+
+
+def test_trace_ring_buffer_keeps_latest_events():
+    trace = TraceRecorder(capacity=3)
+    for i in range(5):
+        trace.complete(f'part{i}', 'part', i, i + 0.5)
+    events = [e for e in trace.trace_events() if e['ph'] != 'M']
+    assert [e['name'] for e in events] == ['part2', 'part3', 'part4']
+    assert events[0]['ts'] == pytest.approx(2e6)
+    assert events[0]['dur'] == pytest.approx(0.5e6)
+
+
+def test_trace_dump_is_chrome_trace_json(tmp_path):
+    trace = TraceRecorder(capacity=10)
+    trace.complete('Camera', 'part', 1.0, 1.01)
+    trace.instant('Pilot', 'skip', args={'reason': 'run_condition'})
+
+    def worker():
+        trace.complete('Camera.update', 'update', 1.0, 1.05)
+    t = threading.Thread(target=worker, name='camera')
+    t.start()
+    t.join()
+
+    path = tmp_path / 'trace.json'
+    trace.dump(str(path))
+    with open(path) as f:
+        data = json.load(f)
+    events = data['traceEvents']
+    names = {e['args']['name'] for e in events if e['ph'] == 'M'}
+    assert names == {threading.current_thread().name, 'camera'}
+    skip = next(e for e in events if e['ph'] == 'i')
+    assert skip['args'] == {'reason': 'run_condition'}
+    update = next(e for e in events if e['name'] == 'Camera.update')
+    camera = next(e for e in events if e['name'] == 'Camera')
+    assert update['tid'] != camera['tid']
+
+
+def test_trace_events_while_threads_start():
+    trace = TraceRecorder(capacity=1000)
+    recorded = threading.Barrier(51, timeout=10)
+    done = threading.Event()
+
+    def worker():
+        trace.instant('start', 'x')
+        recorded.wait()
+        # stay alive, so no thread id is reused
+        done.wait()
+
+    threads = [threading.Thread(target=worker, name=f't{i}')
+               for i in range(50)]
+    for t in threads:
+        t.start()
+        # new thread names are added while the events are read
+        trace.trace_events()
+    recorded.wait()
+    names = {e['args']['name'] for e in trace.trace_events()
+             if e['ph'] == 'M'}
+    done.set()
+    for t in threads:
+        t.join()
+    assert names == {f't{i}' for i in range(50)}
+
+
+def test_trace_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        TraceRecorder(capacity=0)
@@ -234,3 +234,36 @@ def test_training_pipeline(config: Config, model_type: str,
             for k, v in batch.items():
                 assert np.isclose(v, np_dict[k]).all()
 
+
+
+@pytest.mark.parametrize('model_type', ['linear', 'behavior', 'rnn'])
+def test_parallel_pipeline(config: Config, model_type: str) -> None:
+    """
+    The parallel pipeline produces the batches of the generator pipeline,
+    in the same order if it is deterministic.
+
+    :param config:                  donkey config
+    :param model_type:              test specification of model type
+    :return:                        None
+    """
+    cfg = copy(config)
+    cfg.TRAIN_FILTER = None
+    kl = get_model_by_type(model_type, cfg)
+    tub_dir = cfg.DATA_PATH_ALL if model_type in full_tub else cfg.DATA_PATH
+    dataset = TubDataset(cfg, [tub_dir], seq_size=kl.seq_size())
+    records = dataset.get_records()
+    num_batches = len(records) // cfg.BATCH_SIZE
+
+    def batches(pipeline):
+        cfg.TRAIN_PIPELINE = pipeline
+        seq = BatchSequence(kl, cfg, records, is_train=False)
+        data = seq.create_tf_data().take(num_batches)
+        return list(data.as_numpy_iterator())
+
+    cfg.TRAIN_DETERMINISTIC = True
+    for generated, loaded in zip(batches('generator'), batches('parallel')):
+        for generated_part, loaded_part in zip(generated, loaded):
+            assert generated_part.keys() == loaded_part.keys()
+            for k, v in generated_part.items():
+                assert v.dtype == loaded_part[k].dtype
+                assert np.isclose(v, loaded_part[k]).all()
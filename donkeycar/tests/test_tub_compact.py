@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from donkeycar.parts import tub_compact
+from donkeycar.parts.tub_compact import STAGING, compact_tub, \
+    compaction_report
+from donkeycar.parts.tub_v2 import Tub
+
+
+class TestTubCompact(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+
+    def _make_tub(self, image_storage='files'):
+        tub = Tub(self._path, ['cam/image_array', 'input'],
+                  ['image_array', 'int'], max_catalog_len=4,
+                  image_storage=image_storage)
+        rng = np.random.default_rng(0)
+        for i in range(10):
+            tub.write_record({'cam/image_array': rng.integers(
+                0, 255, (8, 8, 3), dtype=np.uint8), 'input': i})
+        tub.delete_records([1, 2, 3, 7])
+        images = {r['input']: tub.read_image(r['cam/image_array'])
+                  for r in tub}
+        tub.close()
+        # an image which no record refers to
+        with open(os.path.join(self._path, Tub.images(), 'stray.jpg'),
+                  'wb') as f:
+            f.write(b'stray')
+        return images
+
+    def _image_files(self):
+        return sorted(os.listdir(os.path.join(self._path, Tub.images())))
+
+    def _check(self, images, originals=(0, 4, 5, 6, 8, 9)):
+        tub = Tub(self._path, read_only=True)
+        records = list(tub)
+        self.assertEqual([r['input'] for r in records], list(originals))
+        self.assertEqual([r['_index'] for r in records],
+                         list(range(len(originals))))
+        self.assertEqual(tub.original_indexes().tolist(), list(originals))
+        self.assertEqual(len(tub.manifest.deleted_indexes), 0)
+        self.assertTrue(tub.columns_synced)
+        self.assertEqual(tub.column('input').tolist(), list(originals))
+        for record in records:
+            self.assertEqual(tub.read_image(record['cam/image_array']),
+                             images[record['input']])
+        tub.close()
+        self.assertFalse(os.path.exists(os.path.join(self._path, STAGING)))
+
+    def test_compact_image_files(self):
+        images = self._make_tub()
+        report = compaction_report(self._path)
+        self.assertEqual(report['deleted'], 4)
+        self.assertEqual(report['unreferenced_images'], 5)
+        self.assertEqual(compact_tub(self._path), (6, 4))
+        self._check(images)
+        self.assertEqual(self._image_files(),
+                         sorted(f'{i}_cam_image_array_.jpg' for i in range(6)))
+        self.assertEqual(
+            sorted(name for name in os.listdir(self._path)
+                   if name.startswith('catalog_') and name.endswith('.catalog')),
+            ['catalog_0.catalog', 'catalog_1.catalog'])
+
+        # new records don't overwrite the renamed images
+        tub = Tub(self._path)
+        tub.write_record({'cam/image_array': np.zeros((8, 8, 3)),
+                          'input': 10})
+        tub.delete_records([0])
+        tub.close()
+        self.assertEqual(compact_tub(self._path), (6, 1))
+        tub = Tub(self._path, read_only=True)
+        self.assertEqual(tub.original_indexes().tolist(), [4, 5, 6, 8, 9, 10])
+        self.assertEqual(tub.read_image(list(tub)[0]['cam/image_array']),
+                         images[4])
+        tub.close()
+
+    def test_compact_packed_images(self):
+        images = self._make_tub('packed')
+        self.assertEqual(compact_tub(self._path), (6, 4))
+        self._check(images)
+        self.assertEqual(self._image_files(),
+                         ['catalog_0.images', 'catalog_0.images_index',
+                          'catalog_1.images', 'catalog_1.images_index'])
+
+    def test_resume_interrupted_compaction(self):
+        images = self._make_tub()
+        # interrupted while staging, staging starts over
+        with mock.patch.object(tub_compact, '_mark',
+                               side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                compact_tub(self._path)
+        self.assertTrue(os.path.exists(os.path.join(self._path, STAGING)))
+
+        # interrupted while moving the compacted files in, which is resumed
+        replace = os.replace
+        calls = []
+
+        def failing_replace(source, target):
+            calls.append(source)
+            if len(calls) == 9:
+                raise KeyboardInterrupt
+            replace(source, target)
+
+        with mock.patch.object(tub_compact.os, 'replace', failing_replace):
+            with self.assertRaises(KeyboardInterrupt):
+                compact_tub(self._path)
+        self.assertTrue(os.path.exists(
+            os.path.join(self._path, STAGING, 'cleared')))
+        self.assertEqual(compact_tub(self._path), (6, 4))
+        self._check(images)
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from copy import copy
+
+import numpy as np
+
+from donkeycar.config import Config
+from donkeycar.parts.tub_index import INDEX_FOLDER, IndexRecord, TubIndex
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.types import TubDataset
+
+
+class TestTubIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        inputs = ['cam/image_array', 'user/angle', 'user/mode', 'count',
+                  'flag', 'vec']
+        types = ['image_array', 'float', 'str', 'int', 'boolean', 'vector']
+        self.tub = Tub(self._path, inputs, types, max_catalog_len=4)
+        self._write(range(10))
+        self.tub.delete_records([2, 3, 7])
+
+    def _write(self, numbers):
+        image = np.zeros((8, 8, 3), dtype=np.uint8)
+        for i in numbers:
+            self.tub.write_record({
+                'cam/image_array': image, 'user/angle': i / 10,
+                'user/mode': 'user' if i % 2 else None, 'count': i,
+                'flag': i % 3 == 0, 'vec': [i, i + 0.5]})
+
+    def test_records_match_catalogs(self):
+        index = TubIndex(self.tub)
+        records = index.records()
+        self.assertTrue(all(isinstance(r, IndexRecord) for r in records))
+        self.assertEqual([dict(r) for r in records], list(self.tub))
+        self.assertNotIn('user/mode', records[0])
+        self.assertIsInstance(records[1]['vec'], list)
+        self.assertEqual(index.column('count').tolist(),
+                         [0, 1, 4, 5, 6, 8, 9])
+        self.assertEqual(len(index.column('count', include_deleted=True)), 10)
+
+    def test_cache_is_reused_and_updated(self):
+        TubIndex(self.tub)
+        self.assertEqual(sorted(os.listdir(os.path.join(self._path,
+                                                        INDEX_FOLDER))),
+                         ['catalog_0.npy', 'catalog_1.npy', 'catalog_2.npy',
+                          'index.json'])
+        mtimes = [os.stat(os.path.join(self._path, INDEX_FOLDER,
+                                       f'catalog_{i}.npy')).st_mtime_ns
+                  for i in range(3)]
+        self._write(range(10, 13))
+        self.tub.flush()
+        self.tub.restore_records([3])
+        index = TubIndex(self.tub)
+        # only the catalogs which changed are compiled again
+        mtimes_2 = [os.stat(os.path.join(self._path, INDEX_FOLDER,
+                                         f'catalog_{i}.npy')).st_mtime_ns
+                    for i in range(4)]
+        self.assertEqual(mtimes_2[:2], mtimes[:2])
+        self.assertNotEqual(mtimes_2[2], mtimes[2])
+        self.assertEqual([dict(r) for r in index.records()], list(self.tub))
+
+    def test_record_changes_and_pickle(self):
+        record = TubIndex(self.tub).records()[1]
+        changed = copy(record)
+        changed['pilot/angle'] = 0.5
+        del changed['vec']
+        self.assertNotIn('pilot/angle', record)
+        self.assertEqual(changed['pilot/angle'], 0.5)
+        self.assertNotIn('vec', changed)
+        unpickled = pickle.loads(pickle.dumps(changed))
+        self.assertEqual(type(unpickled), dict)
+        self.assertEqual(unpickled, dict(changed))
+
+    def test_dataset_uses_index(self):
+        self.tub.close()
+        cfg = Config()
+        dataset = TubDataset(cfg, [self._path])
+        records = dataset.get_records()
+        self.assertIsInstance(records[0].underlying, IndexRecord)
+        self.assertEqual([r.underlying['_index'] for r in records],
+                         [0, 1, 4, 5, 6, 8, 9])
+        dataset.close()
+        cfg.TUB_RECORD_INDEX = False
+        dataset = TubDataset(cfg, [self._path])
+        self.assertEqual([r.underlying for r in dataset.get_records()],
+                         [dict(r.underlying) for r in records])
+        dataset.close()
+
+    def test_dataset_loads_tubs_in_parallel(self):
+        self.tub.close()
+        paths = [self._path]
+        for i in range(3):
+            path = os.path.join(self._path, f'tub_{i}')
+            tub = Tub(path, ['count'], ['int'], max_catalog_len=3)
+            for j in range(7):
+                tub.write_record({'count': 100 * i + j})
+            tub.close()
+            paths.append(path)
+        cfg = Config()
+        cfg.TUB_LOAD_WORKERS = 2
+        dataset = TubDataset(cfg, paths)
+        with self.assertLogs('donkeycar.pipeline.types', 'INFO') as logs:
+            records = dataset.get_records()
+        self.assertEqual([r.underlying['count'] for r in records],
+                         [0, 1, 4, 5, 6, 8, 9] + [100 * i + j for i in range(3)
+                                                  for j in range(7)])
+        self.assertEqual(len([line for line in logs.output
+                              if 'catalogs compiled' in line]), 4)
+        # the workers saved the arrays, which are mapped by the dataset
+        index = records[-1].underlying.index
+        self.assertEqual(index.compiled, 3)
+        self.assertTrue(all(isinstance(a, np.memmap) for a in index.arrays))
+        dataset.close()
+
+    def tearDown(self):
+        if not self.tub.manifest._is_closed:
+            self.tub.close()
+        shutil.rmtree(self._path)
+
+
+if __name__ == '__main__':
+    unittest.main()
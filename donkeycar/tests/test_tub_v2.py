@@ -1,10 +1,16 @@
+import importlib.util
+import os
 import shutil
 import tempfile
 import unittest
 
-from donkeycar.parts.tub_v2 import Tub
+import numpy as np
+from PIL import Image
+
+from donkeycar.parts.tub_v2 import Tub, pack_images, unpack_images
 from donkeycar.pipeline.types import TubRecord, Collator
 from donkeycar.config import Config
+from donkeycar.utils import train_test_split
 
 
 class TestTub(unittest.TestCase):
@@ -58,6 +64,32 @@ class TestTub(unittest.TestCase):
                             for rec_1, rec_2 in zip(it1, it2))), \
                     'Non continuous records found'
 
+    def test_sequence_windows(self):
+        cfg = Config()
+        underlyings = [{'_index': i, '_session_id': 'a' if i < 6 else 'b'}
+                       for i in range(10) if i != 3]
+        underlyings[1]['__empty__'] = True
+        records = [TubRecord(cfg, self.tub.base_path, underlying)
+                   for underlying in underlyings]
+        seq = Collator(2, records)
+        self.assertEqual(seq.windows.dtype, np.int32)
+        # record 1 is empty, 3 is missing and the session changes at 6
+        self.assertEqual(seq.windows.tolist(),
+                         [[3, 4], [5, 6], [6, 7], [7, 8]])
+        self.assertEqual([[r.underlying['_index'] for r in l] for l in seq],
+                         [[4, 5], [6, 7], [7, 8], [8, 9]])
+        self.assertEqual(seq[1], [records[5], records[6]])
+        self.assertEqual(len(Collator(3, records)), 2)
+        self.assertEqual(len(Collator(10, records)), 0)
+
+        part = seq[np.array([3, 0])]
+        self.assertIsInstance(part, Collator)
+        self.assertEqual([l[0].underlying['_index'] for l in part], [8, 4])
+        train, val = train_test_split(seq, test_size=0.25)
+        self.assertEqual((len(train), len(val)), (3, 1))
+        self.assertEqual(sorted(train.windows.tolist() + val.windows.tolist()),
+                         seq.windows.tolist())
+
     def test_delete_last_n_records(self):
         start_len = len(self.tub)
         self.tub.delete_last_n_records(2)
@@ -72,5 +104,322 @@ class TestTub(unittest.TestCase):
         shutil.rmtree(cls._path)
 
 
+class TestTubRandomAccess(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self.tub = Tub(self._path, ['input'], ['int'], max_catalog_len=5)
+        for i in range(23):
+            self.tub.write_record({'input': i})
+        self.tub.delete_records([0, 4, 5, 6, 12, 22])
+
+    def test_getitem(self):
+        records = list(self.tub)
+        self.assertEqual(len(records), 17)
+        for i in range(-len(records), len(records)):
+            self.assertEqual(self.tub[i], records[i])
+        self.assertEqual(self.tub[3:15:4], records[3:15:4])
+        self.assertEqual(self.tub[::-1], records[::-1])
+        self.assertEqual(self.tub[100:], [])
+        with self.assertRaises(IndexError):
+            self.tub[17]
+
+    def test_read_many(self):
+        records = list(self.tub)
+        positions = [16, 0, 7, 7, 3, -2]
+        self.assertEqual(self.tub.read_many(positions),
+                         [records[i] for i in positions])
+        # the records of the current catalog are read while it is written
+        self.tub.write_record({'input': 23})
+        self.assertEqual(self.tub[-1]['input'], 23)
+        self.tub.restore_records([22])
+        self.assertEqual([r['input'] for r in self.tub[-2:]], [22, 23])
+
+    def test_read_only(self):
+        self.tub.close()
+        tub = Tub(self._path, read_only=True)
+        self.assertEqual(tub[::3], list(tub)[::3])
+        tub.close()
+
+    def tearDown(self):
+        if not self.tub.manifest._is_closed:
+            self.tub.close()
+        shutil.rmtree(self._path)
+
+
+class TestTubImages(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self.inputs = ['cam/image_array_a', 'cam/image_array_b',
+                       'cam/depth_array', 'input']
+        self.types = ['image_array', 'image_array', 'gray16_array', 'int']
+
+    def _records(self, count):
+        rng = np.random.default_rng(0)
+        return [{'cam/image_array_a': rng.integers(0, 255, (24, 32, 3),
+                                                   dtype=np.uint8),
+                 'cam/image_array_b': rng.integers(0, 255, (24, 32, 3),
+                                                   dtype=np.uint8),
+                 'cam/depth_array': rng.integers(0, 65535, (24, 32),
+                                                 dtype=np.uint16),
+                 'input': i} for i in range(count)]
+
+    def _check(self, tub, records):
+        written = list(tub)
+        self.assertEqual([r['input'] for r in written],
+                         [r['input'] for r in records])
+        self.assertEqual([r['_index'] for r in written],
+                         list(range(len(records))))
+        for record, source in zip(written, records):
+            depth = np.asarray(Image.open(
+                tub.image_source(record['cam/depth_array'])))
+            np.testing.assert_array_equal(depth, source['cam/depth_array'])
+            image = np.asarray(Image.open(
+                tub.image_source(record['cam/image_array_b'])))
+            self.assertEqual(image.shape, (24, 32, 3))
+
+    def test_parallel_encoding_keeps_order(self):
+        tub = Tub(self._path, self.inputs, self.types, encoder_workers=3)
+        records = self._records(6)
+        tub.write_record(records[0])
+        errors = tub.write_records(records[1:])
+        self.assertEqual(errors, [None] * 5)
+        self._check(tub, records)
+        tub.close()
+
+    def test_failed_images_skip_record(self):
+        tub = Tub(self._path, self.inputs, self.types, encoder_workers=2)
+        records = self._records(3)
+        records[1]['cam/image_array_a'] = np.zeros((2, 2, 7))
+        errors = tub.write_records(records)
+        self.assertIsNotNone(errors[1])
+        written = list(tub)
+        self.assertEqual([r['input'] for r in written], [0, 2])
+        self.assertEqual([r['_index'] for r in written], [0, 1])
+        tub.close()
+
+    def test_failed_record_keeps_image_names(self):
+        tub = Tub(self._path, self.inputs, self.types)
+        records = self._records(4)
+        records[0]['cam/image_array_a'] = np.zeros((2, 2, 7))
+        tub.write_records(records[:2])
+        tub.write_records(records[2:])
+        written = list(tub)
+        self.assertEqual([r['input'] for r in written], [1, 2, 3])
+        # each record has its own images, named after its index
+        self.assertEqual([r['cam/depth_array'] for r in written],
+                         [f'{i}_cam_depth_array_.png' for i in range(3)])
+        self._check(tub, records[1:])
+        tub.close()
+
+    @unittest.skipUnless(importlib.util.find_spec('cv2'), 'needs opencv')
+    def test_cv2_encoder(self):
+        tub = Tub(self._path, self.inputs, self.types, image_encoder='cv2',
+                  image_quality=90)
+        records = self._records(2)
+        tub.write_records(records)
+        self._check(tub, records)
+        tub.close()
+
+    def _image_files(self):
+        return sorted(name for name in os.listdir(
+            os.path.join(self._path, Tub.images()))
+            if name.endswith(('.jpg', '.png')))
+
+    def test_packed_images(self):
+        tub = Tub(self._path, self.inputs, self.types, max_catalog_len=4,
+                  image_storage='packed')
+        records = self._records(10)
+        tub.write_records(records)
+        # three catalogs, so three segments and no image files
+        self.assertEqual(self._image_files(), [])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self._path, Tub.images()))),
+            [f'catalog_{i}{suffix}' for i in range(3)
+             for suffix in ('.images', '.images_index')])
+        self._check(tub, records)
+        tub.close()
+        # training records read the images through the shared reader
+        cfg = Config()
+        cfg.IMAGE_W, cfg.IMAGE_H, cfg.IMAGE_DEPTH = 32, 24, 3
+        underlying = list(Tub(self._path, read_only=True))[7]
+        underlying['cam/image_array'] = underlying['cam/image_array_a']
+        image = TubRecord(cfg, self._path, underlying).image()
+        self.assertEqual(image.shape, (24, 32, 3))
+
+    def test_pack_and_unpack_images(self):
+        tub = Tub(self._path, self.inputs, self.types, max_catalog_len=4)
+        records = self._records(6)
+        tub.write_records(records)
+        tub.delete_records([2])
+        tub.close()
+        files = self._image_files()
+        data = {name: open(os.path.join(self._path, Tub.images(), name),
+                           'rb').read() for name in files}
+        manifest_path = os.path.join(self._path, 'manifest.json')
+        with open(manifest_path) as f:
+            manifest = f.read()
+        self.assertEqual(pack_images(self._path), 18)
+        self.assertEqual(self._image_files(), [])
+        # the catalogs are only read
+        with open(manifest_path) as f:
+            self.assertEqual(f.read(), manifest)
+        tub = Tub(self._path, read_only=True)
+        for name in files:
+            self.assertEqual(tub.read_image(name), data[name])
+        tub.close()
+        # an unpack interrupted while removing the segments is finished
+        for name in files:
+            with open(os.path.join(self._path, Tub.images(), name), 'wb') \
+                    as f:
+                f.write(data[name])
+        os.remove(os.path.join(self._path, Tub.images(), 'catalog_0.images'))
+        self.assertEqual(unpack_images(self._path), 18)
+        self.assertEqual(self._image_files(), files)
+        for name in files:
+            with open(os.path.join(self._path, Tub.images(), name), 'rb') \
+                    as f:
+                self.assertEqual(f.read(), data[name])
+        self.assertEqual(
+            [name for name in os.listdir(os.path.join(self._path,
+                                                      Tub.images()))
+             if 'catalog' in name], [])
+
+    def test_partial_segment_index(self):
+        tub = Tub(self._path, self.inputs, self.types, image_storage='packed')
+        tub.write_records(self._records(2))
+        tub.close()
+        index = os.path.join(self._path, Tub.images(), 'catalog_0.images_index')
+        with open(index, 'a') as f:
+            f.write('2_cam_image_array_a_.jpg 12')
+        tub = Tub(self._path, self.inputs, self.types, image_storage='packed')
+        self.assertNotIn('2_cam_image_array_a_.jpg', tub.images)
+        records = self._records(3)
+        tub.write_records(records[2:])
+        tub.close()
+        tub = Tub(self._path, read_only=True)
+        self.assertEqual(len(tub.images.locations), 9)
+        self._check(tub, records)
+        tub.close()
+
+    def test_unknown_encoder(self):
+        with self.assertRaises(ValueError):
+            Tub(self._path, self.inputs, self.types, image_encoder='png')
+        with self.assertRaises(ValueError):
+            Tub(self._path, self.inputs, self.types, image_storage='zip')
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+
+class TestTubColumns(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self.inputs = ['user/angle', 'user/mode', 'count', 'flag', 'vec']
+        self.types = ['float', 'str', 'int', 'boolean', 'vector']
+
+    def _write(self, tub, numbers):
+        for i in numbers:
+            tub.write_record({'user/angle': i / 10, 'user/mode': 'user',
+                              'count': i if i % 2 else None, 'flag': i % 3 == 0,
+                              'vec': [i, i + 0.5]})
+
+    def test_to_frame(self):
+        tub = Tub(self._path, self.inputs, self.types, max_catalog_len=4)
+        self._write(tub, range(6))
+        tub.delete_records([1])
+        frame = tub.to_frame()
+        self.assertEqual(list(frame.columns), ['_timestamp_ms', 'user/angle',
+                                               'count', 'flag', 'vec_0',
+                                               'vec_1'])
+        self.assertEqual(frame.index.tolist(), [0, 2, 3, 4, 5])
+        self.assertEqual(frame['count'].tolist(), [0, 0, 3, 0, 5])
+        self.assertEqual(frame['flag'].tolist(), [1, 0, 1, 0, 0])
+        self.assertEqual(frame['vec_1'].tolist(), [0.5, 2.5, 3.5, 4.5, 5.5])
+        self.assertEqual(frame['user/angle'].dtype, np.float32)
+        # without deleted records the frame maps the column files
+        column = tub.column('user/angle', include_deleted=True)
+        self.assertIsInstance(column, np.memmap)
+        frame = tub.to_frame(['user/angle'], include_deleted=True)
+        base = frame['user/angle'].to_numpy()
+        while not isinstance(base, np.memmap):
+            base = base.base
+        self.assertEqual(base.filename, column.filename)
+        with self.assertRaises(KeyError):
+            tub.column('user/mode')
+        tub.close()
+
+    def test_columns_follow_the_catalogs(self):
+        tub = Tub(self._path, self.inputs, self.types, max_catalog_len=4)
+        self._write(tub, range(6))
+        tub.close()
+        # rows of a record which is not in the catalogs are dropped, missing
+        # rows are caught up when the tub is opened
+        column_path = os.path.join(self._path, 'columns', 'count')
+        with open(column_path, 'ab') as f:
+            f.write(np.zeros(1, dtype='<i8').tobytes())
+        with open(os.path.join(self._path, 'columns', 'user_angle'), 'rb+') \
+                as f:
+            f.truncate(4 * 4)
+        tub = Tub(self._path, self.inputs, self.types, max_catalog_len=4)
+        self._write(tub, range(6, 8))
+        np.testing.assert_array_equal(
+            tub.column('user/angle'),
+            np.arange(8, dtype=np.float32) / np.float32(10))
+        self.assertEqual(os.path.getsize(column_path), 8 * 8)
+        tub.close()
+
+    def test_columns_after_failed_batch(self):
+        tub = Tub(self._path, self.inputs, self.types, max_catalog_len=4)
+        records = [{'user/angle': i / 10, 'count': i} for i in range(3)]
+        write_record = tub.manifest.write_record
+
+        def failing_write(record, **kwargs):
+            if record['_index'] == 1:
+                raise OSError('write failed')
+            write_record(record, **kwargs)
+
+        tub.manifest.write_record = failing_write
+        with self.assertRaises(OSError):
+            tub.write_records(records)
+        tub.manifest.write_record = write_record
+        # the record in the catalog has its row
+        self.assertEqual(tub.column('count').tolist(), [0])
+        self._write(tub, range(3, 5))
+        self.assertEqual(tub.column('count').tolist(), [0, 3, 0])
+        # columns which fell behind are caught up from the catalogs
+        tub.columns.truncate(1)
+        self._write(tub, [5])
+        self.assertEqual(tub.column('count').tolist(), [0, 3, 0, 5])
+        tub.close()
+
+    def test_tub_without_columns(self):
+        tub = Tub(self._path, self.inputs, self.types, max_catalog_len=4)
+        self._write(tub, range(10))
+        tub.close()
+        shutil.rmtree(os.path.join(self._path, 'columns'))
+        tub = Tub(self._path, read_only=True)
+        self.assertFalse(tub.columns_synced)
+        self.assertEqual(tub.column('count').tolist(),
+                         [0, 1, 0, 3, 0, 5, 0, 7, 0, 9])
+        self.assertEqual(tub.column('vec').shape, (10, 2))
+        tub.close()
+        self.assertFalse(os.path.exists(os.path.join(self._path, 'columns')))
+        # a writable tub writes the columns when they are first read
+        tub = Tub(self._path, self.inputs, self.types, max_catalog_len=4)
+        self._write(tub, [10])
+        self.assertEqual(tub.to_frame()['count'].tolist()[-3:], [0, 9, 0])
+        self._write(tub, [11])
+        self.assertEqual(len(tub.column('count')), 12)
+        tub.close()
+        self.assertEqual(os.path.getsize(
+            os.path.join(self._path, 'columns', 'count')), 12 * 8)
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+
 if __name__ == '__main__':
     unittest.main()
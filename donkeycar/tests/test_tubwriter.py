@@ -1,9 +1,13 @@
 import shutil
 import tempfile
+import threading
+import time
 import unittest
 from random import randint
 
-from donkeycar.parts.tub_v2 import Tub, TubWriter
+import numpy as np
+
+from donkeycar.parts.tub_v2 import AsyncTubWriter, Tub, TubWriter
 
 
 class TestTub(unittest.TestCase):
@@ -35,6 +39,160 @@ class TestTub(unittest.TestCase):
                 id += 1
                 write_counts.pop(0)
 
+    def test_async_tubwriter_writes_all_records(self):
+        tub_writer = AsyncTubWriter(self._path,
+                                    inputs=['cam/image_array', 'input'],
+                                    types=['image_array', 'int'],
+                                    backpressure='block', queue_size=4)
+        image = np.zeros((12, 16, 3), dtype=np.uint8)
+        for i in range(20):
+            num_records, depth, dropped = tub_writer.run(image, i)
+        self.assertEqual(num_records, 20)
+        self.assertEqual(dropped, 0)
+        tub_writer.close()
+        records = list(Tub(self._path, read_only=True))
+        self.assertEqual([r['input'] for r in records], list(range(20)))
+        self.assertTrue(all('_timestamp_ms' in r for r in records))
+
+    def test_async_tubwriter_drops_oldest(self):
+        tub_writer = AsyncTubWriter(self._path, inputs=['input'],
+                                    types=['int'], queue_size=2)
+        # stall the writer thread on the first record
+        started, release = threading.Event(), threading.Event()
+        write_records = tub_writer.tub.write_records
+
+        def slow_write(records, **kwargs):
+            started.set()
+            release.wait()
+            return write_records(records, **kwargs)
+
+        tub_writer.tub.write_records = slow_write
+        tub_writer.run(0)
+        started.wait()
+        for i in range(1, 6):
+            num_records, depth, dropped = tub_writer.run(i)
+        self.assertEqual(depth, 2)
+        # the first record is held by the writer, 1 - 3 got dropped
+        self.assertEqual(dropped, 3)
+        self.assertEqual(num_records, 3)
+        release.set()
+        tub_writer.close()
+        records = list(Tub(self._path, read_only=True))
+        self.assertEqual([r['input'] for r in records], [0, 4, 5])
+
+    def test_async_tubwriter_survives_errors(self):
+        tub_writer = AsyncTubWriter(self._path, inputs=['input'],
+                                    types=['int'], backpressure='block',
+                                    queue_size=2, fsync_interval_s=0)
+        sync = tub_writer.tub.sync
+        calls = []
+
+        def failing_sync():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                raise OSError('sync failed')
+            sync()
+
+        tub_writer.tub.sync = failing_sync
+        for i in range(10):
+            tub_writer.run(i)
+        self.assertTrue(tub_writer.thread.is_alive())
+        tub_writer.close()
+        self.assertIsNone(tub_writer.error)
+        records = list(Tub(self._path, read_only=True))
+        self.assertEqual([r['input'] for r in records], list(range(10)))
+
+    def test_async_tubwriter_counts_failed_records(self):
+        tub_writer = AsyncTubWriter(self._path, inputs=['input'],
+                                    types=['int'])
+        write_records = tub_writer.tub.write_records
+
+        def failing_write(records, **kwargs):
+            if records[0]['input'] == 0:
+                raise OSError('write failed')
+            return write_records(records, **kwargs)
+
+        tub_writer.tub.write_records = failing_write
+        tub_writer.run(0)
+        for _ in range(500):
+            if tub_writer.failed:
+                break
+            time.sleep(0.01)
+        num_records, depth, dropped = tub_writer.run(1)
+        self.assertEqual(tub_writer.failed, 1)
+        self.assertEqual(dropped, 1)
+        self.assertEqual(num_records, 1)
+        tub_writer.close()
+        records = list(Tub(self._path, read_only=True))
+        self.assertEqual([r['input'] for r in records], [1])
+
+    def test_async_tubwriter_writes_after_thread_died(self):
+        tub_writer = AsyncTubWriter(self._path, inputs=['input'],
+                                    types=['int'], backpressure='block',
+                                    queue_size=2)
+        write_records = tub_writer.tub.write_records
+
+        def dying_write(records, **kwargs):
+            tub_writer.tub.write_records = write_records
+            raise SystemExit
+
+        tub_writer.tub.write_records = dying_write
+        tub_writer.run(0)
+        tub_writer.thread.join(5)
+        self.assertIsInstance(tub_writer.error, SystemExit)
+        # a full queue doesn't block run() any more
+        for i in range(1, 10):
+            num_records, depth, dropped = tub_writer.run(i)
+        self.assertEqual(depth, 0)
+        # the batch the thread died on counts as lost
+        self.assertEqual(dropped, 1)
+        tub_writer.close()
+        records = list(Tub(self._path, read_only=True))
+        # the batch the thread died on is lost
+        self.assertEqual([r['input'] for r in records], list(range(1, 10)))
+
+    def test_async_tubwriter_erases_queued_records(self):
+        tub_writer = AsyncTubWriter(self._path, inputs=['input'],
+                                    types=['int'], backpressure='block')
+        for i in range(10):
+            tub_writer.run(i)
+        while tub_writer.tub.manifest.current_index < 10:
+            time.sleep(0.01)
+        # stall the writer thread on the next record
+        started, release = threading.Event(), threading.Event()
+        write_records = tub_writer.tub.write_records
+
+        def slow_write(records, **kwargs):
+            started.set()
+            release.wait()
+            return write_records(records, **kwargs)
+
+        tub_writer.tub.write_records = slow_write
+        tub_writer.run(10)
+        started.wait()
+        for i in range(11, 41):
+            tub_writer.run(i)
+        # only drops queued records
+        tub_writer.delete_last_n_records(10)
+        self.assertEqual(tub_writer.queue.qsize(), 20)
+        # drops the rest of the queue and deletes 5 records once the writer
+        # wrote the record it holds
+        tub_writer.delete_last_n_records(25)
+        tub_writer.run(41)
+        num_records, depth, dropped = tub_writer.run(42)
+        self.assertEqual(num_records, 13)
+        self.assertEqual(dropped, 0)
+        release.set()
+        tub_writer.close()
+        tub = Tub(self._path, read_only=True)
+        self.assertEqual([r['input'] for r in tub], [0, 1, 2, 3, 4, 5, 41, 42])
+        self.assertEqual(tub.manifest.current_index, 13)
+
+    def test_async_tubwriter_rejects_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            AsyncTubWriter(self._path, inputs=['input'], types=['int'],
+                           backpressure='unknown')
+
     def tearDown(self):
         shutil.rmtree(self._path)
 
@@ -1,6 +1,10 @@
+import json
+import time
+
 import pytest
 import donkeycar as dk
 from donkeycar.parts.transform import Lambda
+from donkeycar.utilities.handoff import LatestValue
 
 
 def _get_sample_lambda():
@@ -54,4 +58,216 @@ def test_should_raise_assertion_on_non_boolean_threaded_for_add_part():
     threaded = 'non_boolean'
     with pytest.raises(AssertionError):
         vehicle.add(_get_sample_lambda(), threaded=threaded)
-        pytest.fail("threaded is not a boolean: %r" % threaded)
\ No newline at end of file
+        pytest.fail("threaded is not a boolean: %r" % threaded)
+
+class _Counter:
+    def __init__(self):
+        self.count = 0
+
+    def run(self):
+        self.count += 1
+        return self.count
+
+
+def test_part_every_n():
+    vehicle = dk.Vehicle()
+    fast, slow = _Counter(), _Counter()
+    vehicle.add(fast, outputs=['fast'])
+    vehicle.add(slow, outputs=['slow'], every_n=3)
+    for _ in range(9):
+        vehicle.update_parts()
+    assert fast.count == 9
+    assert slow.count == 3
+    # outputs of a skipped part stay in memory
+    assert vehicle.mem['slow'] == 3
+
+
+def test_part_rate_hz():
+    vehicle = dk.Vehicle()
+    slow = _Counter()
+    vehicle.add(slow, outputs=['slow'], rate_hz=0.001)
+    for _ in range(5):
+        vehicle.update_parts()
+    assert slow.count == 1
+
+
+def test_should_raise_assertion_on_rate_hz_and_every_n():
+    vehicle = dk.Vehicle()
+    with pytest.raises(AssertionError):
+        vehicle.add(_Counter(), rate_hz=5, every_n=2)
+    with pytest.raises(AssertionError):
+        vehicle.add(_Counter(), every_n=0)
+
+
+def _build_pipeline_vehicle():
+    from donkeycar.parts.explode import ExplodeDict
+    vehicle = dk.Vehicle()
+    vehicle.add(Lambda(lambda: 1), outputs=['a'])
+    vehicle.add(Lambda(lambda: 2), outputs=['b'])
+    vehicle.add(Lambda(lambda a: a + 10), inputs=['a'], outputs=['c'])
+    vehicle.add(Lambda(lambda b: {'x': b}), inputs=['b'], outputs=['d'])
+    vehicle.add(Lambda(lambda a: a * 100), inputs=['a'], outputs=['a'])
+    vehicle.add(ExplodeDict(vehicle.mem), inputs=['d'])
+    vehicle.add(Lambda(lambda a, c, x: a + c + x), inputs=['a', 'c', 'x'],
+                outputs=['e'])
+    return vehicle
+
+
+def _part_channels(vehicle):
+    return {k: v for k, v in vehicle.mem.items() if not k.startswith('loop/')}
+
+
+def test_build_stages():
+    from donkeycar.executor import build_stages
+    vehicle = _build_pipeline_vehicle()
+    stages = build_stages(vehicle.parts, vehicle.mem)
+    parts = [entry['part'] for entry in vehicle.parts]
+    as_indexes = [[parts.index(entry['part']) for entry in stage]
+                  for stage in stages]
+    # part 4 overwrites 'a' which is read by part 2, so it can share the
+    # stage of part 2 but can't move before it; the ExplodeDict is a barrier
+    assert as_indexes == [[0, 1], [2, 3, 4], [5], [6]]
+
+
+def test_parallel_vehicle_run_matches_serial():
+    serial = _build_pipeline_vehicle()
+    serial.start(rate_hz=100, max_loop_count=3)
+    parallel = _build_pipeline_vehicle()
+    parallel.start(rate_hz=100, max_loop_count=3, parallel=True)
+    assert _part_channels(parallel) == _part_channels(serial)
+    assert list(parallel.mem.keys()) == list(serial.mem.keys())
+    assert parallel.mem['e'] == 100 + 11 + 2
+
+
+def test_compiled_vehicle_run_matches_serial():
+    serial = _build_pipeline_vehicle()
+    serial.start(rate_hz=100, max_loop_count=3)
+    compiled = _build_pipeline_vehicle()
+    compiled.start(rate_hz=100, max_loop_count=3, compiled=True)
+    assert _part_channels(compiled) == _part_channels(serial)
+    both = _build_pipeline_vehicle()
+    both.start(rate_hz=100, max_loop_count=3, compiled=True, parallel=True)
+    assert _part_channels(both) == _part_channels(serial)
+
+
+def test_profiler_stats(vehicle):
+    vehicle.start(rate_hz=100, max_loop_count=5)
+    part = vehicle.parts[0]['part']
+    stats = vehicle.profiler.stats(part)
+    assert stats['count'] == 5
+    assert 0 <= stats['min'] <= stats['50%'] <= stats['max']
+    assert vehicle.profiler.stats(part, window=True)['count'] == 5
+
+
+def test_loop_stats_in_memory(vehicle):
+    vehicle.start(rate_hz=200, max_loop_count=4)
+    assert vehicle.mem['loop/ticks'] == 4
+    assert vehicle.mem['loop/missed_deadlines'] >= 0
+    assert vehicle.mem['loop/jitter_p99_ms'] >= 0
+
+
+class _ThreadedSource:
+    """ Threaded part which produces a new frame on every other tick """
+    def __init__(self):
+        self.ticks = 0
+        self.frame = [0]
+
+    def update(self):
+        pass
+
+    def run_threaded(self):
+        self.ticks += 1
+        if self.ticks % 2 == 1:
+            self.frame = [self.ticks]
+        return self.frame
+
+
+def test_skip_stale_runs_only_on_new_samples():
+    vehicle = dk.Vehicle()
+    vehicle.add(_ThreadedSource(), outputs=['cam/image_array'], threaded=True)
+    vehicle.add(Lambda(lambda img: img[0]), inputs=['cam/image_array'],
+                outputs=['cam/value'])
+    pilot, always = _Counter(), _Counter()
+    vehicle.add(Lambda(lambda v: pilot.run()), inputs=['cam/value'],
+                outputs=['pilot/count'], skip_stale=True)
+    vehicle.add(Lambda(lambda v: always.run()), inputs=['cam/value'],
+                outputs=['always/count'])
+    for _ in range(6):
+        vehicle.update_parts()
+    assert always.count == 6
+    assert pilot.count == 3
+    assert vehicle.mem['cam/value'] == 5
+
+
+class _PublishingSource:
+    """ Threaded part which publishes its frames through a LatestValue """
+    def __init__(self):
+        self.latest = LatestValue(0)
+        self.on = True
+
+    def update(self):
+        while self.on:
+            self.latest.put(self.latest.value + 1)
+            time.sleep(0.005)
+
+    def run_threaded(self):
+        return self.latest.value
+
+    def shutdown(self):
+        self.on = False
+
+
+def test_trace_records_parts_skips_and_sleep(tmp_path):
+    path = tmp_path / 'trace.json'
+    vehicle = dk.Vehicle()
+    vehicle.enable_trace(path=str(path), threads=True)
+    vehicle.add(_PublishingSource(), outputs=['cam/value'], threaded=True)
+    vehicle.add(Lambda(lambda: False), outputs=['run_pilot'])
+    vehicle.add(_Counter(), outputs=['pilot/count'], run_condition='run_pilot')
+    vehicle.start(rate_hz=50, max_loop_count=5)
+
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    parts = [e for e in events if e.get('cat') == 'part']
+    assert len(parts) == 10
+    assert {e['name'] for e in parts} == {'_PublishingSource', 'Lambda'}
+    skips = [e for e in events if e.get('cat') == 'skip']
+    assert len(skips) == 5
+    assert skips[0]['name'] == '_Counter'
+    assert len([e for e in events if e['name'] == 'sleep']) == 4
+    assert len([e for e in events if e['name'] == 'tick']) == 5
+    updates = [e for e in events if e.get('cat') == 'update']
+    assert updates and updates[0]['name'] == '_PublishingSource.update'
+
+
+def test_analyze_reports_dataflow_problems():
+    vehicle = dk.Vehicle()
+    vehicle.mem['user/mode'] = 'user'
+    vehicle.add(Lambda(lambda a: a), inputs=['pilot/angle'],
+                outputs=['feedback'])
+    vehicle.add(Lambda(lambda m, j: 1), inputs=['user/mode', 'loop/jitter_ms'],
+                outputs=['pilot/angle'])
+    vehicle.add(Lambda(lambda f: 2), inputs=['feedback'],
+                outputs=['pilot/angle'])
+    vehicle.add(Lambda(lambda x: x), inputs=['missing'], outputs=['unused'])
+    report = vehicle.analyze()
+    assert report.unused_outputs == [(3, 'unused')]
+    assert report.unwritten_inputs == [(3, 'missing')]
+    assert report.read_before_write == [(0, 'pilot/angle', 1)]
+    assert report.write_conflicts == [('pilot/angle', [1, 2])]
+    assert report.unused_parts == [3]
+
+
+def test_skip_unused_parts():
+    vehicle = dk.Vehicle()
+    source, unused, sink = _Counter(), _Counter(), _Counter()
+    vehicle.add(source, outputs=['count'])
+    vehicle.add(Lambda(lambda c: c), inputs=['count'], outputs=['copy'])
+    vehicle.add(Lambda(lambda c: unused.run()), inputs=['copy'],
+                outputs=['unused'])
+    vehicle.add(Lambda(lambda c: None), inputs=['count'])
+    vehicle.start(rate_hz=100, max_loop_count=3, skip_unused=True)
+    assert source.count == 3
+    assert unused.count == 0
+    assert len(vehicle.parts) == 2
+    assert len(vehicle.skipped_parts) == 2
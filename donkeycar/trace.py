@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tracing of the vehicle drive loop in the Chrome trace event format, which
+can be opened in https://ui.perfetto.dev or chrome://tracing.
+"""
+
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TraceRecorder:
+    """
+    Records trace events into a preallocated ring buffer, so tracing can
+    stay on for a long drive and only keeps the most recent events. Times
+    are seconds from time.perf_counter(). Events can be recorded from any
+    thread, each thread shows up as its own track.
+    """
+    def __init__(self, capacity=100000):
+        if capacity <= 0:
+            raise ValueError("capacity must be greater than zero")
+        self.capacity = capacity
+        self.events = [None] * capacity
+        self.count = 0
+        self._next = itertools.count()
+        self.thread_names = {}
+        self._names_lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def _append(self, event):
+        # next() on itertools.count is atomic, so threads never share a slot
+        i = next(self._next)
+        self.events[i % self.capacity] = event
+        self.count = max(self.count, i + 1)
+
+    def _tid(self):
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            with self._names_lock:
+                self.thread_names[tid] = threading.current_thread().name
+        return tid
+
+    def complete(self, name, category, start, end, args=None, tid=None):
+        """
+        Record a span of time, like a part call or a sleep.
+        """
+        self._append(('X', name, category, start, end - start,
+                      tid if tid is not None else self._tid(), args))
+
+    def instant(self, name, category, ts=None, args=None):
+        """
+        Record a point in time, like a skipped part.
+        """
+        self._append(('i', name, category,
+                      ts if ts is not None else time.perf_counter(), 0.0,
+                      self._tid(), args))
+
+    def trace_events(self):
+        """
+        The recorded events, oldest first, as Chrome trace event dicts.
+        """
+        first = max(0, self.count - self.capacity)
+        events = []
+        # threads may still add their names while the events are dumped
+        with self._names_lock:
+            thread_names = list(self.thread_names.items())
+        for tid, name in thread_names:
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': self.pid,
+                           'tid': tid, 'args': {'name': name}})
+        for i in range(first, self.count):
+            event = self.events[i % self.capacity]
+            if event is None:
+                # still being written by another thread
+                continue
+            ph, name, category, ts, dur, tid, args = event
+            event = {'ph': ph, 'name': name, 'cat': category,
+                     'ts': ts * 1e6, 'pid': self.pid, 'tid': tid}
+            if ph == 'X':
+                event['dur'] = dur * 1e6
+            else:
+                event['s'] = 't'
+            if args:
+                event['args'] = args
+            events.append(event)
+        return events
+
+    def dump(self, path):
+        """
+        Write the recorded events as Chrome trace JSON.
+        """
+        path = os.path.expanduser(path)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(),
+                       'displayTimeUnit': 'ms'}, f)
+        logger.info(f'Wrote {min(self.count, self.capacity)} trace events '
+                    f'to {path}')
+
+    def clear(self):
+        self.count = 0
+        self._next = itertools.count()
@@ -0,0 +1,79 @@
+import time
+from typing import Any, NamedTuple
+
+
+class Sample(NamedTuple):
+    """
+    A value published through a LatestValue, with its sequence number and the
+    time.time() at which the producer published it.
+    """
+    value: Any
+    seq: int
+    timestamp: float
+
+    def age(self, now=None) -> float:
+        """
+        Seconds since the sample was published
+        """
+        return (now if now is not None else time.time()) - self.timestamp
+
+
+class LatestValue:
+    """
+    Hands the latest value of a producer thread to its consumers without
+    locks. Each publish builds a new immutable Sample and swaps it in with a
+    single reference assignment, which is atomic in CPython, so a consumer
+    always gets a consistent value, sequence number and timestamp. The
+    producer must not mutate a value after publishing it; publish a copy of
+    buffers which are filled in place.
+
+    Consumers compare sequence numbers to tell a fresh sample from one they
+    have already seen.
+
+    An optional on_put callback is called with each new sample in the
+    producer thread, e.g. to trace the iterations of the producer.
+    """
+    def __init__(self, value=None) -> None:
+        self._sample = Sample(value, 0, time.time())
+        self.on_put = None
+
+    def put(self, value, timestamp=None) -> int:
+        """
+        Publish a new value. Only a single producer may call this.
+
+        :param value:       the value, which must not be mutated afterwards
+        :param timestamp:   producer time.time() of the value, defaults to now
+        :return:            the sequence number of the new sample
+        """
+        seq = self._sample.seq + 1
+        sample = Sample(value, seq,
+                        timestamp if timestamp is not None else time.time())
+        self._sample = sample
+        if self.on_put is not None:
+            self.on_put(sample)
+        return seq
+
+    def get(self) -> Sample:
+        """
+        The latest sample
+        """
+        return self._sample
+
+    def get_if_newer(self, seq):
+        """
+        The latest sample if it is newer than the given sequence number,
+        otherwise None.
+        """
+        sample = self._sample
+        return sample if sample.seq > seq else None
+
+    @property
+    def value(self):
+        return self._sample.value
+
+    @property
+    def seq(self) -> int:
+        return self._sample.seq
+
+    def age(self, now=None) -> float:
+        return self._sample.age(now)
@@ -0,0 +1,191 @@
+from math import inf
+
+import numpy as np
+
+
+class LogHistogram:
+    """
+    Fixed memory histogram of positive values with logarithmic buckets, in
+    the spirit of HDR histograms. Every power of two between lowest and
+    highest is split into sub_buckets linear buckets, so percentiles have a
+    relative error below 1 / sub_buckets. Values outside the range are
+    counted in the first or last bucket, while min, max and mean stay exact.
+    """
+    def __init__(self, lowest=1e-6, highest=1e3, sub_buckets=16) -> None:
+        if not 0 < lowest < highest:
+            raise ValueError("lowest must be positive and less than highest")
+        self.lowest = lowest
+        self.highest = highest
+        self.sub_buckets = sub_buckets
+        self.min_exp = int(np.frexp(lowest)[1])
+        self.max_exp = int(np.frexp(highest)[1])
+        self.counts = np.zeros((self.max_exp - self.min_exp + 1) * sub_buckets,
+                               dtype=np.int64)
+        self.clear()
+
+    def clear(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = inf
+        self.max = -inf
+
+    def indexes(self, values):
+        """
+        Bucket indexes of an array of values
+        """
+        mantissa, exp = np.frexp(values)
+        # mantissa is in [0.5, 1) so it maps linearly onto the sub buckets
+        idx = (exp - self.min_exp) * self.sub_buckets \
+            + ((mantissa - 0.5) * (2 * self.sub_buckets)).astype(np.int64)
+        idx[(exp < self.min_exp) | (values <= 0)] = 0
+        idx[exp > self.max_exp] = len(self.counts) - 1
+        return idx
+
+    def bucket_values(self):
+        """
+        Representative value of each bucket, which is its midpoint
+        """
+        i = np.arange(len(self.counts))
+        exp = i // self.sub_buckets + self.min_exp
+        sub = i % self.sub_buckets + 0.5
+        return (0.5 + sub / (2 * self.sub_buckets)) * np.exp2(exp)
+
+    def record(self, value):
+        self.record_many(np.array([value], dtype=np.float64))
+
+    def record_many(self, values):
+        """
+        Record an array of values in one vectorized step
+        """
+        if len(values) == 0:
+            return
+        self.add_indexed(self.indexes(values), values)
+
+    def add_indexed(self, idx, values):
+        """
+        Record an array of values whose bucket indexes are already known
+        """
+        self.counts += np.bincount(idx, minlength=len(self.counts))
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        """
+        Add the counts of another histogram with the same layout
+        """
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, pct):
+        """
+        Approximate percentile of the recorded values, clamped to the exact
+        min and max.
+
+        :param pct: percentile in [0, 100]
+        :return:    value at the percentile or 0 if nothing was recorded
+        """
+        if self.count == 0:
+            return 0.0
+        rank = max(pct / 100.0 * self.count, 1)
+        i = int(np.searchsorted(np.cumsum(self.counts), rank))
+        if i >= len(self.counts) - 1:
+            # the last bucket also collects everything above highest
+            return self.max
+        value = self.bucket_values()[i]
+        return min(max(float(value), self.min), self.max)
+
+
+class WindowedHistogram:
+    """
+    LogHistogram of all values since start plus a sliding window over the
+    last window_s seconds. The window is kept as a ring of slot histograms,
+    each covering window_s / slots seconds, so memory stays fixed.
+
+    Recording only stores the value and its time in a preallocated batch,
+    which is folded into the histograms with numpy when it is full or when
+    the statistics are read. This keeps the cost per sample to a few list
+    stores.
+    """
+    def __init__(self, window_s=10.0, slots=10, batch_size=1024,
+                 **kwargs) -> None:
+        if window_s <= 0 or slots <= 0 or batch_size <= 0:
+            raise ValueError("window_s, slots and batch_size must be "
+                             "greater than zero")
+        self.kwargs = kwargs
+        self.totals = LogHistogram(**kwargs)
+        self.slots = [LogHistogram(**kwargs) for _ in range(slots)]
+        self.slot_ids = [None] * slots
+        self.slots_per_s = slots / window_s
+        self.batch_size = batch_size
+        self.values = [0.0] * batch_size
+        self.times = [0.0] * batch_size
+        self.pending = 0
+
+    def record(self, value, now):
+        """
+        Record value at time now, in seconds of a monotonic clock
+        """
+        i = self.pending
+        self.values[i] = value
+        self.times[i] = now
+        self.pending = i + 1
+        if i + 1 == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Fold the pending samples into the histograms
+        """
+        n = self.pending
+        if n == 0:
+            return
+        self.pending = 0
+        values = np.array(self.values[:n], dtype=np.float64)
+        idx = self.totals.indexes(values)
+        self.totals.add_indexed(idx, values)
+        first_id = int(self.times[0] * self.slots_per_s)
+        last_id = int(self.times[n - 1] * self.slots_per_s)
+        if first_id == last_id:
+            # usually the whole batch falls into a single slot
+            self._slot(first_id).add_indexed(idx, values)
+            return
+        slot_ids = (np.array(self.times[:n]) * self.slots_per_s) \
+            .astype(np.int64)
+        for slot_id in np.unique(slot_ids):
+            mask = slot_ids == slot_id
+            self._slot(int(slot_id)).add_indexed(idx[mask], values[mask])
+
+    def _slot(self, slot_id):
+        pos = slot_id % len(self.slots)
+        if self.slot_ids[pos] != slot_id:
+            self.slots[pos].clear()
+            self.slot_ids[pos] = slot_id
+        return self.slots[pos]
+
+    def total(self):
+        """
+        Histogram of all values recorded so far
+        """
+        self.flush()
+        return self.totals
+
+    def window(self, now):
+        """
+        Histogram of the values recorded in the window ending at now
+        """
+        self.flush()
+        merged = LogHistogram(**self.kwargs)
+        oldest = int(now * self.slots_per_s) - len(self.slots)
+        for slot_id, hist in zip(self.slot_ids, self.slots):
+            if slot_id is not None and slot_id > oldest:
+                merged.merge(hist)
+        return merged
@@ -148,7 +148,7 @@ def normalize_image(img_arr_uint):
     :param img_arr_uint:    [0,255]uint8 numpy image array
     :return:                [0,1] float32 numpy image array
     """
-    return img_arr_uint.astype(np.float64) * ONE_BYTE_SCALE
+    return np.multiply(img_arr_uint, ONE_BYTE_SCALE, dtype=np.float32)
 
 
 def denormalize_image(img_arr_float):
@@ -179,7 +179,7 @@ def load_pil_image(filename, cfg):
         return img
 
     except Exception as e:
-        logger.error(f'failed to load image from {filename}: {e.message}')
+        logger.error(f'failed to load image from {filename}: {e}')
         return None
 
 
@@ -225,7 +225,7 @@ def load_image_sized(filename, image_width, image_height, image_depth):
         return img_arr
 
     except Exception as e:
-        logger.error(f'failed to load image from {filename}: {e.message}')
+        logger.error(f'failed to load image from {filename}: {e}')
         return None
 
 
@@ -496,6 +496,7 @@ def get_model_by_type(model_type: str, cfg: 'Config') -> Union['KerasPilot', 'Fa
         model_type = cfg.DEFAULT_MODEL_TYPE
     logger.info(f'get_model_by_type: model type is: {model_type}')
     input_shape = (cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)
+    uint8_input = getattr(cfg, 'MODEL_UINT8_INPUT', False)
     if 'tflite_' in model_type:
         interpreter = TfLite()
         used_model_type = model_type.replace('tflite_', '')
@@ -514,36 +515,45 @@ def get_model_by_type(model_type: str, cfg: 'Config') -> Union['KerasPilot', 'Fa
 
     used_model_type = EqMemorizedString(used_model_type)
     if used_model_type == "linear":
-        kl = KerasLinear(interpreter=interpreter, input_shape=input_shape)
+        kl = KerasLinear(interpreter=interpreter, input_shape=input_shape,
+                         uint8_input=uint8_input)
     elif used_model_type == "categorical":
         kl = KerasCategorical(
             interpreter=interpreter,
             input_shape=input_shape,
-            throttle_range=cfg.MODEL_CATEGORICAL_MAX_THROTTLE_RANGE)
+            throttle_range=cfg.MODEL_CATEGORICAL_MAX_THROTTLE_RANGE,
+            uint8_input=uint8_input)
     elif used_model_type == 'inferred':
-        kl = KerasInferred(interpreter=interpreter, input_shape=input_shape)
+        kl = KerasInferred(interpreter=interpreter, input_shape=input_shape,
+                           uint8_input=uint8_input)
     elif used_model_type == "imu":
-        kl = KerasIMU(interpreter=interpreter, input_shape=input_shape)
+        kl = KerasIMU(interpreter=interpreter, input_shape=input_shape,
+                      uint8_input=uint8_input)
     elif used_model_type == "memory":
         mem_length = getattr(cfg, 'SEQUENCE_LENGTH', 3)
         mem_depth = getattr(cfg, 'MEM_DEPTH', 0)
         kl = KerasMemory(interpreter=interpreter, input_shape=input_shape,
-                         mem_length=mem_length, mem_depth=mem_depth)
+                         mem_length=mem_length, mem_depth=mem_depth,
+                         uint8_input=uint8_input)
     elif used_model_type == "behavior":
         kl = KerasBehavioral(
             interpreter=interpreter,
             input_shape=input_shape,
             throttle_range=cfg.MODEL_CATEGORICAL_MAX_THROTTLE_RANGE,
-            num_behavior_inputs=len(cfg.BEHAVIOR_LIST))
+            num_behavior_inputs=len(cfg.BEHAVIOR_LIST),
+            uint8_input=uint8_input)
     elif used_model_type == 'localizer':
         kl = KerasLocalizer(interpreter=interpreter, input_shape=input_shape,
-                            num_locations=cfg.NUM_LOCATIONS)
+                            num_locations=cfg.NUM_LOCATIONS,
+                            uint8_input=uint8_input)
     elif used_model_type == 'rnn':
         kl = KerasLSTM(interpreter=interpreter, input_shape=input_shape,
-                       seq_length=cfg.SEQUENCE_LENGTH)
+                       seq_length=cfg.SEQUENCE_LENGTH,
+                       uint8_input=uint8_input)
     elif used_model_type == '3d':
         kl = Keras3D_CNN(interpreter=interpreter, input_shape=input_shape,
-                         seq_length=cfg.SEQUENCE_LENGTH)
+                         seq_length=cfg.SEQUENCE_LENGTH,
+                         uint8_input=uint8_input)
     else:
         known = [k + u for k in ('', 'tflite_', 'tensorrt_')
                  for u in used_model_type.mem]
@@ -577,10 +587,20 @@ def train_test_split(data_list: List[Any],
     take a list, split it into two sets while selecting a
     random element in order to shuffle the results.
     use the test_size to choose the split percent.
-    shuffle is always True, left there to be backwards compatible
+    shuffle is always True, left there to be backwards compatible.
+    Sequences other than lists, like the Collator, are split by selecting
+    their items with index arrays.
     '''
     target_train_size = int(len(data_list) * (1. - test_size))
 
+    if shuffle and not isinstance(data_list, list):
+        train_positions = np.array(
+            random.sample(range(len(data_list)), target_train_size),
+            dtype=np.int64)
+        is_val = np.ones(len(data_list), dtype=bool)
+        is_val[train_positions] = False
+        return data_list[train_positions], data_list[np.flatnonzero(is_val)]
+
     if shuffle:
         train_data = []
         i_sample = 0
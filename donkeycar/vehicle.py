@@ -7,53 +7,102 @@ Created on Sun Jun 25 10:44:24 2017
 """
 
 import time
-import numpy as np
 import logging
 from threading import Thread
+from .analysis import analyze_parts
 from .memory import Memory
+from .executor import ParallelExecutor
+from .process import ProcessPart
+from .scheduler import LoopScheduler
+from .trace import TraceRecorder
+from .utilities.histogram import WindowedHistogram
+from .utilities.handoff import LatestValue
 from prettytable import PrettyTable
 import traceback
 
 logger = logging.getLogger(__name__)
 
+PROFILE_PERCENTILES = [50, 90, 99, 99.9]
+
+# Memory channels with the loop timing, written by the vehicle on each tick
+LOOP_STATS_CHANNELS = ['loop/ticks', 'loop/missed_deadlines', 'loop/jitter_ms']
+LOOP_JITTER_CHANNELS = ['loop/jitter_p50_ms', 'loop/jitter_p99_ms']
+
+
+def _same_objects(outputs, previous):
+    """
+    Check if run_threaded() returned the same objects as before, which means
+    the update thread did not produce anything new.
+    """
+    if outputs is previous:
+        return True
+    if isinstance(outputs, (tuple, list)) \
+            and isinstance(previous, (tuple, list)) \
+            and len(outputs) == len(previous):
+        return all(a is b for a, b in zip(outputs, previous))
+    return False
+
 
 class PartProfiler:
-    def __init__(self):
+    """
+    Keeps the run times of the parts in fixed memory histograms, both since
+    start and over a sliding window of the last window_s seconds. Recording
+    a sample is cheap enough to stay enabled in production.
+
+    If a trace recorder is set, every part call is also recorded as a trace
+    event.
+    """
+    def __init__(self, window_s=10.0):
+        self.window_s = window_s
         self.records = {}
+        self.starts = {}
+        self.trace = None
 
     def profile_part(self, p):
-        self.records[p] = { "times" : [] }
+        self.records[p] = WindowedHistogram(window_s=self.window_s)
 
     def on_part_start(self, p):
-        self.records[p]['times'].append(time.time())
+        self.starts[p] = time.perf_counter()
 
     def on_part_finished(self, p):
-        now = time.time()
-        prev = self.records[p]['times'][-1]
-        delta = now - prev
-        thresh = 0.000001
-        if delta < thresh or delta > 100000.0:
-            delta = thresh
-        self.records[p]['times'][-1] = delta
-
-    def report(self):
-        logger.info("Part Profile Summary: (times in ms)")
+        now = time.perf_counter()
+        start = self.starts[p]
+        self.records[p].record(now - start, now)
+        if self.trace is not None:
+            self.trace.complete(p.__class__.__name__, 'part', start, now)
+
+    def stats(self, p, window=False):
+        """
+        Run time statistics of a part in ms
+
+        :param p:       the part
+        :param window:  if only the last window_s seconds are included
+        :return:        dict of count, max, min, avg and percentiles
+        """
+        record = self.records[p]
+        hist = record.window(time.perf_counter()) if window \
+            else record.total()
+        stats = {'count': hist.count}
+        if hist.count:
+            stats.update({'max': hist.max * 1000,
+                          'min': hist.min * 1000,
+                          'avg': hist.mean() * 1000})
+            for pct in PROFILE_PERCENTILES:
+                stats[f'{pct}%'] = hist.percentile(pct) * 1000
+        return stats
+
+    def report(self, window=False):
+        span = f'last {self.window_s}s' if window else 'total'
+        logger.info(f"Part Profile Summary: (times in ms, {span})")
         pt = PrettyTable()
-        field_names = ["part", "max", "min", "avg"]
-        pctile = [50, 90, 99, 99.9]
-        pt.field_names = field_names + [str(p) + '%' for p in pctile]
-        for p, val in self.records.items():
-            # remove first and last entry because you there could be one-off
-            # time spent in initialisations, and the latest diff could be
-            # incomplete because of user keyboard interrupt
-            arr = val['times'][1:-1]
-            if len(arr) == 0:
+        field_names = ["part", "count", "max", "min", "avg"]
+        pt.field_names = field_names + [f'{p}%' for p in PROFILE_PERCENTILES]
+        for p in self.records:
+            stats = self.stats(p, window)
+            if stats['count'] == 0:
                 continue
-            row = [p.__class__.__name__,
-                   "%.2f" % (max(arr) * 1000),
-                   "%.2f" % (min(arr) * 1000),
-                   "%.2f" % (sum(arr) / len(arr) * 1000)]
-            row += ["%.2f" % (np.percentile(arr, p) * 1000) for p in pctile]
+            row = [p.__class__.__name__, stats['count']]
+            row += ["%.2f" % stats[f] for f in pt.field_names[2:]]
             pt.add_row(row)
         logger.info('\n' + str(pt))
 
@@ -65,12 +114,25 @@ class Vehicle:
             mem = Memory()
         self.mem = mem
         self.parts = []
+        self.skipped_parts = []
         self.on = True
         self.threads = []
         self.profiler = PartProfiler()
+        self.executor = None
+        self.compiled_parts = None
+        self.scheduler = None
+        # freshness stamps of the channels, only kept if a part skips stale
+        # inputs
+        self.track_freshness = False
+        self.stamps = {}
+        self._stamp = 0
+        self.trace = None
+        self.trace_path = None
+        self.trace_threads = False
 
     def add(self, part, inputs=[], outputs=[],
-            threaded=False, run_condition=None):
+            threaded=False, run_condition=None, rate_hz=None, every_n=None,
+            skip_stale=False, process=False):
         """
         Method to add a part to the vehicle drive loop.
 
@@ -86,34 +148,162 @@ class Vehicle:
                 If a part should be run in a separate thread.
             run_condition : str
                 If a part should be run or not
+            rate_hz : float
+                If given, the part runs at most at this frequency instead
+                of on every tick of the drive loop.
+            every_n : int
+                If given, the part runs only on every n-th tick of the
+                drive loop. Mutually exclusive with rate_hz.
+            skip_stale : boolean
+                If the part should only run when at least one of its inputs
+                carries a new sample of a threaded part, e.g. to not run the
+                pilot twice on the same camera frame.
+            process : boolean
+                If the part should run in a child process, to use another
+                core. Numpy arrays are passed through shared memory. Combined
+                with threaded, the drive loop does not wait for the child.
         """
         assert type(inputs) is list, "inputs is not a list: %r" % inputs
         assert type(outputs) is list, "outputs is not a list: %r" % outputs
         assert type(threaded) is bool, "threaded is not a boolean: %r" % threaded
-
+        assert rate_hz is None or rate_hz > 0, \
+            "rate_hz is not positive: %r" % rate_hz
+        assert every_n is None or (type(every_n) is int and every_n > 0), \
+            "every_n is not a positive integer: %r" % every_n
+        assert rate_hz is None or every_n is None, \
+            "only one of rate_hz or every_n can be given"
+        assert type(process) is bool, "process is not a boolean: %r" % process
+
+        logger.info('Adding part {}.'.format(part.__class__.__name__))
+        if process:
+            part = ProcessPart(part, threaded=threaded)
         p = part
-        logger.info('Adding part {}.'.format(p.__class__.__name__))
         entry = {}
         entry['part'] = p
         entry['inputs'] = inputs
         entry['outputs'] = outputs
         entry['run_condition'] = run_condition
+        if rate_hz:
+            entry['period'] = 1.0 / rate_hz
+            entry['next_run'] = 0.0
+        if every_n:
+            entry['every_n'] = every_n
+            entry['tick'] = 0
+
+        if skip_stale:
+            entry['skip_stale'] = True
+            self.track_freshness = True
+        entry['input_stamp'] = -1
 
         if threaded:
-            t = Thread(target=part.update, args=())
+            t = Thread(target=part.update, args=(),
+                       name=f'{part.__class__.__name__}.update')
             t.daemon = True
             entry['thread'] = t
+            # Parts can publish their samples through a LatestValue, for all
+            # other threaded parts the vehicle publishes a new sample
+            # whenever run_threaded() returns different objects.
+            latest = getattr(part, 'latest', None)
+            entry['owns_latest'] = not isinstance(latest, LatestValue)
+            entry['latest'] = LatestValue() if entry['owns_latest'] else latest
+            entry['seen_seq'] = 0
+            entry['stamp'] = 0
 
         self.parts.append(entry)
         self.profiler.profile_part(part)
 
+    def enable_trace(self, capacity=100000, path=None, threads=False):
+        """
+        Record a trace of the drive loop, with each part call, skipped
+        parts and the sleep between ticks. The trace is Chrome trace JSON,
+        which can be opened in https://ui.perfetto.dev.
+
+        Parameters
+        ----------
+            capacity : int
+                Number of events kept in the ring buffer, older events are
+                overwritten.
+            path : str
+                If given, the trace is written to this file on shutdown.
+            threads : boolean
+                If the update() iterations of threaded parts are traced too.
+                An iteration ends when the part publishes a sample through
+                its LatestValue, like the cameras do.
+        """
+        self.trace = TraceRecorder(capacity)
+        self.trace_path = path
+        self.trace_threads = threads
+        self.profiler.trace = self.trace
+        return self.trace
+
+    def dump_trace(self, path=None):
+        """
+        Write the trace recorded so far to path, or to the path given in
+        enable_trace().
+        """
+        path = path or self.trace_path
+        if self.trace is None or not path:
+            raise ValueError("tracing is not enabled or no path given")
+        self.trace.dump(path)
+
+    def _trace_updates(self):
+        """
+        Record a trace event for each sample published by a threaded part,
+        spanning the time since its previous sample.
+        """
+        trace = self.trace
+        for entry in self.parts:
+            if not entry.get('thread') or entry['owns_latest']:
+                continue
+            name = f"{entry['part'].__class__.__name__}.update"
+            last = [time.perf_counter()]
+
+            def on_put(sample, name=name, last=last):
+                now = time.perf_counter()
+                trace.complete(name, 'update', last[0], now,
+                               {'seq': sample.seq})
+                last[0] = now
+
+            entry['latest'].on_put = on_put
+
+    def _trace_skip(self, entry, reason):
+        self.trace.instant(entry['part'].__class__.__name__, 'skip',
+                           args={'reason': reason})
+
+    def analyze(self):
+        """
+        Analyze the dataflow between the parts for unused outputs, inputs
+        which are never written, reads before writes and channels written
+        by several parts.
+
+        :return: PartGraphReport
+        """
+        return analyze_parts(self.parts, self.mem,
+                             LOOP_STATS_CHANNELS + LOOP_JITTER_CHANNELS)
+
+    def skip_unused_parts(self, report=None):
+        """
+        Take the parts out of the drive loop whose outputs are never read.
+        They are still shut down with the vehicle.
+        """
+        report = report or self.analyze()
+        unused = set(report.unused_parts)
+        for i in report.unused_parts:
+            logger.info(f"Skipping unused part "
+                        f"{self.parts[i]['part'].__class__.__name__}")
+        self.skipped_parts += [e for i, e in enumerate(self.parts)
+                               if i in unused]
+        self.parts = [e for i, e in enumerate(self.parts) if i not in unused]
+
     def remove(self, part):
         """
         remove part form list
         """
         self.parts.remove(part)
 
-    def start(self, rate_hz=10, max_loop_count=None, verbose=False):
+    def start(self, rate_hz=10, max_loop_count=None, verbose=False,
+              parallel=False, max_workers=None, compiled=False,
+              overrun='skip', spin_s=0.0, skip_unused=False):
         """
         Start vehicle's main drive loop.
 
@@ -132,12 +322,49 @@ class Vehicle:
             used for testing that all the parts of the vehicle work.
         verbose: bool
             If debug output should be printed into shell
+        parallel: bool
+            If independent parts, according to their inputs and outputs,
+            should run concurrently in a thread pool. The values and the
+            order of writes into memory are the same as in the serial loop.
+        max_workers: int
+            Number of threads for the parallel execution, defaults to the
+            largest number of independent parts.
+        compiled: bool
+            If the memory should be switched to integer slots and the parts
+            should read and write through precomputed slot accessors instead
+            of string keyed lookups on every tick.
+        overrun: str
+            What happens when a tick overruns its deadline: 'skip' drops the
+            missed ticks and stays on the time grid, 'catchup' runs missed
+            ticks back to back and 'stretch' starts a new time grid.
+        spin_s: float
+            Busy wait the last spin_s seconds before each deadline instead
+            of sleeping, for more accurate tick timing.
+        skip_unused: bool
+            If parts whose outputs are never read, also not through other
+            such parts, should be taken out of the loop. Parts without
+            outputs are always kept.
         """
 
         try:
 
             self.on = True
 
+            report = self.analyze()
+            report.log(self.parts)
+            if skip_unused:
+                self.skip_unused_parts(report)
+
+            if compiled:
+                self.compile()
+
+            if parallel:
+                self.executor = ParallelExecutor(self, max_workers)
+
+            trace = self.trace
+            if trace is not None and self.trace_threads:
+                self._trace_updates()
+
             for entry in self.parts:
                 if entry.get('thread'):
                     # start the update thread
@@ -146,32 +373,49 @@ class Vehicle:
             # wait until the parts warm up.
             logger.info('Starting vehicle at {} Hz'.format(rate_hz))
 
-            loop_start_time = time.time()
+            scheduler = LoopScheduler(rate_hz, overrun=overrun, spin_s=spin_s)
+            self.scheduler = scheduler
+            scheduler.start()
+            loop_start_time = time.monotonic()
             loop_count = 0
             while self.on:
-                start_time = time.time()
                 loop_count += 1
-
-                self.update_parts()
+                # refresh the jitter percentiles about once per second
+                self._publish_loop_stats(
+                    (loop_count - 1) % max(1, int(rate_hz)) == 0)
+
+                if trace is not None:
+                    tick_start = time.perf_counter()
+                    self.update_parts()
+                    trace.complete('tick', 'loop', tick_start,
+                                   time.perf_counter(), {'tick': loop_count})
+                else:
+                    self.update_parts()
 
                 # stop drive loop if loop_count exceeds max_loopcount
                 if max_loop_count and loop_count >= max_loop_count:
                     self.on = False
                 else:
-                    sleep_time = 1.0 / rate_hz - (time.time() - start_time)
-                    if sleep_time > 0.0:
-                        time.sleep(sleep_time)
+                    if trace is not None:
+                        sleep_start = time.perf_counter()
+                        overrun_time = scheduler.wait()
+                        trace.complete('sleep', 'loop', sleep_start,
+                                       time.perf_counter(),
+                                       {'tick': loop_count,
+                                        'overrun_ms': overrun_time * 1000})
                     else:
+                        overrun_time = scheduler.wait()
+                    if overrun_time > 0.0:
                         # print a message when could not maintain loop rate.
                         if verbose:
                             logger.info('WARN::Vehicle: jitter violation in vehicle loop '
-                                  'with {0:4.0f}ms'.format(abs(1000 * sleep_time)))
+                                  'with {0:4.0f}ms'.format(1000 * overrun_time))
 
                     if verbose and loop_count % 200 == 0:
-                        self.profiler.report()
+                        self.profiler.report(window=True)
 
 
-            loop_total_time = time.time() - loop_start_time
+            loop_total_time = time.monotonic() - loop_start_time
             logger.info(f"Vehicle executed {loop_count} steps in {loop_total_time} seconds.")
 
             return loop_count, loop_total_time
@@ -183,40 +427,200 @@ class Vehicle:
         finally:
             self.stop()
 
+    def _publish_loop_stats(self, with_percentiles):
+        """
+        Write the loop timing of the scheduler into memory, so parts can
+        read it.
+        """
+        scheduler = self.scheduler
+        self.mem.put(LOOP_STATS_CHANNELS,
+                     [scheduler.ticks, scheduler.missed,
+                      scheduler.last_jitter_ns * 1e-6])
+        if with_percentiles:
+            stats = scheduler.stats()
+            self.mem.put(LOOP_JITTER_CHANNELS,
+                         [stats['jitter_p50_ms'], stats['jitter_p99_ms']])
+
     def update_parts(self):
         '''
         loop over all parts
         '''
+        if self.executor:
+            self.executor.run()
+            return
+
+        if self.compiled_parts and not self.track_freshness:
+            self._update_compiled_parts()
+            return
+
         for entry in self.parts:
+            inputs = self._part_inputs(entry)
+            if inputs is not None:
+                outputs = self._run_part(entry, inputs)
+                self._write_outputs(entry, outputs)
 
-            run = True
+    def _part_inputs(self, entry):
+        """
+        Get the inputs of a part from memory, or None if the part does not
+        run in this tick because it is not due or its run condition is off.
+        """
+        # skip parts which are not due in this tick
+        if not self._is_due(entry):
+            return None
+
+        get_inputs = entry.get('get_inputs')
+        if get_inputs:
+            get_condition = entry['get_condition']
+            if get_condition and not get_condition()[0]:
+                if self.trace is not None:
+                    self._trace_skip(entry, 'run_condition')
+                return None
+        else:
             # check run condition, if it exists
-            if entry.get('run_condition'):
-                run_condition = entry.get('run_condition')
-                run = self.mem.get([run_condition])[0]
-            
-            if run:
-                # get part
-                p = entry['part']
-                # start timing part run
-                self.profiler.on_part_start(p)
-                # get inputs from memory
-                inputs = self.mem.get(entry['inputs'])
-                # run the part
-                if entry.get('thread'):
-                    outputs = p.run_threaded(*inputs)
-                else:
-                    outputs = p.run(*inputs)
+            run_condition = entry.get('run_condition')
+            if run_condition and not self.mem.get([run_condition])[0]:
+                if self.trace is not None:
+                    self._trace_skip(entry, 'run_condition')
+                return None
+
+        if self.track_freshness and not self._has_fresh_inputs(entry):
+            if self.trace is not None:
+                self._trace_skip(entry, 'stale')
+            return None
 
-                # save the output to memory
-                if outputs is not None:
-                    self.mem.put(entry['outputs'], outputs)
-                # finish timing part run
-                self.profiler.on_part_finished(p)
+        return get_inputs() if get_inputs else self.mem.get(entry['inputs'])
+
+    def _has_fresh_inputs(self, entry):
+        """
+        Remember the freshness stamp of the inputs of the part and check if
+        it changed since the last run. The stamp of a channel is the latest
+        stamp of the threaded part samples it was computed from.
+        """
+        stamps = self.stamps
+        stamp = max((stamps.get(channel, 0) for channel in entry['inputs']),
+                    default=0)
+        if entry.get('skip_stale') and stamp == entry['input_stamp']:
+            return False
+        entry['input_stamp'] = stamp
+        return True
+
+    def _stamp_outputs(self, entry, outputs):
+        """
+        Propagate freshness stamps to the output channels of the part. A
+        threaded part gets a new stamp when its sample sequence number
+        advances, other parts pass on the stamp of their inputs.
+        """
+        latest = entry.get('latest')
+        if latest is None:
+            stamp = entry['input_stamp']
+        else:
+            if entry['owns_latest'] \
+                    and not _same_objects(outputs, latest.value):
+                latest.put(outputs)
+            seq = latest.seq
+            if seq != entry['seen_seq']:
+                entry['seen_seq'] = seq
+                self._stamp += 1
+                entry['stamp'] = self._stamp
+            stamp = entry['stamp']
+        for channel in entry['outputs']:
+            self.stamps[channel] = stamp
+
+    def _run_part(self, entry, inputs):
+        """
+        Run the part with the given inputs and return its outputs.
+        """
+        p = entry['part']
+        # start timing part run
+        self.profiler.on_part_start(p)
+        # run the part
+        if entry.get('thread'):
+            outputs = p.run_threaded(*inputs)
+        else:
+            outputs = p.run(*inputs)
+        # finish timing part run
+        self.profiler.on_part_finished(p)
+        return outputs
+
+    def _write_outputs(self, entry, outputs):
+        # save the output to memory
+        if outputs is not None:
+            if self.track_freshness:
+                self._stamp_outputs(entry, outputs)
+            put_outputs = entry.get('put_outputs')
+            if put_outputs:
+                put_outputs(outputs)
+            else:
+                self.mem.put(entry['outputs'], outputs)
+
+    def compile(self):
+        """
+        Resolve all channel names of the parts to slots in the memory and
+        precompute the accessors of each part. The memory API keeps working
+        for parts which read or write the memory directly.
+        """
+        store = self.mem.compile()
+        self.compiled_parts = []
+        for entry in self.parts:
+            p = entry['part']
+            run_condition = entry.get('run_condition')
+            entry['get_inputs'] = store.getter(entry['inputs'])
+            entry['put_outputs'] = store.setter(entry['outputs'])
+            entry['get_condition'] = \
+                store.getter([run_condition]) if run_condition else None
+            run = p.run_threaded if entry.get('thread') else p.run
+            scheduled = 'every_n' in entry or 'period' in entry
+            self.compiled_parts.append(
+                (entry, p, run, scheduled, entry['get_condition'],
+                 entry['get_inputs'], entry['put_outputs']))
+        logger.info(f'Compiled {len(self.parts)} parts into {len(store)} '
+                    f'memory slots')
+
+    def _update_compiled_parts(self):
+        profiler = self.profiler
+        is_due = self._is_due
+        for entry, p, run, scheduled, get_condition, get_inputs, \
+                put_outputs in self.compiled_parts:
+            if scheduled and not is_due(entry):
+                continue
+            if get_condition and not get_condition()[0]:
+                if self.trace is not None:
+                    self._trace_skip(entry, 'run_condition')
+                continue
+            inputs = get_inputs()
+            profiler.on_part_start(p)
+            outputs = run(*inputs)
+            profiler.on_part_finished(p)
+            if outputs is not None:
+                put_outputs(outputs)
+
+    @staticmethod
+    def _is_due(entry):
+        """
+        Check if a part runs in the current tick, given its optional
+        every_n or rate_hz cadence.
+        """
+        every_n = entry.get('every_n')
+        if every_n:
+            tick = entry['tick']
+            entry['tick'] = tick + 1
+            return tick % every_n == 0
+
+        period = entry.get('period')
+        if period:
+            now = time.monotonic()
+            if now < entry['next_run']:
+                return False
+            # schedule from the previous deadline to keep the cadence, but
+            # don't try to catch up if the part fell behind by a full period
+            next_run = entry['next_run'] + period
+            entry['next_run'] = next_run if next_run > now else now + period
+
+        return True
 
     def stop(self):        
         logger.info('Shutting down vehicle and its parts...')
-        for entry in self.parts:
+        for entry in self.parts + self.skipped_parts:
             try:
                 entry['part'].shutdown()
             except AttributeError:
@@ -225,4 +629,14 @@ class Vehicle:
             except Exception as e:
                 logger.error(e)
 
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
         self.profiler.report()
+
+        if self.trace is not None and self.trace_path:
+            try:
+                self.trace.dump(self.trace_path)
+            except Exception as e:
+                logger.error(f'Could not write trace: {e}')
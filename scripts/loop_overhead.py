@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Micro benchmark of the per tick overhead of the vehicle loop. Builds a
+vehicle with many trivial parts, similar in number and wiring to what the
+complete template creates, and compares the plain and the compiled memory.
+
+Usage:
+    loop_overhead.py [--parts=<n>] [--ticks=<n>]
+
+Options:
+    -h --help        Show this screen.
+    --parts=<n>      Number of parts in the vehicle [default: 60]
+    --ticks=<n>      Number of ticks to time [default: 20000]
+"""
+import time
+from docopt import docopt
+import donkeycar as dk
+from donkeycar.parts.transform import Lambda
+
+
+def build_vehicle(num_parts):
+    v = dk.Vehicle()
+    for i in range(num_parts):
+        # chain of parts with a mix of zero, one and two in- and outputs
+        if i % 3 == 0:
+            v.add(Lambda(lambda: 1), outputs=[f'ch/{i}'])
+        elif i % 3 == 1:
+            v.add(Lambda(lambda x: x), inputs=[f'ch/{i - 1}'],
+                  outputs=[f'ch/{i}'])
+        else:
+            v.add(Lambda(lambda x, y: (y, x)),
+                  inputs=[f'ch/{i - 2}', f'ch/{i - 1}'],
+                  outputs=[f'ch/{i}', f'ch/{i}/b'],
+                  run_condition=f'ch/{i - 2}')
+    return v
+
+
+def time_ticks(v, ticks):
+    start = time.perf_counter()
+    for _ in range(ticks):
+        v.update_parts()
+    return (time.perf_counter() - start) / ticks
+
+
+def benchmark(num_parts, ticks):
+    plain = build_vehicle(num_parts)
+    compiled = build_vehicle(num_parts)
+    compiled.compile()
+    # warm up
+    time_ticks(plain, 100)
+    time_ticks(compiled, 100)
+    t_plain = time_ticks(plain, ticks)
+    t_compiled = time_ticks(compiled, ticks)
+    print(f'{num_parts} parts, {ticks} ticks')
+    print(f'plain memory:    {t_plain * 1e6:8.1f} us/tick')
+    print(f'compiled memory: {t_compiled * 1e6:8.1f} us/tick')
+    print(f'speedup:         {t_plain / t_compiled:8.2f}x')
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    benchmark(int(args['--parts']), int(args['--ticks']))